@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import User, Story, ReadingSession, Student, Class
+from .models import User, Story, ReadingSession, Student, Class, MatchJob
 
 admin.site.register(User)
 admin.site.register(Story)
 admin.site.register(ReadingSession)
 admin.site.register(Student)
-admin.site.register(Class)
\ No newline at end of file
+admin.site.register(Class)
+admin.site.register(MatchJob)
\ No newline at end of file
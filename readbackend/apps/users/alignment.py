@@ -0,0 +1,107 @@
+'''Word-level scoring - one CTC forced alignment of a reading against the expected phonemes of each word
+
+The recognizer's log-probabilities are aligned (Viterbi) to the expected phonemes, encoded with the shared phoneme
+vocabulary (see phoneme_vocab). Each word then gets the frames its phonemes were aligned to, which give its timing,
+and a goodness-of-pronunciation score: how close the expected phoneme's probability is to the most likely token on
+those frames (1.0 = it was the model's best guess).
+'''
+
+import re
+
+import numpy as np
+from django.conf import settings
+
+from .audio_processing import text_to_phonemes
+
+# Function to split matching_text into words paired with their expected phonemes
+# Uses the sentence's phonemes when espeak kept one phoneme word per text word, otherwise phonemizes each word
+def word_phonemes(matching_text: str, text_phonemes: str, language: str = None):
+    words = matching_text.split()
+    phoneme_words = text_phonemes.split()
+    if len(phoneme_words) != len(words):
+        phoneme_words = [text_to_phonemes(re.sub(r'[^\w\'-]', '', word) or word, language) for word in words]
+    return list(zip(words, phoneme_words))
+
+
+# Function to tell whether a word is anything a reader could misread - words without a letter or digit (dashes,
+# ellipses) are skipped; a real word that phonemized to nothing (espeak missing or failing, an unknown voice) is not
+def is_readable(word: str) -> bool:
+    return re.search(r'[^\W_]', word) is not None
+
+
+# Function to find the most likely CTC path of `tokens` through log_probs (frames, vocab)
+# Returns, for each frame, the index of the token it was aligned to (-1 for blank), or None if the clip has too few
+# frames to emit every token
+def forced_align(log_probs, tokens, blank_id):
+    num_frames = len(log_probs)
+    if not tokens or num_frames == 0:
+        return None
+
+    # Extended label sequence: blank, t1, blank, t2, ..., tn, blank
+    labels = np.full(2 * len(tokens) + 1, blank_id)
+    labels[1::2] = tokens
+    num_states = len(labels)
+    # A token may be entered straight from the previous token (skipping the blank between) unless they're the same
+    can_skip = np.zeros(num_states, dtype=bool)
+    can_skip[3::2] = labels[3::2] != labels[1:-2:2]
+
+    scores = np.full(num_states, -np.inf)
+    scores[:2] = log_probs[0, labels[:2]]
+    backpointers = np.zeros((num_frames, num_states), dtype=np.int8)
+    for frame in range(1, num_frames):
+        stay = scores
+        advance = np.concatenate([[-np.inf], scores[:-1]])
+        skip = np.where(can_skip, np.concatenate([[-np.inf, -np.inf], scores[:-2]]), -np.inf)
+        candidates = np.stack([stay, advance, skip])
+        backpointers[frame] = candidates.argmax(axis=0)
+        scores = candidates.max(axis=0) + log_probs[frame, labels]
+
+    state = num_states - 1 if scores[-1] >= scores[-2] else num_states - 2
+    if not np.isfinite(scores[state]):
+        return None
+
+    path = np.empty(num_frames, dtype=np.int64)
+    for frame in range(num_frames - 1, -1, -1):
+        path[frame] = state
+        state -= backpointers[frame, state]
+    return np.where(path % 2 == 1, path // 2, -1)
+
+
+# Function to score each word of a reading from its CTC log-probabilities (frames, vocab) in one alignment pass
+# Returns [{"index", "word", "start", "end", "score", "correct"}], times in seconds from the start of the clip inference
+# ran on (i.e. after silence trimming)
+def score_words(log_probs, words, vocab, frame_seconds):
+    word_tokens = [vocab.encode(phonemes).tolist() for _, phonemes in words]
+    tokens = [token for token_ids in word_tokens for token in token_ids]
+    token_word = np.array([index for index, token_ids in enumerate(word_tokens) for _ in token_ids], dtype=np.int64)
+
+    alignment = forced_align(log_probs, tokens, vocab.blank_id)
+    # Goodness of pronunciation per frame: expected token's log-probability relative to the best token's
+    if alignment is not None:
+        aligned = alignment >= 0
+        frames = np.flatnonzero(aligned)
+        frame_words = token_word[alignment[aligned]]
+        expected = log_probs[frames, np.asarray(tokens)[alignment[aligned]]]
+        frame_scores = np.exp(expected - log_probs[frames].max(axis=-1))
+
+    results = []
+    for index, (word, _) in enumerate(words):
+        result = {'index': index, 'word': word, 'start': None, 'end': None, 'score': None, 'correct': True}
+        if not word_tokens[index]:
+            if is_readable(word):
+                result.update(correct=False)  # Its phonemes are missing - it can't be scored, so it can't pass
+            results.append(result)  # Otherwise nothing the model can emit (e.g. punctuation only) - can't be misread
+            continue
+
+        in_word = frame_words == index if alignment is not None else None
+        if in_word is None or not in_word.any():
+            result.update(score=0.0, correct=False)
+        else:
+            word_frames = frames[in_word]
+            score = float(frame_scores[in_word].mean())
+            result.update(
+                start=round(word_frames[0] * frame_seconds, 3), end=round((word_frames[-1] + 1) * frame_seconds, 3),
+                score=round(score, 3), correct=score >= settings.WORD_SCORE_THRESHOLD,
+            )
+        results.append(result)
+    return results
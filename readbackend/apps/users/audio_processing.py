@@ -1,23 +1,80 @@
-import torch
-import librosa
-from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
 import subprocess
 import io
 import re
-from difflib import SequenceMatcher
-import Levenshtein
+import threading
+from functools import lru_cache, partial
+import numpy as np
+from rapidfuzz.distance import Indel, Levenshtein
+from django.conf import settings
+from .recognizer import get_recognizer, get_processor, model_for_language
+from .inference import BatchingScheduler
+from .inference_pool import PoolClient
+from . import metrics
+from .phoneme_vocab import get_vocab
+from .vad import trim_silence, NoSpeechDetected
 
-model_name = "facebook/wav2vec2-xlsr-53-espeak-cv-ft" #facebook/wav2vec2-lv-60-espeak-cv-ft seems to transcribe more accurately -- Still need to work on alignment either way
-model = Wav2Vec2ForCTC.from_pretrained(model_name)
-processor = Wav2Vec2Processor.from_pretrained(model_name)
+SAMPLE_RATE = 16000  # Sample rate expected by the Wav2Vec2 models
+FRAME_SECONDS = 0.02  # Duration of one CTC logit frame (the wav2vec2 feature encoder's stride, 320 samples at 16 kHz)
+LEVENSHTEIN_TOLERANCE = 0.25  # Fraction of the expected phonemes that may differ for a reading to count as a match
+
+
+class AudioTooLong(ValueError):
+    pass
+
+
+class PhonemizerUnavailable(RuntimeError):
+    pass
+
+
+class _NoPhonemes(Exception):
+    pass
+
+
+_schedulers = {}  # Model name -> micro-batching scheduler
+_pool_client = None
+_inference_lock = threading.Lock()
+_phoneme_caches = {}  # Reading language -> LRU-cached espeak-ng phonemizer for its voice
 
 
 # Function to convert text to phonemes using eSpeak
-def text_to_phonemes(text: str, language: str = "en-us") -> str:
-    command = ['espeak-ng', f'-v{language}', '--ipa=1', '-q', text]
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+# language is a reading language (READING_DEFAULT_LANGUAGE by default), mapped to its espeak voice by ESPEAK_VOICES
+# Each language has its own bounded LRU in front of espeak-ng for ad-hoc text, so one language's traffic can't evict
+# another's - story sentences are normally served from the story's phoneme index
+# Empty results and failures are never cached, so a transient espeak-ng error isn't remembered for the process's life
+# Raises PhonemizerUnavailable if espeak-ng is missing or fails
+def text_to_phonemes(text: str, language: str = None) -> str:
+    language = language or settings.READING_DEFAULT_LANGUAGE
+    phonemizer = _phoneme_caches.get(language)
+    if phonemizer is None:
+        with _inference_lock:
+            phonemizer = _phoneme_caches.get(language)
+            if phonemizer is None:
+                voice = settings.ESPEAK_VOICES.get(language, language)
+                phonemizer = _phoneme_caches[language] = lru_cache(maxsize=settings.PHONEME_CACHE_SIZE)(
+                    partial(_cached_phonemes, voice=voice)
+                )
+    try:
+        return phonemizer(text)
+    except _NoPhonemes:
+        return ''
+
+# lru_cache doesn't store exceptions - raising on empty output keeps it out of the cache
+def _cached_phonemes(text: str, voice: str) -> str:
+    phonemes = _espeak_phonemes(text, voice)
+    if not phonemes:
+        raise _NoPhonemes()
+    return phonemes
+
+def _espeak_phonemes(text: str, voice: str) -> str:
+    command = ['espeak-ng', f'-v{voice}', '--ipa=1', '-q', text]
+    try:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise PhonemizerUnavailable(f'espeak-ng could not be run: {e}') from e
     output, error = process.communicate()
 
+    if process.returncode != 0:
+        raise PhonemizerUnavailable(f"espeak-ng failed: {error.decode('utf-8').strip()}")
     if error:
         print("Error in eSpeak execution:", error.decode("utf-8"))
     phonemes = output.decode("utf-8").strip()
@@ -26,16 +83,210 @@ def text_to_phonemes(text: str, language: str = "en-us") -> str:
 
 # Function to convert audio file to text using Wav2Vec2 and then to phonemes using eSpeak
 def audio_to_phonemes(audio_file) -> str:
-    wav_file = convert_audio_to_wav(audio_file)
-    waveform, _ = librosa.load(io.BytesIO(wav_file.read()), sr=16000)
-    input_values = processor(waveform, return_tensors="pt", sampling_rate=16000).input_values
-    with torch.no_grad():
-        logits = model(input_values).logits
-    predicted_ids = torch.argmax(logits, dim=-1)
-    transcription = processor.batch_decode(predicted_ids)[0]
+    return logits_to_phonemes(audio_to_logits(audio_file))
+
+# Function to decode an uploaded clip, trim its silence and compute its CTC log-probabilities (frames, vocab)
+def audio_to_logits(audio_file):
+    return waveform_to_logits(audio_to_waveform(audio_file))
+
+# Function to decode an uploaded clip to the waveform inference runs on (silence trimmed)
+def audio_to_waveform(audio_file):
+    waveform = decode_audio(audio_file)
+    if settings.VAD_ENABLED:
+        waveform = trim_waveform(waveform)
+    return waveform
+
+# Function to cut silence from a decoded clip before inference, recording how much audio (compute) was saved
+# Raises NoSpeechDetected for (near) silent clips so they're rejected before reaching the model
+def trim_waveform(waveform):
+    original_seconds = len(waveform) / SAMPLE_RATE
+    try:
+        trimmed = trim_silence(waveform, SAMPLE_RATE)
+    except NoSpeechDetected:
+        metrics.increment('vad_rejected_clips')
+        raise
+    trimmed_seconds = len(trimmed) / SAMPLE_RATE
+
+    metrics.increment('vad_original_seconds', original_seconds)
+    metrics.increment('vad_trimmed_seconds', trimmed_seconds)
+    print(f"Trimmed silence: {original_seconds:.2f}s -> {trimmed_seconds:.2f}s")
+    return trimmed
+
+# Function to transcribe a 16 kHz mono float32 waveform to phonemes using Wav2Vec2
+def waveform_to_phonemes(waveform) -> str:
+    return logits_to_phonemes(waveform_to_logits(waveform))
+
+# Function to compute the CTC log-probabilities (frames, vocab) of a 16 kHz mono float32 waveform
+# model_name picks the recognizer model (RECOGNIZER_MODEL_NAME by default)
+# With INFERENCE_BATCHING on, concurrent requests are micro-batched into a single forward pass
+def waveform_to_logits(waveform, model_name=None):
+    if settings.INFERENCE_BATCHING:
+        return get_scheduler(model_name).infer(waveform)
+    return run_batch([waveform], model_name)[0]
+
+# Function to transcribe a waveform to timed words with a word-transcribing backend (RECOGNIZER_BACKEND = 'whisper')
+# Runs in this process - the micro-batching scheduler and the inference pool only serve CTC backends
+def waveform_to_words(waveform, language=None) -> list:
+    metrics.increment('inference_clips')
+    words = get_recognizer().transcribe(waveform, language)
+    print("Audio Transcription:", ' '.join(word for word, _, _, _ in words))
+    return words
+
+# Function to greedily decode CTC log-probabilities to a phoneme string
+# Only needs the processor, so processes that hand inference to the worker pool never load the model
+def logits_to_phonemes(logits, model_name=None) -> str:
+    transcription = get_processor(model_name).decode(logits.argmax(axis=-1).tolist())
     print("Audio Transcription:", transcription)
     return transcription
 
+# Function to run a batch through the inference worker pool if one is configured, otherwise in this process
+def run_batch(waveforms, model_name=None) -> list:
+    metrics.increment('inference_batches')
+    metrics.increment('inference_clips', len(waveforms))
+    if settings.INFERENCE_POOL_ADDRESS:
+        return get_pool_client().infer(waveforms, model_name)
+    return batch_logits(waveforms, get_recognizer(model_name))
+
+# Function to score a clip in a reading language with the language's model, through the two-tier recognizer cascade
+# (RECOGNIZER_CASCADE, which only covers READING_DEFAULT_LANGUAGE)
+# score(log_probs, model_name) is run on the fast model's output first; the full model only runs when the fast model
+# wasn't confident (mean CTC confidence below RECOGNIZER_CASCADE_MIN_CONFIDENCE) or is_uncertain(result) says its
+# result is too close to the decision threshold. Returns the result of the tier that decided
+def cascade(waveform, score, is_uncertain, language=None):
+    language = language or settings.READING_DEFAULT_LANGUAGE
+    if settings.RECOGNIZER_CASCADE and language == settings.READING_DEFAULT_LANGUAGE:
+        fast_model = settings.RECOGNIZER_FAST_MODEL_NAME
+        log_probs = waveform_to_logits(waveform, fast_model)
+        result = score(log_probs, fast_model)
+        confidence = ctc_confidence(log_probs, get_vocab(fast_model).blank_id)
+        if confidence >= settings.RECOGNIZER_CASCADE_MIN_CONFIDENCE and not is_uncertain(result):
+            metrics.increment('cascade_fast_decisions')
+            return result
+        print(f"Cascade: escalating to the full model (confidence {confidence:.2f})")
+        metrics.increment('cascade_full_decisions')
+
+    model_name = model_for_language(language)
+    return score(waveform_to_logits(waveform, model_name), model_name)
+
+# Function to measure how sure the model is of its transcription: mean probability of the best token over the frames
+# where that token isn't the blank (0 if it emitted nothing)
+def ctc_confidence(log_probs, blank_id) -> float:
+    best = log_probs.max(axis=-1)
+    emitted = log_probs.argmax(axis=-1) != blank_id
+    if not emitted.any():
+        return 0.0
+    return float(np.exp(best[emitted]).mean())
+
+# Function to transcribe a batch of waveforms in one padded forward pass (with this process's recognizer by default)
+def transcribe_batch(waveforms, recognizer=None) -> list:
+    recognizer = recognizer or get_recognizer()
+    return [recognizer.processor.decode(logits.argmax(axis=-1).tolist()) for logits in batch_logits(waveforms, recognizer)]
+
+# Function to compute the CTC log-probabilities of a batch of waveforms: one (frames, vocab) array per clip
+# Short clips share one padded forward pass; clips longer than RECOGNIZER_CHUNK_SECONDS are run chunk by chunk instead
+# Models without an attention mask (group-norm feature extractors) treat padding as audio and give a different result
+# for a padded clip, so their clips are only batched with clips of the same length
+def batch_logits(waveforms, recognizer=None) -> list:
+    recognizer = recognizer or get_recognizer()
+    max_samples = int(settings.RECOGNIZER_CHUNK_SECONDS * SAMPLE_RATE)
+    results = [None] * len(waveforms)
+
+    short = [i for i, waveform in enumerate(waveforms) if len(waveform) <= max_samples]
+    if recognizer.uses_attention_mask:
+        batches = [short] if short else []
+    else:
+        same_length = {}
+        for i in short:
+            same_length.setdefault(len(waveforms[i]), []).append(i)
+        batches = list(same_length.values())
+
+    for batch in batches:
+        inputs = recognizer.processor(
+            [waveforms[i] for i in batch], return_tensors="np", sampling_rate=SAMPLE_RATE, padding=True,
+            return_attention_mask=recognizer.uses_attention_mask,
+        )
+        logits = recognizer.forward(inputs.input_values, inputs.get('attention_mask'))
+
+        # Drop the frames that only cover padding
+        lengths = recognizer.output_lengths(np.array([len(waveforms[i]) for i in batch]))
+        for i, clip_logits, length in zip(batch, logits, lengths):
+            results[i] = log_softmax(clip_logits[:length])
+
+    for i, waveform in enumerate(waveforms):
+        if results[i] is None:
+            results[i] = log_softmax(chunked_logits(waveform, recognizer))
+    return results
+
+def log_softmax(logits):
+    logits = logits - logits.max(axis=-1, keepdims=True)
+    return (logits - np.log(np.exp(logits).sum(axis=-1, keepdims=True))).astype(np.float32, copy=False)
+
+# Function to compute the CTC logits of a long waveform over overlapping windows, so memory doesn't grow with length
+# Each window is RECOGNIZER_CHUNK_SECONDS long and overlaps its neighbours by RECOGNIZER_CHUNK_OVERLAP_SECONDS on each
+# side; only the frames from the middle of each window (which saw context on both sides) are kept and concatenated
+def chunked_logits(waveform, recognizer=None):
+    recognizer = recognizer or get_recognizer()
+    hop = int(np.prod(recognizer.config.conv_stride))  # Samples per logit frame
+    chunk = int(settings.RECOGNIZER_CHUNK_SECONDS * SAMPLE_RATE) // hop * hop
+    overlap = int(settings.RECOGNIZER_CHUNK_OVERLAP_SECONDS * SAMPLE_RATE) // hop * hop
+    step = chunk - 2 * overlap
+    if step <= 0:
+        raise ValueError('RECOGNIZER_CHUNK_OVERLAP_SECONDS must be less than half of RECOGNIZER_CHUNK_SECONDS')
+
+    pieces = []
+    start = 0
+    while start < len(waveform):
+        end = start + step
+        if len(waveform) - end < 2 * hop:  # Fold a tail too short to run through the model into this window
+            end = len(waveform)
+        window_start = max(0, start - overlap)
+        window_end = min(len(waveform), end + overlap)
+
+        logits = waveform_logits(waveform[window_start:window_end], recognizer)
+        first = (start - window_start) // hop
+        last = len(logits) if end >= len(waveform) else (end - window_start) // hop
+        pieces.append(logits[first:last])
+        start = end
+
+    metrics.increment('inference_chunks', len(pieces))
+    return np.concatenate(pieces)
+
+# Function to return this process's connection to the inference worker pool
+def get_pool_client():
+    global _pool_client
+
+    if _pool_client is None:
+        with _inference_lock:
+            if _pool_client is None:
+                _pool_client = PoolClient(
+                    settings.INFERENCE_POOL_ADDRESS, settings.INFERENCE_POOL_AUTHKEY.encode(),
+                    timeout=settings.INFERENCE_POOL_TIMEOUT,
+                )
+    return _pool_client
+
+# Function to compute the CTC logits (frames, vocab) of a single waveform
+def waveform_logits(waveform, recognizer=None):
+    recognizer = recognizer or get_recognizer()
+    inputs = recognizer.processor(
+        waveform, return_tensors="np", sampling_rate=SAMPLE_RATE, return_attention_mask=recognizer.uses_attention_mask,
+    )
+    return recognizer.forward(inputs.input_values, inputs.get('attention_mask'))[0]
+
+# Function to return this process's micro-batching scheduler for a model, starting it on first use
+def get_scheduler(model_name=None):
+    model_name = model_name or settings.RECOGNIZER_MODEL_NAME
+    scheduler = _schedulers.get(model_name)
+    if scheduler is None:
+        with _inference_lock:
+            scheduler = _schedulers.get(model_name)
+            if scheduler is None:
+                scheduler = _schedulers[model_name] = BatchingScheduler(
+                    lambda waveforms: run_batch(waveforms, model_name),
+                    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+                )
+    return scheduler
+
 # Function to clean and normalize phoneme strings
 def normalize_phonemes(phonemes: str) -> str:
     # Remove non-phoneme characters and normalize whitespace
@@ -45,21 +296,23 @@ def normalize_phonemes(phonemes: str) -> str:
     return phonemes
 
 # Function to compare phoneme strings
-def compare_phonemes(audio_file, text: str) -> bool:
-    # Convert audio to text and then to phonemes
-    audio_transcription = audio_to_phonemes(audio_file)
-    # Convert text to phonemes
-    text_phonemes = text_to_phonemes(text)
-    # Normalize and map phonemes
-    normalized_audio_phonemes = normalize_phonemes(audio_transcription)
-    normalized_text_phonemes = normalize_phonemes(text_phonemes)
-    print("Normalized Audio Phonemes:", normalized_audio_phonemes)
-    print("Normalized Text Phonemes:", normalized_text_phonemes)
-    # Compare normalized phonemes
-    answer = (normalized_audio_phonemes == normalized_text_phonemes)
+def compare_phonemes(audio_file, text: str, text_phonemes: str = None, language: str = None) -> bool:
+    audio_ids, text_ids = phoneme_ids(audio_file, text, text_phonemes, language)
+    # Compare the phoneme id sequences
+    answer = np.array_equal(audio_ids, text_ids)
     print("Phoneme Comparison Result:", answer)
     return answer
 
+# Function to recognize audio_file and encode both it and the expected phonemes of text with the shared phoneme vocabulary
+def phoneme_ids(audio_file, text: str, text_phonemes: str = None, language: str = None):
+    model_name = model_for_language(language)
+    vocab = get_vocab(model_name)
+    audio_ids = vocab.recognized(waveform_to_logits(audio_to_waveform(audio_file), model_name))
+    # Convert text to phonemes (unless already looked up in the story's phoneme index)
+    if text_phonemes is None:
+        text_phonemes = text_to_phonemes(text, language)
+    return audio_ids, vocab.encode(text_phonemes)
+
 
 # Function to convert audio_file from webm (as received) to Wav (as needed by Librosa)
 def convert_audio_to_wav(audio_file):
@@ -80,34 +333,107 @@ def convert_audio_to_wav(audio_file):
     output_audio.seek(0)  # Reset buffer position to the beginning
     return output_audio
 
-# Function to compare phonemes with a tolerance using SequenceMatcher
-def compare_phonemes_with_sequence_matcher(audio_file, text: str, threshold=0.75) -> bool:  # 0.75 is a little generous, but might be necessary
-    audio_transcription = audio_to_phonemes(audio_file)
-    text_phonemes = text_to_phonemes(text)
-    normalized_audio_phonemes = normalize_phonemes(audio_transcription)
-    normalized_text_phonemes = normalize_phonemes(text_phonemes)
-    print("Normalized Audio Phonemes:", normalized_audio_phonemes)
-    print("Normalized Text Phonemes:", normalized_text_phonemes)
-    matcher = SequenceMatcher(None, normalized_audio_phonemes, normalized_text_phonemes)
-    similarity = matcher.ratio()
+# Function to decode an uploaded clip (webm/opus as received) straight to a 16 kHz mono float32 NumPy array
+# Decodes in-process with PyAV and resamples with soxr; the ffmpeg subprocess is only used if that fails
+# Raises AudioTooLong as soon as the clip runs past AUDIO_MAX_SECONDS, without decoding the rest
+def decode_audio(audio_file):
+    try:
+        return _decode_with_pyav(audio_file)
+    except AudioTooLong:
+        raise
+    except Exception as e:
+        print("In-process decoding failed, falling back to ffmpeg:", e)
+        audio_file.seek(0)
+        return _decode_with_ffmpeg(audio_file)
+
+def _decode_with_pyav(audio_file):
+    import av
+    import soxr
+
+    # Uploads spooled to disk are opened by path; in-memory uploads are read directly as file objects
+    source = audio_file.temporary_file_path() if hasattr(audio_file, 'temporary_file_path') else audio_file
+    chunks = []
+    num_samples = 0
+    sample_rate = None
+    with av.open(source) as container:
+        stream = container.streams.audio[0]
+        # Downmix to mono float32 at the native rate - soxr does the rate conversion below
+        resampler = av.AudioResampler(format='flt', layout='mono')
+        for frame in container.decode(stream):
+            sample_rate = sample_rate or frame.sample_rate
+            for resampled in resampler.resample(frame):
+                chunks.append(resampled.to_ndarray()[0])
+                num_samples += len(chunks[-1])
+            if num_samples > settings.AUDIO_MAX_SECONDS * sample_rate:
+                raise AudioTooLong(f'Recording is longer than {settings.AUDIO_MAX_SECONDS} seconds')
+        for resampled in resampler.resample(None):
+            chunks.append(resampled.to_ndarray()[0])
+
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    waveform = np.concatenate(chunks)
+    if sample_rate != SAMPLE_RATE:
+        waveform = soxr.resample(waveform, sample_rate, SAMPLE_RATE, quality='HQ')
+    return waveform.astype(np.float32, copy=False)
+
+def _decode_with_ffmpeg(audio_file):
+    # Have ffmpeg emit raw 16 kHz mono float32 samples so no WAV parsing / further resampling is needed
+    command = [
+        'ffmpeg', '-i', 'pipe:0', '-t', str(settings.AUDIO_MAX_SECONDS + 1),
+        '-f', 'f32le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'
+    ]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = process.communicate(input=audio_file.read())
+
+    if process.returncode != 0:
+        raise RuntimeError(f'ffmpeg error: {stderr.decode()}')
+
+    waveform = np.frombuffer(stdout, dtype=np.float32)
+    if len(waveform) > settings.AUDIO_MAX_SECONDS * SAMPLE_RATE:
+        raise AudioTooLong(f'Recording is longer than {settings.AUDIO_MAX_SECONDS} seconds')
+    return waveform
+
+# Function to compare phonemes with a tolerance using an Indel (SequenceMatcher-style) ratio
+def compare_phonemes_with_sequence_matcher(audio_file, text: str, threshold=0.75, text_phonemes: str = None, language: str = None) -> bool:  # 0.75 is a little generous, but might be necessary
+    audio_ids, text_ids = phoneme_ids(audio_file, text, text_phonemes, language)
+    similarity = Indel.normalized_similarity(audio_ids, text_ids)
     print(f"SequenceMatcher Similarity: {similarity}")
     return similarity >= threshold
 
 # Function to compare phonemes with a tolerance using Levenshtein distance
-def compare_phonemes_with_levenshtein(audio_file, text: str, tolerance=0.25) -> bool:
-    audio_transcription = audio_to_phonemes(audio_file)
-    text_phonemes = text_to_phonemes(text)
-    normalized_audio_phonemes = normalize_phonemes(audio_transcription)
-    normalized_text_phonemes = normalize_phonemes(text_phonemes)
-    print("Normalized Audio Phonemes:", normalized_audio_phonemes)
-    print("Normalized Text Phonemes:", normalized_text_phonemes)
-    
-    # Calculate Levenshtein Distance
-    distance = Levenshtein.distance(normalized_audio_phonemes, normalized_text_phonemes)
-    max_len = max(len(normalized_audio_phonemes), len(normalized_text_phonemes))
-    
+def compare_phonemes_with_levenshtein(audio_file, text: str, tolerance=LEVENSHTEIN_TOLERANCE, text_phonemes: str = None, language: str = None) -> bool:
+    waveform = audio_to_waveform(audio_file)
+    if text_phonemes is None:
+        text_phonemes = text_to_phonemes(text, language)
+
+    def score(log_probs, model_name):
+        return phoneme_similarity(log_probs, text_phonemes, model_name)
+
+    # The fast tier decides unless its similarity is within RECOGNIZER_CASCADE_MARGIN of the threshold
+    threshold = 1 - tolerance
+    margin = settings.RECOGNIZER_CASCADE_MARGIN
+    similarity = cascade(waveform, score, lambda similarity: abs(similarity - threshold) < margin, language)
     # Determine if distance is within tolerance
+    return similarity >= threshold
+
+# Function to score a model's CTC log-probabilities against the expected phonemes (see levenshtein_similarity)
+def phoneme_similarity(log_probs, text_phonemes: str, model_name=None) -> float:
+    vocab = get_vocab(model_name)
+    text_ids = vocab.encode(text_phonemes)
+    if len(text_ids) == 0:
+        return 0.0  # Phonemization failed (espeak missing or an unknown voice) - nothing to read correctly
+    return levenshtein_similarity(vocab.recognized(log_probs), text_ids)
+
+# Function to score recognized phoneme ids against the expected ones: 1 - normalized Levenshtein distance
+# Works on phoneme ids (see phoneme_vocab), so a multi-character phoneme is a single edit
+def levenshtein_similarity(audio_ids, text_ids) -> float:
+    # Calculate Levenshtein Distance
+    distance = Levenshtein.distance(audio_ids, text_ids)
+    max_len = max(len(audio_ids), len(text_ids))
+    if max_len == 0:
+        return 1.0
+
     similarity = 1 - (distance / max_len)
     print(f"Levenshtein Distance: {distance}")
     print(f"Similarity: {similarity}")
-    return similarity >= (1 - tolerance)
\ No newline at end of file
+    return similarity
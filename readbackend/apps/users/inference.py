@@ -0,0 +1,91 @@
+'''Inference scheduling - dynamic micro-batching of concurrent recognition requests'''
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingScheduler:
+    """
+    Collects requests that arrive within max_wait_ms of each other into padded batches (up to max_batch_size)
+    and runs them through run_batch in one forward pass, handing each caller back its own result.
+
+    Requests are bucketed by length before batching so short clips aren't padded out to the longest clip
+    in the window: a bucket never holds clips more than bucket_ratio times longer than its shortest clip.
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10, bucket_ratio=1.5):
+        self.run_batch = run_batch  # Callable: list of waveforms -> list of results (same order)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.bucket_ratio = bucket_ratio
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='inference-batcher', daemon=True)
+        self._thread.start()
+
+    # Queue a waveform for inference - returns a Future resolving to its result
+    def submit(self, waveform):
+        future = Future()
+        self._queue.put((waveform, future))
+        return future
+
+    # Queue a waveform and block until its result is ready
+    def infer(self, waveform, timeout=None):
+        return self.submit(waveform).result(timeout=timeout)
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _loop(self):
+        while True:
+            pending = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+
+            # Keep collecting until the window closes or we have enough for a full batch
+            while len(pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            for bucket in self._buckets(pending):
+                self._run(bucket)
+
+    # Group requests of similar length (sorted shortest first) into batches
+    def _buckets(self, pending):
+        pending.sort(key=lambda item: len(item[0]))
+        bucket = []
+        for item in pending:
+            if bucket and (len(bucket) >= self.max_batch_size
+                           or len(item[0]) > self.bucket_ratio * max(len(bucket[0][0]), 1)):
+                yield bucket
+                bucket = []
+            bucket.append(item)
+        if bucket:
+            yield bucket
+
+    def _run(self, bucket):
+        # Callers that gave up (cancelled) don't need to be computed
+        bucket = [(waveform, future) for waveform, future in bucket if future.set_running_or_notify_cancel()]
+        if not bucket:
+            return
+
+        start = time.perf_counter()
+        try:
+            results = self.run_batch([waveform for waveform, _ in bucket])
+        except Exception as e:
+            logger.exception("Batched inference failed")
+            for _, future in bucket:
+                future.set_exception(e)
+            return
+
+        logger.debug("Ran batch of %d in %.3fs", len(bucket), time.perf_counter() - start)
+        for (_, future), result in zip(bucket, results):
+            future.set_result(result)
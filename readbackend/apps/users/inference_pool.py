@@ -0,0 +1,319 @@
+'''Inference worker pool - runs the recognizer in dedicated processes so web request threads never run the model
+
+The pool is a separate service (`manage.py run_inference_pool`) listening on a local socket. It owns a set of worker
+processes, each with a pinned number of torch threads, fed from one local task queue. Web workers connect to it
+with a PoolClient and only ship decoded waveforms and the resulting CTC log-probabilities back and forth.
+'''
+
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import get_context
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_INTERVAL = 1.0  # Seconds between heartbeats from an idle worker
+MONITOR_INTERVAL = 1.0  # Seconds between health checks of the workers
+
+
+class PoolUnavailable(Exception):
+    pass
+
+
+class _Worker:
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.process = None
+        self.ready = False
+        self.task_id = None  # Task currently being run
+        self.busy_since = None
+        self.last_heartbeat = time.monotonic()
+        self.restarts = 0
+
+
+class InferenceWorkerPool:
+    """
+    A fixed set of inference worker processes fed from one task queue. Each task is a list of waveforms (and the
+    model to run them through) and resolves to the list of their CTC log-probabilities.
+
+    A monitor thread health-checks the workers: a worker that dies, stops sending heartbeats while idle, or spends
+    longer than task_timeout on one task is restarted, and the task it was running is failed.
+    """
+
+    def __init__(self, num_workers, task_timeout=30):
+        self.num_workers = num_workers
+        self.task_timeout = task_timeout
+        # spawn, not fork: each worker imports torch and loads the model itself, with its own thread pool
+        self._context = get_context('spawn')
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._workers = [_Worker(worker_id) for worker_id in range(num_workers)]
+        self._futures = {}
+        self._queued = set()  # Submitted but not yet picked up by a worker
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        for worker in self._workers:
+            self._spawn(worker)
+        threading.Thread(target=self._collect, name='inference-pool-collector', daemon=True).start()
+        threading.Thread(target=self._monitor, name='inference-pool-monitor', daemon=True).start()
+
+    # Queue a batch of waveforms - returns a Future resolving to their log-probabilities
+    # model_name is None for RECOGNIZER_MODEL_NAME
+    def submit(self, waveforms, model_name=None):
+        future = Future()
+        with self._lock:
+            task_id = next(self._task_ids)
+            self._futures[task_id] = future
+            self._queued.add(task_id)
+        self._tasks.put((task_id, model_name, waveforms))
+        return future
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'queue_depth': len(self._queued),
+                'in_flight': len(self._futures) - len(self._queued),
+                'completed': self.completed,
+                'failed': self.failed,
+                'workers': [
+                    {
+                        'id': worker.worker_id,
+                        'pid': worker.process.pid if worker.process else None,
+                        'alive': bool(worker.process and worker.process.is_alive()),
+                        'ready': worker.ready,
+                        'busy_seconds': round(now - worker.busy_since, 3) if worker.busy_since else 0,
+                        'seconds_since_heartbeat': round(now - worker.last_heartbeat, 3),
+                        'restarts': worker.restarts,
+                    }
+                    for worker in self._workers
+                ],
+            }
+
+    def _spawn(self, worker):
+        worker.process = self._context.Process(
+            target=_worker_main, args=(worker.worker_id, self._tasks, self._results),
+            name=f'inference-worker-{worker.worker_id}', daemon=True,
+        )
+        worker.process.start()
+        worker.ready = False
+        worker.task_id = None
+        worker.busy_since = None
+        worker.last_heartbeat = time.monotonic()
+
+    # Resolve futures from the workers' result messages
+    def _collect(self):
+        while True:
+            kind, worker_id, task_id, payload = self._results.get()
+            worker = self._workers[worker_id]
+            with self._lock:
+                worker.last_heartbeat = time.monotonic()
+                if kind == 'ready':
+                    worker.ready = True
+                elif kind == 'started':
+                    self._queued.discard(task_id)
+                    worker.task_id = task_id
+                    worker.busy_since = time.monotonic()
+                elif kind in ('done', 'error'):
+                    worker.task_id = None
+                    worker.busy_since = None
+                    self._finish(task_id, payload if kind == 'done' else None,
+                                 RuntimeError(payload) if kind == 'error' else None)
+
+    def _monitor(self):
+        while True:
+            time.sleep(MONITOR_INTERVAL)
+            now = time.monotonic()
+            for worker in self._workers:
+                with self._lock:
+                    if not worker.process.is_alive():
+                        reason = f'exited with code {worker.process.exitcode}'
+                    elif worker.busy_since and now - worker.busy_since > self.task_timeout:
+                        reason = f'task ran longer than {self.task_timeout}s'
+                    elif worker.ready and not worker.busy_since and now - worker.last_heartbeat > self.task_timeout:
+                        reason = 'stopped sending heartbeats'
+                    else:
+                        continue
+
+                    logger.warning("Restarting inference worker %d (pid %s): %s",
+                                   worker.worker_id, worker.process.pid, reason)
+                    if worker.task_id is not None:
+                        self._finish(worker.task_id, None, RuntimeError(f'Inference worker {reason}'))
+                    if worker.process.is_alive():
+                        worker.process.kill()
+                    worker.process.join(timeout=5)
+                    worker.restarts += 1
+                    self._spawn(worker)
+
+    # Called with the lock held
+    def _finish(self, task_id, result, error):
+        future = self._futures.pop(task_id, None)
+        if future is None:
+            return
+        if error is not None:
+            self.failed += 1
+            future.set_exception(error)
+        else:
+            self.completed += 1
+            future.set_result(result)
+
+
+# Entry point of a worker process
+def _worker_main(worker_id, tasks, results):
+    import django
+    django.setup()
+
+    from .audio_processing import batch_logits
+    from .recognizer import get_recognizer, warm_up
+
+    warm_up()
+    results.put(('ready', worker_id, None, None))
+    logger.info("Inference worker %d ready (pid %d)", worker_id, os.getpid())
+
+    while True:
+        try:
+            task_id, model_name, waveforms = tasks.get(timeout=HEARTBEAT_INTERVAL)
+        except queue.Empty:
+            results.put(('heartbeat', worker_id, None, None))
+            continue
+
+        results.put(('started', worker_id, task_id, None))
+        try:
+            results.put(('done', worker_id, task_id, batch_logits(waveforms, get_recognizer(model_name))))
+        except Exception as e:
+            logger.exception("Inference failed in worker %d", worker_id)
+            results.put(('error', worker_id, task_id, repr(e)))
+
+
+# Serve a pool to web workers on a local socket: requests are (request_id, op, payload), responses (request_id, ok, result)
+def serve_pool(pool, address, authkey):
+    with Listener(address, authkey=authkey) as listener:
+        logger.info("Inference pool listening on %s", address)
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                logger.exception("Failed to accept an inference pool connection")
+                continue
+            threading.Thread(target=_serve_connection, args=(pool, conn), daemon=True).start()
+
+
+def _serve_connection(pool, conn):
+    send_lock = threading.Lock()
+
+    def respond(request_id, ok, result):
+        with send_lock:
+            try:
+                conn.send((request_id, ok, result))
+            except (OSError, EOFError):
+                pass  # Client went away; its pending requests are failed on its side
+
+    def on_done(request_id, future):
+        if future.exception() is not None:
+            respond(request_id, False, str(future.exception()))
+        else:
+            respond(request_id, True, future.result())
+
+    with conn:
+        while True:
+            try:
+                request_id, op, payload = conn.recv()
+            except (OSError, EOFError):
+                return
+
+            if op == 'infer':
+                pool.submit(*payload).add_done_callback(lambda future, request_id=request_id: on_done(request_id, future))
+            elif op == 'stats':
+                respond(request_id, True, pool.stats())
+            else:
+                respond(request_id, False, f'Unknown op {op}')
+
+
+class PoolClient:
+    """
+    Web-process side of the pool: one connection per process, shared by all request threads.
+    A reader thread matches responses to waiting requests; if the connection drops, waiting requests fail and the
+    next call reconnects.
+    """
+
+    def __init__(self, address, authkey, timeout):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._conn = None
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def infer(self, waveforms, model_name=None):
+        return self._call('infer', (waveforms, model_name))
+
+    def stats(self):
+        return self._call('stats', None)
+
+    def _call(self, op, payload):
+        future = Future()
+        with self._lock:
+            conn = self._connection()
+            request_id = next(self._request_ids)
+            self._pending[request_id] = future
+            try:
+                conn.send((request_id, op, payload))
+            except (OSError, EOFError) as e:
+                self._pending.pop(request_id, None)
+                self._disconnect(conn)
+                raise PoolUnavailable(f'Inference pool connection lost: {e}') from e
+        try:
+            return future.result(timeout=self.timeout)
+        finally:
+            # Drop the entry if the wait timed out, so a response that never comes doesn't leak it
+            with self._lock:
+                self._pending.pop(request_id, None)
+
+    # Called with the lock held
+    def _connection(self):
+        if self._conn is None:
+            try:
+                self._conn = Client(self.address, authkey=self.authkey)
+            except OSError as e:
+                raise PoolUnavailable(f'Inference pool not reachable at {self.address}: {e}') from e
+            threading.Thread(target=self._read, args=(self._conn,), name='inference-pool-client', daemon=True).start()
+        return self._conn
+
+    def _read(self, conn):
+        while True:
+            try:
+                request_id, ok, result = conn.recv()
+            except (OSError, EOFError):
+                with self._lock:
+                    self._disconnect(conn)
+                return
+
+            with self._lock:
+                future = self._pending.pop(request_id, None)
+            if future is not None:
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(RuntimeError(result))
+
+    # Called with the lock held: fail everything waiting on this connection
+    def _disconnect(self, conn):
+        if self._conn is conn:
+            self._conn = None
+            for future in self._pending.values():
+                future.set_exception(PoolUnavailable('Inference pool connection lost'))
+            self._pending.clear()
+        try:
+            conn.close()
+        except OSError:
+            pass
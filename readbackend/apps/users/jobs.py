@@ -0,0 +1,106 @@
+'''Asynchronous /match-audio/ jobs - the upload returns a job id at once and scoring runs on a background thread
+
+Jobs only live in the process that queued them, so a worker recycle, deploy or crash loses them. Their audio is gone
+with the process and they can't be re-queued - instead a job still pending or running after MATCH_JOB_TIMEOUT seconds
+is failed when it's polled (or when a process queues its first job), and the client can upload the clip again.
+'''
+
+import io
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .models import MatchJob
+from .reading import score_reading_once, record_match_result
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 0.2  # Seconds between checks while long-polling a job
+LOST_JOB_ERROR = 'Job timed out - its worker stopped before it finished. Upload the recording again.'
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                # A new process - fail the overdue jobs lost with earlier ones, polled or not
+                fail_stale_jobs(MatchJob.objects.all())
+                _executor = ThreadPoolExecutor(max_workers=settings.MATCH_JOB_WORKERS, thread_name_prefix='match-job')
+    return _executor
+
+
+# Create a job for a reading attempt and queue it for scoring
+# The upload is copied into memory because the request's temporary file is gone once the response is sent
+def submit_match_job(session, matching_text, audio_file):
+    audio_bytes = audio_file.read()
+    job = MatchJob.objects.create(session=session, matching_text=matching_text)
+    _get_executor().submit(_run_job, job.id, audio_bytes)
+    return job
+
+
+# Return the job, waiting up to `wait` seconds for it to finish (None if it doesn't exist)
+def wait_for_job(job_id, wait=0):
+    deadline = time.monotonic() + wait
+    while True:
+        job = MatchJob.objects.filter(id=job_id).first()
+        unfinished = job is not None and job.status in (MatchJob.PENDING, MatchJob.RUNNING)
+        if unfinished and job.created_at < _stale_cutoff() and fail_stale_jobs(MatchJob.objects.filter(id=job_id)):
+            job.refresh_from_db()
+        if job is None or job.status in (MatchJob.DONE, MatchJob.FAILED) or time.monotonic() >= deadline:
+            return job
+        time.sleep(POLL_INTERVAL)
+
+
+# Fail the jobs (of a queryset) still pending or running after MATCH_JOB_TIMEOUT seconds, returning how many
+# A lost job's late result can still complete it, as long as its process is alive (see _complete_job)
+def fail_stale_jobs(jobs):
+    return jobs.filter(status__in=(MatchJob.PENDING, MatchJob.RUNNING), created_at__lt=_stale_cutoff()).update(
+        status=MatchJob.FAILED, error=LOST_JOB_ERROR, completed_at=timezone.now(),
+    )
+
+
+def _stale_cutoff():
+    return timezone.now() - timedelta(seconds=settings.MATCH_JOB_TIMEOUT)
+
+
+def _run_job(job_id, audio_bytes):
+    try:
+        MatchJob.objects.filter(id=job_id, status=MatchJob.PENDING).update(status=MatchJob.RUNNING)
+        job = MatchJob.objects.select_related('session__story').get(id=job_id)
+        result, is_new = score_reading_once(job.session, job.matching_text, io.BytesIO(audio_bytes),
+                                            apply=lambda result: _complete_job(job_id, result))
+        if not is_new:
+            _complete_job(job_id, result, apply=False)
+    except Exception as e:
+        logger.exception("Match job %s failed", job_id)
+        MatchJob.objects.filter(id=job_id).update(status=MatchJob.FAILED, error=str(e), completed_at=timezone.now())
+    finally:
+        close_old_connections()
+
+
+# Store the verdict and apply it to the session in one transaction, so the session is updated exactly once
+# (apply is False when the verdict came from the result cache - a retry of a clip that was already counted)
+def _complete_job(job_id, result, apply=True):
+    with transaction.atomic():
+        job = MatchJob.objects.select_for_update().get(id=job_id)
+        if job.status == MatchJob.DONE:
+            return
+
+        if apply:
+            record_match_result(job.session_id, job.matching_text, result['match'])
+        job.status = MatchJob.DONE
+        job.match = result['match']
+        job.words = result['words']
+        job.completed_at = timezone.now()
+        job.save()
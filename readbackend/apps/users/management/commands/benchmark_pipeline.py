@@ -0,0 +1,232 @@
+'''Time each stage of the /match-audio/ pipeline on its own, over clips of several lengths'''
+
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.alignment import score_words, word_phonemes
+from apps.users.audio_processing import (
+    FRAME_SECONDS, SAMPLE_RATE, _espeak_phonemes, batch_logits, decode_audio, levenshtein_similarity, log_softmax,
+    logits_to_phonemes, text_to_phonemes, trim_waveform,
+)
+from apps.users.phoneme_vocab import get_vocab
+from apps.users.recognizer import create_recognizer
+
+MANIFEST = 'manifest.json'
+# Synthetic clips are read at about this many words per second, so their expected text grows with their length
+WORDS_PER_SECOND = 2.5
+SYNTHETIC_TEXT = 'The quick brown fox jumps over the lazy dog while the children read their stories aloud.'
+
+
+class Command(BaseCommand):
+    help = ("Time each stage of the audio pipeline (decode, silence trimming, feature extraction, model forward pass, "
+            "CTC decoding, phonemization, phoneme encoding, Levenshtein comparison, word alignment) over synthetic "
+            "clips, or the clips listed in <fixtures>/manifest.json, and the throughput of batched inference. "
+            "Reports p50/p95 latency and peak RSS, and writes everything to a JSON file for comparing commits.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixtures', help='Directory with manifest.json (as for benchmark_recognizers) - '
+                                               'synthetic clips are generated when omitted')
+        parser.add_argument('--lengths', default='2,5,10,30',
+                            help='Comma-separated lengths in seconds of the synthetic clips (default: 2,5,10,30)')
+        parser.add_argument('--batch-sizes', default='1,4,8',
+                            help='Comma-separated batch sizes for the throughput runs (default: 1,4,8)')
+        parser.add_argument('--threads', default=str(os.cpu_count() or 1),
+                            help='Comma-separated intra-op thread counts for the throughput runs (default: all cores)')
+        parser.add_argument('--repeat', type=int, default=10, help='Timed runs per stage and clip (default: 10)')
+        parser.add_argument('--backend', default=None, help='Recognizer backend (default: RECOGNIZER_BACKEND)')
+        parser.add_argument('--output', default='benchmark_pipeline.json', help='JSON results file')
+
+    def handle(self, *args, **options):
+        try:
+            batch_sizes = [int(size) for size in options['batch_sizes'].split(',')]
+            thread_counts = [int(threads) for threads in options['threads'].split(',')]
+        except ValueError as e:
+            raise CommandError(f'Invalid --batch-sizes / --threads: {e}')
+
+        clips = self._load_fixtures(options['fixtures']) if options['fixtures'] else self._synthesize(options['lengths'])
+        recognizer = create_recognizer(options['backend'])
+        if getattr(recognizer, 'transcribes_words', False):
+            raise CommandError('benchmark_pipeline times the CTC pipeline - use benchmark_recognizers for word backends')
+        recognizer.warm_up()
+        vocab = get_vocab()
+
+        stages = []
+        for name, encoded, text in clips:
+            stages += self._time_stages(name, encoded, text, recognizer, vocab, options['repeat'])
+            self.stdout.write(f'Timed the stages on {name}')
+
+        throughput = []
+        for threads in thread_counts:
+            self._set_threads(threads)
+            for batch_size in batch_sizes:
+                for name, encoded, _ in clips:
+                    waveform = decode_audio(io.BytesIO(encoded))
+                    throughput.append(
+                        self._time_batch(name, waveform, batch_size, threads, recognizer, options['repeat'])
+                    )
+
+        results = {
+            'commit': self._commit(),
+            'backend': recognizer.name,
+            'model': recognizer.model_name,
+            'repeat': options['repeat'],
+            'stages': stages,
+            'throughput': throughput,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,  # ru_maxrss is in KB on Linux
+        }
+        with open(options['output'], 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+
+        self._report(results)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    # (name, encoded audio, text) for each clip in the manifest
+    def _load_fixtures(self, fixtures_dir):
+        try:
+            with open(os.path.join(fixtures_dir, MANIFEST)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {MANIFEST}: {e}')
+        if not manifest:
+            raise CommandError(f'{MANIFEST} lists no clips')
+
+        clips = []
+        for entry in manifest:
+            with open(os.path.join(fixtures_dir, entry['audio']), 'rb') as audio_file:
+                clips.append((entry['audio'], audio_file.read(), entry['text']))
+        return clips
+
+    # (name, encoded audio, text) for a noise-burst clip of each length, encoded as webm/opus like browser uploads
+    def _synthesize(self, lengths):
+        try:
+            seconds = [float(length) for length in lengths.split(',')]
+        except ValueError as e:
+            raise CommandError(f'Invalid --lengths: {e}')
+
+        words = SYNTHETIC_TEXT.split()
+        rng = np.random.default_rng(0)
+        clips = []
+        for length in seconds:
+            num_samples = int(length * SAMPLE_RATE)
+            # Syllable-rate amplitude modulation, so silence trimming sees speech-like energy rather than one block
+            envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * np.arange(num_samples) / SAMPLE_RATE)
+            waveform = (rng.standard_normal(num_samples) * 0.1 * envelope).astype(np.float32)
+            text = ' '.join(words[i % len(words)] for i in range(max(1, int(length * WORDS_PER_SECOND))))
+            clips.append((f'synthetic {length:g}s', self._encode_webm(waveform), text))
+        return clips
+
+    def _encode_webm(self, waveform):
+        import av
+
+        buffer = io.BytesIO()
+        with av.open(buffer, 'w', format='webm') as container:
+            stream = container.add_stream('libopus', rate=SAMPLE_RATE)
+            stream.layout = 'mono'
+            frame = av.AudioFrame.from_ndarray(waveform[np.newaxis], format='flt', layout='mono')
+            frame.sample_rate = SAMPLE_RATE
+            for packet in stream.encode(frame):
+                container.mux(packet)
+            for packet in stream.encode(None):
+                container.mux(packet)
+        return buffer.getvalue()
+
+    # Latency of each stage on one clip - every stage gets the previous stage's output, computed once up front
+    def _time_stages(self, name, encoded, text, recognizer, vocab, repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            waveform = decode_audio(io.BytesIO(encoded))
+            trimmed = trim_waveform(waveform) if settings.VAD_ENABLED else waveform
+            inputs = recognizer.processor(trimmed, return_tensors='np', sampling_rate=SAMPLE_RATE)
+            log_probs = log_softmax(recognizer.forward(inputs.input_values)[0])
+            text_phonemes = text_to_phonemes(text)
+            expected_words = word_phonemes(text, text_phonemes)
+        audio_ids = vocab.recognized(log_probs)
+        text_ids = vocab.encode(text_phonemes)
+        voice = settings.ESPEAK_VOICES.get(settings.READING_DEFAULT_LANGUAGE, settings.READING_DEFAULT_LANGUAGE)
+
+        stages = {
+            'decode': lambda: decode_audio(io.BytesIO(encoded)),
+            'trim_silence': lambda: trim_waveform(waveform),
+            'features': lambda: recognizer.processor(trimmed, return_tensors='np', sampling_rate=SAMPLE_RATE),
+            'forward': lambda: recognizer.forward(inputs.input_values),
+            'ctc_decode': lambda: logits_to_phonemes(log_probs),
+            'phonemize': lambda: _espeak_phonemes(text, voice),  # Uncached - a sentence missing from the story index
+            'encode_phonemes': lambda: vocab._encode(text_phonemes),  # Uncached, as on a sentence's first reading
+            'levenshtein': lambda: levenshtein_similarity(audio_ids, text_ids),
+            'align_words': lambda: score_words(log_probs, expected_words, vocab, FRAME_SECONDS),
+        }
+        audio_seconds = len(waveform) / SAMPLE_RATE
+        return [
+            {'clip': name, 'audio_seconds': audio_seconds, 'stage': stage, **self._percentiles(self._time(run, repeat))}
+            for stage, run in stages.items()
+        ]
+
+    # Throughput of batched inference (feature extraction + forward pass) on `batch_size` copies of a clip
+    def _time_batch(self, name, waveform, batch_size, threads, recognizer, repeat):
+        waveforms = [waveform] * batch_size
+        latencies = self._time(lambda: batch_logits(waveforms, recognizer), repeat)
+        audio_seconds = len(waveform) / SAMPLE_RATE
+        p50 = float(np.percentile(latencies, 50))
+        return {
+            'clip': name, 'audio_seconds': audio_seconds, 'batch_size': batch_size, 'threads': threads,
+            **self._percentiles(latencies),
+            'clips_per_second': batch_size / p50 if p50 else 0.0,
+            'real_time_factor': p50 / (audio_seconds * batch_size) if audio_seconds else 0.0,
+        }
+
+    # Seconds per run; the pipeline's debug prints are swallowed so they don't distort the timings
+    def _time(self, run, repeat):
+        latencies = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            run()  # Untimed warm-up run
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                latencies.append(time.perf_counter() - start)
+        return latencies
+
+    def _percentiles(self, latencies):
+        return {
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+            'p95_ms': float(np.percentile(latencies, 95)) * 1000,
+        }
+
+    # Intra-op threads of the inference runtime (torch; ONNX Runtime sessions read RECOGNIZER_TORCH_THREADS at load time)
+    def _set_threads(self, threads):
+        try:
+            import torch
+        except ImportError:
+            return
+        torch.set_num_threads(threads)
+
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def _report(self, results):
+        self.stdout.write(f"{'clip':<18}{'stage':<18}{'p50 ms':>10}{'p95 ms':>10}")
+        for stage in results['stages']:
+            self.stdout.write(
+                f"{stage['clip']:<18}{stage['stage']:<18}{stage['p50_ms']:>10.2f}{stage['p95_ms']:>10.2f}"
+            )
+        self.stdout.write('')
+        self.stdout.write(f"{'clip':<18}{'threads':>8}{'batch':>7}{'p50 ms':>10}{'p95 ms':>10}{'clips/s':>10}{'RTF':>8}")
+        for run in results['throughput']:
+            self.stdout.write(
+                f"{run['clip']:<18}{run['threads']:>8}{run['batch_size']:>7}{run['p50_ms']:>10.1f}{run['p95_ms']:>10.1f}"
+                f"{run['clips_per_second']:>10.1f}{run['real_time_factor']:>8.3f}"
+            )
+        self.stdout.write('')
+        self.stdout.write(f"Peak RSS: {results['peak_rss_mb']:.0f} MB")
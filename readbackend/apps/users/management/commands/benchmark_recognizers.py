@@ -0,0 +1,108 @@
+'''Compare recognizer backends on latency and accuracy over a set of labelled fixture clips'''
+
+import json
+import os
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.alignment import score_words, word_phonemes
+from apps.users.audio_processing import FRAME_SECONDS, SAMPLE_RATE, audio_to_waveform, batch_logits, text_to_phonemes
+from apps.users.phoneme_vocab import get_vocab
+from apps.users.reading import reading_verdict
+from apps.users.recognizer import BACKENDS, create_recognizer
+from apps.users.transcript_scoring import score_transcript
+
+MANIFEST = 'manifest.json'
+
+
+class Command(BaseCommand):
+    help = ("Score every clip listed in <fixtures_dir>/manifest.json with each backend and report latency, "
+            "real-time factor and how often the verdict matches the label. Manifest entries look like "
+            '{"audio": "clip.webm", "text": "The sentence that was read.", "match": true} ("match" and "language" '
+            'are optional).')
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures_dir', help='Directory with manifest.json and the clips it lists')
+        parser.add_argument('--backends', default=','.join(BACKENDS),
+                            help=f"Comma-separated backends to compare (default: {','.join(BACKENDS)})")
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per clip (default: 3)')
+
+    def handle(self, *args, **options):
+        backends = [backend.strip() for backend in options['backends'].split(',') if backend.strip()]
+        unknown = [backend for backend in backends if backend not in BACKENDS]
+        if unknown:
+            raise CommandError(f"Unknown backend(s): {', '.join(unknown)}")
+
+        try:
+            with open(os.path.join(options['fixtures_dir'], MANIFEST)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Could not read {MANIFEST}: {e}')
+        if not manifest:
+            raise CommandError(f'{MANIFEST} lists no clips')
+
+        # Decoding and the expected phonemes are shared by every backend, so they're prepared once
+        clips = []
+        for entry in manifest:
+            with open(os.path.join(options['fixtures_dir'], entry['audio']), 'rb') as audio_file:
+                waveform = audio_to_waveform(audio_file)
+            language = entry.get('language')
+            expected_words = word_phonemes(entry['text'], text_to_phonemes(entry['text'], language), language)
+            clips.append((entry, waveform, expected_words))
+        audio_seconds = sum(len(waveform) for _, waveform, _ in clips) / SAMPLE_RATE
+        vocab = get_vocab()
+
+        results = []
+        for backend in backends:
+            start = time.perf_counter()
+            recognizer = create_recognizer(backend)
+            recognizer.warm_up()
+            load_seconds = time.perf_counter() - start
+
+            latencies = []
+            verdicts = []
+            for entry, waveform, expected_words in clips:
+                for run in range(options['repeat']):
+                    start = time.perf_counter()
+                    if recognizer.transcribes_words:
+                        words = score_transcript(
+                            recognizer.transcribe(waveform, entry.get('language')), expected_words, vocab,
+                            settings.WORD_SCORE_THRESHOLD, entry.get('language'),
+                        )
+                    else:
+                        words = score_words(batch_logits([waveform], recognizer)[0], expected_words, vocab, FRAME_SECONDS)
+                    latencies.append(time.perf_counter() - start)
+                verdicts.append(reading_verdict(words)['match'])
+
+            results.append(self._summarize(backend, load_seconds, latencies, verdicts, clips, audio_seconds, options))
+            del recognizer
+
+        self._report(results, backends[0])
+
+    def _summarize(self, backend, load_seconds, latencies, verdicts, clips, audio_seconds, options):
+        labelled = [(verdict, entry['match']) for verdict, (entry, _, _) in zip(verdicts, clips) if 'match' in entry]
+        return {
+            'backend': backend,
+            'load_seconds': load_seconds,
+            'p50_ms': float(np.percentile(latencies, 50)) * 1000,
+            'p95_ms': float(np.percentile(latencies, 95)) * 1000,
+            # Seconds of compute per second of audio
+            'real_time_factor': sum(latencies) / options['repeat'] / audio_seconds if audio_seconds else 0.0,
+            'accuracy': sum(verdict == label for verdict, label in labelled) / len(labelled) if labelled else None,
+            'verdicts': verdicts,
+        }
+
+    def _report(self, results, reference):
+        reference_verdicts = results[0]['verdicts']
+        self.stdout.write(f"{'backend':<10}{'load s':>8}{'p50 ms':>10}{'p95 ms':>10}{'RTF':>8}{'accuracy':>10}"
+                          f"{'agrees w/ ' + reference:>20}")
+        for result in results:
+            accuracy = f"{result['accuracy']:.1%}" if result['accuracy'] is not None else 'n/a'
+            agreement = np.mean([a == b for a, b in zip(result['verdicts'], reference_verdicts)])
+            self.stdout.write(
+                f"{result['backend']:<10}{result['load_seconds']:>8.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                f"{result['real_time_factor']:>8.3f}{accuracy:>10}{agreement:>20.1%}"
+            )
@@ -0,0 +1,58 @@
+'''Compare the phoneme output of two recognizer backends on a set of fixture clips'''
+
+import os
+
+import Levenshtein
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.audio_processing import decode_audio, normalize_phonemes, transcribe_batch, SAMPLE_RATE
+from apps.users.recognizer import BACKENDS, create_recognizer
+
+AUDIO_EXTENSIONS = ('.wav', '.webm', '.ogg', '.mp3', '.m4a', '.flac')
+
+
+class Command(BaseCommand):
+    help = ("Transcribe every clip in a fixture directory with a reference and a candidate backend "
+            "and fail if their phoneme output diverges.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('fixtures_dir', help='Directory of audio clips')
+        parser.add_argument('--reference', default='torch', help='Reference backend (default: torch)')
+        parser.add_argument('--candidate', default='onnx', help='Backend under test (default: onnx)')
+        parser.add_argument('--min-similarity', type=float, default=0.95,
+                            help='Minimum Levenshtein similarity required for every clip')
+
+    def handle(self, *args, **options):
+        clips = sorted(
+            name for name in os.listdir(options['fixtures_dir']) if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+        if not clips:
+            raise CommandError(f"No audio clips found in {options['fixtures_dir']}")
+
+        for backend in (options['reference'], options['candidate']):
+            if backend in BACKENDS and BACKENDS[backend].transcribes_words:
+                raise CommandError(f"'{backend}' transcribes words - compare it with benchmark_recognizers instead")
+
+        reference = create_recognizer(options['reference'])
+        candidate = create_recognizer(options['candidate'])
+
+        similarities = []
+        failures = []
+        for name in clips:
+            with open(os.path.join(options['fixtures_dir'], name), 'rb') as audio_file:
+                waveform = decode_audio(audio_file)
+
+            expected = normalize_phonemes(transcribe_batch([waveform], recognizer=reference)[0])
+            actual = normalize_phonemes(transcribe_batch([waveform], recognizer=candidate)[0])
+            similarity = Levenshtein.ratio(expected, actual)
+            similarities.append(similarity)
+
+            self.stdout.write(f'{name} ({len(waveform) / SAMPLE_RATE:.1f}s): similarity {similarity:.3f}')
+            if similarity < options['min_similarity']:
+                failures.append(name)
+                self.stdout.write(f'  {options["reference"]}: {expected}\n  {options["candidate"]}: {actual}')
+
+        self.stdout.write(f'Mean similarity over {len(clips)} clips: {sum(similarities) / len(similarities):.3f}')
+        if failures:
+            raise CommandError(f'{len(failures)} clip(s) below {options["min_similarity"]}: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('Backends agree'))
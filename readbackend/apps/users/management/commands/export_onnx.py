@@ -0,0 +1,55 @@
+'''Export the recognizer model to ONNX and quantize it to int8 for the 'onnx' backend'''
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Export RECOGNIZER_MODEL_NAME to ONNX and apply int8 dynamic quantization. "
+            "Set RECOGNIZER_BACKEND=onnx and RECOGNIZER_ONNX_PATH to the output to serve it.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.RECOGNIZER_ONNX_PATH, help='Path of the quantized model')
+        parser.add_argument('--no-quantize', action='store_true', help='Only export the float32 model')
+        parser.add_argument('--opset', type=int, default=14)
+
+    def handle(self, *args, **options):
+        import torch
+        from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+        model_name = settings.RECOGNIZER_MODEL_NAME
+        output = options['output']
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        fp32_output = output if options['no_quantize'] else os.path.splitext(output.replace('.int8', ''))[0] + '.fp32.onnx'
+
+        processor = Wav2Vec2Processor.from_pretrained(model_name)
+        model = Wav2Vec2ForCTC.from_pretrained(model_name)
+        model.eval()
+
+        # Only export an attention_mask input if the model actually uses one
+        input_names = ['input_values']
+        dummy_inputs = (torch.zeros(1, 16000),)
+        if processor.feature_extractor.return_attention_mask:
+            input_names.append('attention_mask')
+            dummy_inputs += (torch.ones(1, 16000, dtype=torch.int64),)
+
+        dynamic_axes = {name: {0: 'batch', 1: 'samples'} for name in input_names}
+        dynamic_axes['logits'] = {0: 'batch', 1: 'frames'}
+
+        self.stdout.write(f'Exporting {model_name} to {fp32_output}')
+        torch.onnx.export(
+            model, dummy_inputs, fp32_output,
+            input_names=input_names, output_names=['logits'],
+            dynamic_axes=dynamic_axes, opset_version=options['opset'],
+        )
+
+        if not options['no_quantize']:
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            # Quantize the transformer's matmuls (the bulk of the compute); the conv feature encoder stays float32
+            self.stdout.write(f'Quantizing to {output}')
+            quantize_dynamic(fp32_output, output, weight_type=QuantType.QInt8, op_types_to_quantize=['MatMul'])
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {output}. Run check_recognizer_parity before switching backends.'))
@@ -0,0 +1,26 @@
+'''Save the recognizer model and processor as a local safetensors checkpoint'''
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Download RECOGNIZER_MODEL_NAME and save it as a safetensors checkpoint. "
+            "Point RECOGNIZER_MODEL_NAME at the output directory so workers load it from local disk, without "
+            "unpickling a PyTorch checkpoint.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir', help='Directory to write the checkpoint to')
+
+    def handle(self, *args, **options):
+        from transformers import Wav2Vec2ForCTC, Wav2Vec2Processor
+
+        model_name = settings.RECOGNIZER_MODEL_NAME
+        output_dir = options['output_dir']
+
+        processor = Wav2Vec2Processor.from_pretrained(model_name)
+        model = Wav2Vec2ForCTC.from_pretrained(model_name)
+        processor.save_pretrained(output_dir)
+        model.save_pretrained(output_dir, safe_serialization=True)
+
+        self.stdout.write(self.style.SUCCESS(f'Saved {model_name} to {output_dir}'))
@@ -0,0 +1,197 @@
+'''Bulk-generate a synthetic, production-sized dataset of users, classes, stories and reading sessions'''
+
+import re
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from apps.users.models import Class, ReadingSession, Story, Student, User
+from apps.users.rollups import rebuild_rollups
+
+# Story lengths in characters per difficulty level (low, high), and how common each level is
+STORY_LENGTHS = {'easy': (300, 1000), 'medium': (1000, 3500), 'hard': (3500, 9000)}
+DIFFICULTY_SHARES = {'easy': 0.5, 'medium': 0.3, 'hard': 0.2}
+WORDS = (
+    'the a little big cat dog bird fox tree house river garden sun moon star boat friend mother father sister brother '
+    'ran jumped saw found looked played walked said called opened climbed laughed happy sad quick slow green red '
+    'under over into through behind near far away home school morning night rain wind and then but so because'
+).split()
+
+
+# Generated class codes are this followed by an 8-digit number (class codes are at most 20 characters)
+def class_code_prefix(prefix):
+    return prefix.upper()[:8]
+
+
+class Command(BaseCommand):
+    help = ("Generate synthetic readers, teachers, classes, stories and reading sessions for load and query "
+            "benchmarks (e.g. --readers 100000 --sessions 5000000). Rows are bulk-inserted in batches and every user "
+            "shares one precomputed password hash (--password). Stories aren't phoneme-indexed - run index_stories "
+            "afterwards if the benchmark scores readings.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=1000, help='Readers to create (default: 1000)')
+        parser.add_argument('--teachers', type=int, default=None,
+                            help='Teachers to create (default: one per 150 readers, at least one)')
+        parser.add_argument('--classes-per-teacher', type=int, default=5, help='Classes per teacher (default: 5)')
+        parser.add_argument('--enrolled', type=float, default=0.9,
+                            help='Share of readers who are in a class (default: 0.9)')
+        parser.add_argument('--stories', type=int, default=200, help='Stories to create (default: 200)')
+        parser.add_argument('--sessions', type=int, default=20000, help='Reading sessions to create (default: 20000)')
+        parser.add_argument('--days', type=int, default=365, help='Sessions start within this many days (default: 365)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per bulk insert (default: 5000)')
+        parser.add_argument('--prefix', default='syn',
+                            help="Prefix of generated usernames and class codes (default: 'syn')")
+        parser.add_argument('--password', default='password',
+                            help="Password of every generated user (default: 'password')")
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+
+    def handle(self, *args, **options):
+        if options['readers'] < 1 or options['stories'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--readers, --stories and --batch-size must be at least 1')
+        if options['classes_per_teacher'] < 1 or (options['teachers'] is not None and options['teachers'] < 1):
+            raise CommandError('--teachers and --classes-per-teacher must be at least 1')
+        if options['sessions'] < 0 or options['days'] < 1:
+            raise CommandError('--sessions must be at least 0 and --days at least 1')
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=f'{prefix}-').exists():
+            raise CommandError(f"Users prefixed '{prefix}-' already exist - pass a different --prefix")
+        # Class codes only keep the prefix's first 8 characters, so different prefixes can still give the same codes
+        if Class.objects.filter(class_code__regex=rf'^{re.escape(class_code_prefix(prefix))}[0-9]{{8}}$').exists():
+            raise CommandError(f"Class codes of prefix '{prefix}' already exist - pass a different --prefix")
+
+        self.rng = np.random.default_rng(options['seed'])
+        self.batch_size = options['batch_size']
+        self.now = timezone.now()
+        self.password = make_password(options['password'])  # Hashed once - PBKDF2 per user would take hours
+        start = time.perf_counter()
+
+        num_teachers = options['teachers'] or max(1, options['readers'] // 150)
+        teacher_ids = self._create_users(prefix, 'teacher', num_teachers, np.zeros(num_teachers))
+        reader_ids = self._create_users(prefix, 'reader', options['readers'], self._reading_levels(options['readers']))
+        class_ids = self._create_classes(prefix, teacher_ids, options['classes_per_teacher'])
+        self._create_students(reader_ids, class_ids, options['enrolled'])
+        story_ids, story_lengths = self._create_stories(options['stories'])
+        self._create_sessions(reader_ids, story_ids, story_lengths, options['sessions'], options['days'])
+        # Bulk inserts bypass the rollup hooks - rebuild them over the whole dataset
+        self.stdout.write(f'Rebuilt {rebuild_rollups()} reading rollups')
+
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - start:.0f}s'))
+
+    # Readers' levels are right-skewed over 0-500: most readers are early on, a long tail is advanced
+    def _reading_levels(self, count):
+        return np.clip(self.rng.gamma(shape=2.0, scale=40.0, size=count), 0, 500).round(1)
+
+    def _create_users(self, prefix, role, count, levels):
+        ids = []
+        for start in range(0, count, self.batch_size):
+            users = [
+                User(
+                    username=f'{prefix}-{role}-{i:07d}', email=f'{prefix}-{role}-{i:07d}@example.com',
+                    password=self.password, role=role, reading_level=float(levels[i]),
+                    previous_reading_level=float(max(0.0, levels[i] - self.rng.uniform(0, 10))),
+                    date_joined=self.now - timedelta(days=float(self.rng.uniform(0, 730))),
+                )
+                for i in range(start, min(start + self.batch_size, count))
+            ]
+            ids += self._bulk_create(User, users)
+        self.stdout.write(f'Created {count} {role}s')
+        return np.array(ids)
+
+    def _create_classes(self, prefix, teacher_ids, classes_per_teacher):
+        code_prefix = class_code_prefix(prefix)
+        classes = [
+            Class(teacher_id=int(teacher_id), class_code=f'{code_prefix}{i:08d}')
+            for i, teacher_id in enumerate(np.repeat(teacher_ids, classes_per_teacher))
+        ]
+        ids = []
+        for start in range(0, len(classes), self.batch_size):
+            ids += self._bulk_create(Class, classes[start:start + self.batch_size])
+        self.stdout.write(f'Created {len(ids)} classes')
+        return np.array(ids)
+
+    # Enrolled readers are spread over the classes, with class sizes varying around the mean
+    def _create_students(self, reader_ids, class_ids, enrolled):
+        enrolled_ids = reader_ids[self.rng.random(len(reader_ids)) < enrolled]
+        class_weights = self.rng.gamma(shape=8.0, size=len(class_ids))
+        assignments = self.rng.choice(class_ids, size=len(enrolled_ids), p=class_weights / class_weights.sum())
+        for start in range(0, len(enrolled_ids), self.batch_size):
+            self._bulk_create(Student, [
+                Student(reader_id=int(reader_id), class_code_id=int(class_id))
+                for reader_id, class_id in zip(enrolled_ids[start:start + self.batch_size],
+                                               assignments[start:start + self.batch_size])
+            ])
+        self.stdout.write(f'Created {len(enrolled_ids)} students')
+
+    def _create_stories(self, count):
+        levels = list(DIFFICULTY_SHARES)
+        difficulties = self.rng.choice(levels, size=count, p=list(DIFFICULTY_SHARES.values()))
+        stories = []
+        for i, difficulty in enumerate(difficulties):
+            low, high = STORY_LENGTHS[difficulty]
+            fulltext = self._story_text(int(self.rng.integers(low, high)))
+            stories.append(Story(
+                title=f'Synthetic story {i}', description=fulltext[:120], fulltext=fulltext,
+                difficulty_level=difficulty, image='resources/story_images/synthetic.jpg',
+            ))
+        ids = []
+        for start in range(0, count, self.batch_size):
+            ids += self._bulk_create(Story, stories[start:start + self.batch_size])
+        self.stdout.write(f'Created {count} stories')
+        return np.array(ids), np.array([len(story.fulltext) for story in stories])
+
+    # Sentences of 4-14 random words until the text is `length` characters long
+    def _story_text(self, length):
+        sentences = []
+        total = 0
+        while total < length:
+            words = self.rng.choice(WORDS, size=int(self.rng.integers(4, 15)))
+            sentence = ' '.join(words).capitalize() + '.'
+            sentences.append(sentence)
+            total += len(sentence) + 1
+        return ' '.join(sentences)
+
+    # Sessions follow heavy-tailed distributions: a few readers read a lot, a few stories are read by most readers
+    # About 60% of sessions are finished (progress 100); the rest stopped part of the way through
+    def _create_sessions(self, reader_ids, story_ids, story_lengths, count, days):
+        activity = self.rng.lognormal(mean=0.0, sigma=1.0, size=len(reader_ids))
+        activity /= activity.sum()
+        popularity = 1.0 / np.arange(1, len(story_ids) + 1) ** 0.8
+        popularity = self.rng.permutation(popularity / popularity.sum())
+
+        created = 0
+        for start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - start)
+            readers = self.rng.choice(reader_ids, size=size, p=activity)
+            stories = self.rng.choice(len(story_ids), size=size, p=popularity)
+            lengths = story_lengths[stories]
+            finished = self.rng.random(size) < 0.6
+            positions = np.where(finished, lengths, (self.rng.random(size) * lengths).astype(np.int64))
+            chars_per_second = self.rng.lognormal(mean=np.log(8.0), sigma=0.4, size=size)
+            reading_seconds = positions / chars_per_second
+            started = self.rng.uniform(0, days * 86400, size=size)
+            errors = self.rng.poisson(positions / 200.0)
+
+            sessions = []
+            for i in range(size):
+                start_datetime = self.now - timedelta(seconds=float(started[i]))
+                end_datetime = start_datetime + timedelta(seconds=float(reading_seconds[i]) * 1.5)
+                sessions.append(ReadingSession(
+                    user_id=int(readers[i]), story_id=int(story_ids[stories[i]]), start_datetime=start_datetime,
+                    end_datetime=end_datetime if finished[i] else None,
+                    story_progress=float(positions[i] / lengths[i] * 100), current_position=int(positions[i]),
+                    total_errors=int(errors[i]), total_reading_time=timedelta(seconds=float(reading_seconds[i])),
+                ))
+            self._bulk_create(ReadingSession, sessions)
+            created += size
+            self.stdout.write(f'Created {created}/{count} reading sessions')
+
+    # Insert one batch in its own transaction, returning the new rows' ids
+    def _bulk_create(self, model, objects):
+        with transaction.atomic():
+            return [obj.id for obj in model.objects.bulk_create(objects, batch_size=self.batch_size)]
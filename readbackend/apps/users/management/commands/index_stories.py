@@ -0,0 +1,25 @@
+'''(Re)build the phoneme index of existing stories'''
+
+from django.core.management.base import BaseCommand
+
+from apps.users.models import Story
+from apps.users.story_index import index_story
+
+
+class Command(BaseCommand):
+    help = ("Phonemize and respell every story's sentences into its phoneme index / sentence bundle "
+            "(run once after deploying, or to repair an index).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--story', type=int, action='append', help='Only index the story with this id (repeatable)')
+
+    def handle(self, *args, **options):
+        stories = Story.objects.all()
+        if options['story']:
+            stories = stories.filter(id__in=options['story'])
+
+        for story in stories.iterator():
+            index_story(story)
+            self.stdout.write(f'Indexed story {story.id}: {len(story.phoneme_index)} sentences')
+
+        self.stdout.write(self.style.SUCCESS('Done'))
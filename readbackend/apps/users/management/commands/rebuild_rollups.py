@@ -0,0 +1,14 @@
+'''(Re)build the reading rollups and story engagement counters behind the analytics and ranking endpoints'''
+
+from django.core.management.base import BaseCommand
+
+from apps.users.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = ("Recompute the reading rollups (over all readers, and per class) and every story's engagement counters "
+            "from the reading sessions and readers (after bulk imports, or to repair drift - migrating builds them on deploy).")
+
+    def handle(self, *args, **options):
+        count = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} rollups'))
@@ -0,0 +1,37 @@
+'''Run the inference worker pool that web workers send recognition requests to'''
+
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ("Start a pool of recognizer processes and serve it on INFERENCE_POOL_ADDRESS. "
+            "Web workers use it instead of running the model in request threads.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.INFERENCE_POOL_WORKERS,
+                            help='Number of inference worker processes')
+        parser.add_argument('--threads', type=int, default=settings.RECOGNIZER_TORCH_THREADS,
+                            help='Torch / ONNX Runtime threads per worker')
+
+    def handle(self, *args, **options):
+        from apps.users.inference_pool import InferenceWorkerPool, serve_pool
+        from apps.users.recognizer import transcribes_words
+
+        address = settings.INFERENCE_POOL_ADDRESS
+        if transcribes_words():
+            raise CommandError(f"The inference pool only serves CTC backends, not '{settings.RECOGNIZER_BACKEND}'")
+        if not address:
+            raise CommandError('Set INFERENCE_POOL_ADDRESS (e.g. /tmp/readbackend-inference.sock)')
+        if os.path.exists(address):
+            os.unlink(address)  # Stale socket from a previous run
+
+        # Workers are spawned fresh and read their settings from the environment
+        os.environ['RECOGNIZER_TORCH_THREADS'] = str(options['threads'])
+
+        pool = InferenceWorkerPool(options['workers'], task_timeout=settings.INFERENCE_POOL_TIMEOUT)
+        pool.start()
+        self.stdout.write(f"Started {options['workers']} inference workers x {options['threads']} threads")
+        serve_pool(pool, address, settings.INFERENCE_POOL_AUTHKEY.encode())
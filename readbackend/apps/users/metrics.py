@@ -0,0 +1,22 @@
+'''Process-local metrics - simple named counters, exposed by the /health/metrics/ endpoint
+
+Counters are per process: with several gunicorn workers, each worker reports its own values.
+'''
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+
+
+# Add value to the named counter
+def increment(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+# Current value of every counter
+def snapshot():
+    with _lock:
+        return dict(_counters)
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0009_user_previous_reading_level'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='phoneme_index',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 20:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0011_matchjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchjob',
+            name='words',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 20:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0012_matchjob_words'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='language',
+            field=models.CharField(default='en', max_length=10),
+        ),
+    ]
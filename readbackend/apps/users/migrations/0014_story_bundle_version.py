@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-17 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0013_story_language'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='bundle_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-17 20:41
+
+import datetime
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0014_story_bundle_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_count', models.PositiveBigIntegerField(default=0)),
+                ('reading_time', models.DurationField(default=datetime.timedelta(0))),
+                ('progress_sum', models.FloatField(default=0)),
+                ('completed_count', models.PositiveBigIntegerField(default=0)),
+                ('completed_reading_time', models.DurationField(default=datetime.timedelta(0))),
+                ('reader_count', models.PositiveBigIntegerField(default=0)),
+                ('reading_level_sum', models.FloatField(default=0)),
+                ('class_code', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='users.class')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.0.7 on 2026-10-17 20:45
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0015_readingrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='completed_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='session_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='total_reading_time',
+            field=models.DurationField(default=datetime.timedelta(0)),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['session_count', 'id'], name='users_story_session_794723_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['total_reading_time', 'id'], name='users_story_total_r_c8932c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['completed_count', 'id'], name='users_story_complet_035898_idx'),
+        ),
+    ]
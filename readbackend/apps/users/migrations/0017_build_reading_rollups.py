@@ -0,0 +1,71 @@
+# Builds the reading rollups (see rollups.py) over the sessions and readers that existed before them, so the analytics
+# endpoints and the rollup hooks have rows to read and update straight after deploying
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Count, Q, Sum
+
+COMPLETE = 100  # story_progress of a finished story (rollups.COMPLETE)
+
+
+# Aggregates matching the rollup's session fields, over sessions reached through `path` (rollups._session_sums)
+def session_sums(path=''):
+    completed = Q(**{f'{path}story_progress__gte': COMPLETE})
+    return {
+        'session_count': Count(f'{path}id'),
+        'reading_time': Sum(f'{path}total_reading_time'),
+        'progress_sum': Sum(f'{path}story_progress'),
+        'completed_count': Count(f'{path}id', filter=completed),
+        'completed_reading_time': Sum(f'{path}total_reading_time', filter=completed),
+    }
+
+
+def clean(values):
+    return {
+        field: value if value is not None else (timedelta(0) if field.endswith('time') else 0)
+        for field, value in values.items()
+    }
+
+
+def build_rollups(apps, schema_editor):
+    Class = apps.get_model('users', 'Class')
+    ReadingRollup = apps.get_model('users', 'ReadingRollup')
+    ReadingSession = apps.get_model('users', 'ReadingSession')
+    Student = apps.get_model('users', 'Student')
+    User = apps.get_model('users', 'User')
+
+    ReadingRollup.objects.all().delete()
+    sessions = clean(ReadingSession.objects.aggregate(**session_sums()))
+    readers = clean(User.objects.filter(role='reader').aggregate(
+        reader_count=Count('id'), reading_level_sum=Sum('reading_level'),
+    ))
+    rollups = [ReadingRollup(class_code=None, **sessions, **readers)]
+
+    # Sessions and readers are grouped in separate queries - joining both would count each session per student row
+    class_sessions = {
+        row.pop('class_code'): clean(row)
+        for row in Student.objects.values('class_code').annotate(**session_sums('reader__readingsession__'))
+    }
+    class_readers = {
+        row.pop('class_code'): clean(row)
+        for row in Student.objects.values('class_code').annotate(
+            reader_count=Count('id'), reading_level_sum=Sum('reader__reading_level'),
+        )
+    }
+    for class_id in Class.objects.values_list('id', flat=True):
+        rollups.append(ReadingRollup(
+            class_code_id=class_id, **class_sessions.get(class_id, {}), **class_readers.get(class_id, {}),
+        ))
+    ReadingRollup.objects.bulk_create(rollups, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0016_story_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Backfills every story's engagement counters (see rollups.py) from its existing reading sessions, so the popularity
+# rankings are right straight after deploying
+
+from datetime import timedelta
+
+from django.db import migrations
+from django.db.models import Count, DurationField, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+COMPLETE = 100  # story_progress of a finished story (rollups.COMPLETE)
+
+
+def backfill_story_counters(apps, schema_editor):
+    ReadingSession = apps.get_model('users', 'ReadingSession')
+    Story = apps.get_model('users', 'Story')
+
+    per_story = ReadingSession.objects.filter(story_id=OuterRef('pk')).order_by().values('story_id')
+
+    def total(aggregate, zero, output_field=None):
+        return Coalesce(Subquery(per_story.annotate(value=aggregate).values('value')), zero, output_field=output_field)
+
+    Story.objects.update(
+        session_count=total(Count('id'), 0),
+        total_reading_time=total(Sum('total_reading_time'), timedelta(0), DurationField()),
+        completed_count=total(Count('id', filter=Q(story_progress__gte=COMPLETE)), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0017_build_reading_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_story_counters, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth.models import AbstractUser, Group
 from django.db import models
 from django.utils import timezone
 from datetime import timedelta
+import uuid
 
 # User model, broken down into admin, teacher and reader roles
 class User(AbstractUser):
@@ -39,6 +40,21 @@ class Story(models.Model):
     fulltext = models.TextField()
     difficulty_level = models.CharField(max_length=50)
     image = models.ImageField(upload_to='resources/story_images/')
+    phoneme_index = models.JSONField(default=dict, blank=True)  # Sentence offset -> expected phonemes (see story_index.py)
+    language = models.CharField(max_length=10, default='en')  # Reading language - picks the espeak voice and recognizer model
+    bundle_version = models.PositiveIntegerField(default=0)  # Bumped whenever the phoneme index is rebuilt (see story_index.py)
+    # Engagement counters over the story's reading sessions, kept up to date with them (see rollups.py)
+    session_count = models.PositiveBigIntegerField(default=0)
+    total_reading_time = models.DurationField(default=timedelta(0))
+    completed_count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        # The popularity rankings - id breaks ties, so pages of a ranking don't overlap
+        indexes = [
+            models.Index(fields=['session_count', 'id']),
+            models.Index(fields=['total_reading_time', 'id']),
+            models.Index(fields=['completed_count', 'id']),
+        ]
 
     def __str__(self):
         return self.title
@@ -85,3 +101,43 @@ class Student(models.Model):
         return f'{self.reader.username} in {self.class_code.class_code}'
 
 
+# Reading Rollup model - running sums and counts behind the reading analytics endpoints, over all readers (no class)
+# or over one class's readers; updated in the same transactions as the changes they summarize (see rollups.py)
+class ReadingRollup(models.Model):
+    class_code = models.OneToOneField(Class, null=True, blank=True, on_delete=models.CASCADE)
+    session_count = models.PositiveBigIntegerField(default=0)
+    reading_time = models.DurationField(default=timedelta(0))  # Sum of the sessions' total_reading_time
+    progress_sum = models.FloatField(default=0)  # Sum of the sessions' story_progress
+    completed_count = models.PositiveBigIntegerField(default=0)  # Sessions with story_progress 100
+    completed_reading_time = models.DurationField(default=timedelta(0))  # Sum of their total_reading_time
+    reader_count = models.PositiveBigIntegerField(default=0)
+    reading_level_sum = models.FloatField(default=0)
+
+    def __str__(self):
+        return f'Rollup of {self.class_code or "all readers"}'
+
+
+# Match Job model - an asynchronous /match-audio/ request, scored in the background and polled for its verdict
+class MatchJob(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    session = models.ForeignKey(ReadingSession, on_delete=models.CASCADE)
+    matching_text = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    match = models.BooleanField(null=True, blank=True)
+    words = models.JSONField(default=list, blank=True)  # Per-word results (see alignment.score_words)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.id} ({self.status})'
@@ -0,0 +1,75 @@
+'''Phoneme vocabulary - one integer encoding of phonemes, shared by the expected (espeak) and recognized (model) side
+
+The vocabulary is the recognizer's tokenizer vocabulary, so a multi-character phoneme (an affricate like "tʃ", a long
+vowel like "ɜː") is one id on both sides and counts as one edit when readings are compared.
+'''
+
+import threading
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+
+from .recognizer import get_processor
+
+_lock = threading.Lock()
+_vocabs = {}  # Model name -> vocabulary
+
+
+class PhonemeVocab:
+    def __init__(self, tokenizer):
+        special = set(tokenizer.all_special_tokens) | {getattr(tokenizer, 'word_delimiter_token', None), ' '}
+        self.tokens = {token: token_id for token, token_id in tokenizer.get_vocab().items() if token not in special}
+        self.longest = max(len(token) for token in self.tokens)
+        self.blank_id = tokenizer.pad_token_id
+        # Ids that aren't phonemes (blank, special tokens, word delimiter) - dropped from the model's output
+        self.phoneme_ids = np.zeros(len(tokenizer.get_vocab()), dtype=bool)
+        self.phoneme_ids[list(self.tokens.values())] = True
+        # Story sentences are encoded over and over (once per reading attempt) - keep the arrays
+        self.encode = lru_cache(maxsize=settings.PHONEME_CACHE_SIZE)(self._encode)
+
+    # Encode an IPA string (e.g. espeak output) as phoneme ids, longest match first
+    # Whitespace and characters the model can't emit (e.g. stress marks missing from its vocabulary) are skipped
+    def _encode(self, phonemes: str):
+        phonemes = ''.join(phonemes.split())
+        ids = []
+        i = 0
+        while i < len(phonemes):
+            for length in range(min(self.longest, len(phonemes) - i), 0, -1):
+                token_id = self.tokens.get(phonemes[i:i + length])
+                if token_id is not None:
+                    ids.append(token_id)
+                    i += length
+                    break
+            else:
+                i += 1
+        encoded = np.array(ids, dtype=np.int32)
+        encoded.flags.writeable = False  # Shared through the cache
+        return encoded
+
+    # Phoneme ids of a greedy CTC decode: collapse repeated frame ids, then drop blanks and non-phoneme tokens
+    def collapse(self, frame_ids):
+        frame_ids = np.asarray(frame_ids)
+        if len(frame_ids) == 0:
+            return frame_ids.astype(np.int32)
+        keep = np.ones(len(frame_ids), dtype=bool)
+        keep[1:] = frame_ids[1:] != frame_ids[:-1]
+        ids = frame_ids[keep]
+        return ids[self.phoneme_ids[ids]].astype(np.int32)
+
+    # Phoneme ids recognized in CTC log-probabilities (frames, vocab)
+    def recognized(self, log_probs):
+        return self.collapse(log_probs.argmax(axis=-1))
+
+
+# Return the vocabulary of a recognizer model, RECOGNIZER_MODEL_NAME by default (built once per process)
+# Each model has its own: ids are only comparable between sequences encoded with the same model's vocabulary
+def get_vocab(model_name=None):
+    model_name = model_name or settings.RECOGNIZER_MODEL_NAME
+    vocab = _vocabs.get(model_name)
+    if vocab is None:
+        with _lock:
+            vocab = _vocabs.get(model_name)
+            if vocab is None:
+                vocab = _vocabs[model_name] = PhonemeVocab(get_processor(model_name).tokenizer)
+    return vocab
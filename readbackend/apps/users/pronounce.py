@@ -1,8 +1,36 @@
-from lytspel import Converter
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+
+# lytspel is imported on first use - it pulls in spaCy (and its torch / thinc stack), which processes that never
+# respell a word (inference pool workers, most management commands) shouldn't pay for at startup
+_converter = None  # Process-wide converter - its dictionary and spaCy tagger are only loaded once
+_lock = threading.Lock()  # Converters are stateful (sentence-start tracking), so calls are serialized
+
 
 #lytspel pronounciation of a word (simple respelling)
+# Respellings are kept in a bounded LRU, so repeat lookups of a word skip lytspel entirely
+@lru_cache(maxsize=settings.PRONUNCIATION_CACHE_SIZE)
 def get_phonetic_spelling(text):
-    converter = Converter() 
-    phonetic_spelling = converter.convert_para(text)
- 
+    global _converter
+    with _lock:
+        if _converter is None:
+            from lytspel import Converter
+            _converter = Converter()
+        phonetic_spelling = _converter.convert_para(text)
+
     return phonetic_spelling
+
+
+# Function to respell several words in one go: {word: respelling}, in the order the words were given
+def get_phonetic_spellings(words):
+    return {word: get_phonetic_spelling(word) for word in dict.fromkeys(words)}
+
+
+# Function to split a sentence into its words (no punctuation, numbers or URLs), in order
+def sentence_words(text):
+    from lytspel import Converter
+    from lytspel.conv import TokenType
+
+    return [token for token_type, token in Converter.typed_tokenize(text) if token_type is TokenType.Word]
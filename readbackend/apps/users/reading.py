@@ -0,0 +1,152 @@
+'''Reading progress - applying match verdicts to reading sessions (shared by the HTTP and streaming endpoints)'''
+
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from . import metrics, recognizer, result_cache
+from .alignment import score_words, word_phonemes
+from .audio_processing import (
+    FRAME_SECONDS, LEVENSHTEIN_TOLERANCE, audio_to_waveform, cascade, compare_phonemes_with_levenshtein,
+    logits_to_phonemes, phoneme_similarity, text_to_phonemes, waveform_to_words,
+)
+from .models import ReadingSession
+from .phoneme_vocab import get_vocab
+from .rollups import record_session_change, session_totals
+from .story_index import lookup_phonemes
+from .transcript_scoring import score_transcript
+
+logger = logging.getLogger(__name__)
+
+CLAIM_POLL_INTERVAL = 0.05  # Seconds between checks on a clip another request is scoring
+
+
+# Score a recorded reading of matching_text against the sentence at the session's current position
+# Returns {"match": bool, "words": [per-word results, see alignment.score_words]}
+def score_reading(session, matching_text, audio_file):
+    # Expected phonemes come from the story's phoneme index when the sentence is indexed
+    text_phonemes = lookup_phonemes(session.story, session.current_position, matching_text)
+    language = session.story.language
+
+    # Word-transcribing backends (whisper) are always scored word by word
+    if recognizer.transcribes_words():
+        if text_phonemes is None:
+            text_phonemes = text_to_phonemes(matching_text, language)
+        recognized = waveform_to_words(audio_to_waveform(audio_file), language)
+        words = score_transcript(
+            recognized, word_phonemes(matching_text, text_phonemes, language), get_vocab(),
+            settings.WORD_SCORE_THRESHOLD, language,
+        )
+        return reading_verdict(words)
+
+    # Perform the phoneme matching
+    # match_result = compare_phonemes_with_sequence_matcher(audio_file, matching_text)
+    if settings.READING_SCORER == 'levenshtein':
+        match = compare_phonemes_with_levenshtein(
+            audio_file, matching_text, text_phonemes=text_phonemes, language=language,
+        )
+        return {'match': match, 'words': []}
+
+    if text_phonemes is None:
+        text_phonemes = text_to_phonemes(matching_text, language)
+    waveform = audio_to_waveform(audio_file)
+    expected_words = word_phonemes(matching_text, text_phonemes, language)
+
+    def score(log_probs, model_name):
+        return _word_scores(log_probs, model_name, expected_words)
+
+    # With the recognizer cascade on, the fast model decides unless a word's score is close to the pass mark
+    def is_uncertain(words):
+        margin = settings.RECOGNIZER_CASCADE_MARGIN
+        return any(
+            word['score'] is not None and abs(word['score'] - settings.WORD_SCORE_THRESHOLD) < margin for word in words
+        )
+
+    return reading_verdict(cascade(waveform, score, is_uncertain, language))
+
+
+# Score a reading from CTC log-probabilities the caller already has (the streaming endpoint's final transcription)
+# with READING_SCORER, exactly as score_reading scores the model's output for an uploaded clip
+def score_log_probs(log_probs, model_name, matching_text, text_phonemes, language):
+    if settings.READING_SCORER == 'levenshtein':
+        match = phoneme_similarity(log_probs, text_phonemes, model_name) >= 1 - LEVENSHTEIN_TOLERANCE
+        return {'match': match, 'words': []}
+
+    expected_words = word_phonemes(matching_text, text_phonemes, language)
+    return reading_verdict(_word_scores(log_probs, model_name, expected_words))
+
+
+# Per-word scores of a reading (see alignment.score_words)
+def _word_scores(log_probs, model_name, expected_words):
+    logits_to_phonemes(log_probs, model_name)  # Logged for debugging, as with the Levenshtein scorer
+    return score_words(log_probs, expected_words, get_vocab(model_name), FRAME_SECONDS)
+
+
+# The sentence counts as read unless more than MATCH_WORD_TOLERANCE of its readable words failed
+# Skipped words (no score, but correct - punctuation) don't count; a sentence with no readable words at all means
+# phonemization failed, and fails rather than passing every reading
+def reading_verdict(words):
+    scored = [word for word in words if word['score'] is not None or not word['correct']]
+    failed = [word for word in scored if not word['correct']]
+    logger.debug("Failed words: %s", [word['word'] for word in failed])
+    match = bool(scored) and len(failed) <= settings.MATCH_WORD_TOLERANCE * len(scored)
+    return {'match': match, 'words': words}
+
+
+# Response body for a scored reading: the verdict, the words to re-prompt, and the per-word detail
+def reading_result_data(result):
+    return {
+        'match': result['match'],
+        'failed_words': [word['word'] for word in result['words'] if not word['correct']],
+        'words': result['words'],
+    }
+
+
+# Score a reading attempt unless the identical clip was already scored for this sentence (a client retry)
+# apply(result) is called only for a new verdict, before it is cached, so retries aren't counted twice; if scoring
+# or applying fails the claim is released and a retry scores the clip again. Returns (result, is_new)
+def score_reading_once(session, matching_text, audio_file, apply):
+    key = result_cache.cache_key(session.id, matching_text, audio_file)
+    while True:
+        if result_cache.claim(key):
+            metrics.increment('match_cache_misses')
+            try:
+                result = score_reading(session, matching_text, audio_file)
+                apply(result)
+            except BaseException:
+                result_cache.release(key)
+                raise
+            result_cache.store(key, result)
+            return result, True
+
+        cached = result_cache.get(key)
+        if cached is not None and cached != result_cache.PENDING:
+            metrics.increment('match_cache_hits')
+            return cached, False
+
+        # A concurrent retry of the same clip is being scored - wait for its verdict (or its claim to be released)
+        time.sleep(CLAIM_POLL_INTERVAL)
+
+
+# Apply the result of a reading attempt to a session: count an error, or advance past the sentence that was read
+# Row-locked so concurrent attempts on the same session can't lose updates
+def record_match_result(session_id, matching_text, match_result):
+    with transaction.atomic():
+        session = ReadingSession.objects.select_for_update().get(id=session_id)
+        before = session_totals(session)
+        
+        if not match_result:
+            session.total_errors += 1
+        else:
+            # Update the current position
+            current_position = session.current_position
+            next_position = current_position + len(matching_text)
+            
+            # Ensure we don't exceed the story length
+            session.current_position = min(next_position, len(session.story.fulltext))
+
+        session.save()
+        record_session_change(session.user_id, before, session_totals(session))
+    return session
@@ -0,0 +1,345 @@
+'''Recognizer provider - pluggable recognizer backends, loaded on first use instead of at import time
+
+Two kinds of backend:
+  - CTC phoneme models (torch, onnx) turn audio into phoneme logits - see Recognizer.forward
+  - word transcribers (whisper) turn audio into timed words, which are phonemized for scoring - see
+    WhisperRecognizer.transcribe
+'''
+
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()  # Guards the registries below - never held while a model loads
+_recognizers = OrderedDict()  # Model name -> recognizer, least recently used first
+_sizes = {}  # Model name -> bytes of the loaded recognizer's weights
+_load_locks = {}  # Model name -> lock held while that model (or its processor) loads
+_processors = {}  # Model name -> processor, for models that aren't loaded in this process
+_configs = {}  # Model name -> config, for models that aren't loaded in this process
+_warm = threading.Event()
+_warm_up_thread = None
+
+
+class Recognizer:
+    """
+    Base class for CTC recognizer backends. A backend only has to turn a padded batch of input values into
+    CTC logits (forward); feature extraction and decoding use the model's Wav2Vec2Processor, shared by all backends.
+    """
+    name = None
+    transcribes_words = False
+
+    def __init__(self, model_name):
+        from transformers import AutoConfig, Wav2Vec2Processor
+
+        self.model_name = model_name
+        self.processor = Wav2Vec2Processor.from_pretrained(model_name)
+        self.config = AutoConfig.from_pretrained(model_name)
+
+    # Whether padded batches should carry an attention mask (models with layer-norm feature extractors)
+    @property
+    def uses_attention_mask(self):
+        return self.processor.feature_extractor.return_attention_mask
+
+    # input_values: float32 array (batch, samples); attention_mask: int array (batch, samples) or None
+    # Returns float32 logits (batch, frames, vocab)
+    def forward(self, input_values, attention_mask=None):
+        raise NotImplementedError
+
+    # Number of logit frames produced for inputs of the given lengths (in samples) - the conv feature encoder's output length
+    def output_lengths(self, input_lengths):
+        for kernel, stride in zip(self.config.conv_kernel, self.config.conv_stride):
+            input_lengths = (input_lengths - kernel) // stride + 1
+        return input_lengths
+
+    # Run one dummy forward pass so the first real request doesn't pay for lazy initialisation
+    def warm_up(self):
+        import numpy as np
+
+        self.forward(np.zeros((1, 16000), dtype=np.float32))
+
+    # Approximate resident size of the model's weights, for the registry's memory budget
+    def memory_bytes(self):
+        raise NotImplementedError
+
+
+# PyTorch backend - the original Wav2Vec2ForCTC model
+class TorchRecognizer(Recognizer):
+    name = 'torch'
+
+    def __init__(self, model_name):
+        import torch
+        from transformers import Wav2Vec2ForCTC
+
+        super().__init__(model_name)
+        torch.set_num_threads(settings.RECOGNIZER_TORCH_THREADS)
+        self.model = Wav2Vec2ForCTC.from_pretrained(model_name)
+        self.model.eval()
+
+    def forward(self, input_values, attention_mask=None):
+        import torch
+
+        with torch.no_grad():
+            logits = self.model(
+                torch.from_numpy(input_values),
+                attention_mask=torch.from_numpy(attention_mask) if attention_mask is not None else None,
+            ).logits
+        return logits.numpy()
+
+    def memory_bytes(self):
+        tensors = list(self.model.parameters()) + list(self.model.buffers())
+        return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+    def warm_up(self):
+        import torch
+
+        # Keep the master single-threaded: an OpenMP pool started before fork() is not usable in the children
+        num_threads = torch.get_num_threads()
+        torch.set_num_threads(1)
+        try:
+            super().warm_up()
+        finally:
+            torch.set_num_threads(num_threads)
+
+
+# ONNX Runtime backend - an exported (and normally int8 dynamically quantized) copy of the model, see the export_onnx command
+class OnnxRecognizer(Recognizer):
+    name = 'onnx'
+
+    def __init__(self, model_name, onnx_path=None):
+        import onnxruntime
+
+        super().__init__(model_name)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = settings.RECOGNIZER_TORCH_THREADS
+        self.onnx_path = onnx_path or settings.RECOGNIZER_ONNX_PATH
+        self.session = onnxruntime.InferenceSession(self.onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {graph_input.name for graph_input in self.session.get_inputs()}
+
+    def forward(self, input_values, attention_mask=None):
+        import numpy as np
+
+        feeds = {'input_values': input_values}
+        # The graph is exported with an attention_mask input when the model uses one
+        if 'attention_mask' in self.input_names:
+            if attention_mask is None:
+                attention_mask = np.ones(input_values.shape, dtype=np.int64)
+            feeds['attention_mask'] = attention_mask.astype(np.int64, copy=False)
+        return self.session.run(['logits'], feeds)[0]
+
+    def memory_bytes(self):
+        return os.path.getsize(self.onnx_path)
+
+
+# faster-whisper backend - a CTranslate2 Whisper model (int8 by default) that transcribes words instead of phonemes
+# The words are phonemized with espeak and compared with the expected words (see transcript_scoring); the phoneme
+# vocabulary still comes from RECOGNIZER_MODEL_NAME's tokenizer
+class WhisperRecognizer:
+    name = 'whisper'
+    transcribes_words = True
+
+    def __init__(self, model_name=None):
+        from faster_whisper import WhisperModel
+        from faster_whisper.utils import download_model
+
+        self.model_name = settings.RECOGNIZER_WHISPER_MODEL
+        # Model size names ('base.en') resolve to the downloaded CTranslate2 model directory
+        self.model_path = self.model_name if os.path.isdir(self.model_name) else download_model(self.model_name)
+        self.model = WhisperModel(
+            self.model_path, device='cpu', compute_type=settings.RECOGNIZER_WHISPER_COMPUTE_TYPE,
+            cpu_threads=settings.RECOGNIZER_TORCH_THREADS,
+        )
+
+    # waveform: 16 kHz mono float32 array; language: reading language (e.g. 'en', RECOGNIZER_WHISPER_LANGUAGE by default)
+    # Returns [(word, start seconds, end seconds, probability)]
+    def transcribe(self, waveform, language=None):
+        # Greedy decoding without conditioning on earlier text: one sentence per clip, and the cheapest settings
+        segments, _ = self.model.transcribe(
+            waveform, language=(language or settings.RECOGNIZER_WHISPER_LANGUAGE).split('-')[0], beam_size=1,
+            word_timestamps=True, condition_on_previous_text=False,
+        )
+        return [
+            (word.word.strip(), word.start, word.end, word.probability)
+            for segment in segments for word in segment.words
+        ]
+
+    def warm_up(self):
+        import numpy as np
+
+        self.transcribe(np.zeros(16000, dtype=np.float32))
+
+    # The CTranslate2 model is held in memory at about its size on disk (int8 weights are converted at load)
+    def memory_bytes(self):
+        return sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(self.model_path) for name in names
+        )
+
+
+BACKENDS = {
+    TorchRecognizer.name: TorchRecognizer,
+    OnnxRecognizer.name: OnnxRecognizer,
+    WhisperRecognizer.name: WhisperRecognizer,
+}
+
+
+# Construct a recognizer backend by name (defaults to the RECOGNIZER_BACKEND setting)
+def create_recognizer(backend=None, model_name=None):
+    backend = backend or settings.RECOGNIZER_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown recognizer backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+
+    start = time.perf_counter()
+    # Heavy libraries are only imported here so management commands and tests never pay for them
+    if not BACKENDS[backend].transcribes_words:
+        import transformers  # noqa: F401
+        logger.info("Imported transformers in %.2fs", time.perf_counter() - start)
+    imported = time.perf_counter()
+
+    recognizer = BACKENDS[backend](model_name or settings.RECOGNIZER_MODEL_NAME)
+    logger.info("Loaded %s recognizer %s in %.2fs", backend, recognizer.model_name, time.perf_counter() - imported)
+    return recognizer
+
+
+# Return the recognizer model for a reading language (see RECOGNIZER_LANGUAGE_MODELS)
+# Languages without a dedicated model use RECOGNIZER_MODEL_NAME - the default XLSR-53 espeak model is multilingual
+def model_for_language(language=None):
+    language = language or settings.READING_DEFAULT_LANGUAGE
+    return settings.RECOGNIZER_LANGUAGE_MODELS.get(language, settings.RECOGNIZER_MODEL_NAME)
+
+
+# Load (once) and return this process's recognizer for a model (RECOGNIZER_MODEL_NAME by default)
+# Thread-safe: concurrent first requests for a model wait for a single load rather than each loading their own copy,
+# while requests for models already loaded carry on - only the registry updates are under the global lock
+# Only the main model uses RECOGNIZER_BACKEND (the ONNX export is of that model); others run on torch
+# Loaded models are kept in a least-recently-used registry bounded by RECOGNIZER_MEMORY_BUDGET_MB
+def get_recognizer(model_name=None):
+    model_name = model_name or settings.RECOGNIZER_MODEL_NAME
+    recognizer = _lookup(model_name)
+    if recognizer is not None:
+        return recognizer
+
+    with _load_lock(model_name):
+        recognizer = _lookup(model_name)
+        if recognizer is None:
+            backend = None if model_name == settings.RECOGNIZER_MODEL_NAME else TorchRecognizer.name
+            recognizer = create_recognizer(backend, model_name)
+            size = recognizer.memory_bytes()
+            with _lock:
+                _recognizers[model_name] = recognizer
+                _sizes[model_name] = size
+                _evict(keep=model_name)
+    return recognizer
+
+
+# The loaded recognizer for a model (marked most recently used), or None
+def _lookup(model_name):
+    with _lock:
+        recognizer = _recognizers.get(model_name)
+        if recognizer is not None:
+            _recognizers.move_to_end(model_name)
+        return recognizer
+
+
+# The lock serializing loads of one model
+def _load_lock(model_name):
+    with _lock:
+        return _load_locks.setdefault(model_name, threading.Lock())
+
+
+# Called with the lock held: unload least recently used models until the registry fits its memory budget
+# The main model (which readiness depends on) is never evicted. A request still using an evicted model keeps its
+# reference; the weights are freed once it finishes
+def _evict(keep):
+    budget = settings.RECOGNIZER_MEMORY_BUDGET_MB * 1024 * 1024
+    for model_name in list(_recognizers):
+        if sum(_sizes.values()) <= budget:
+            break
+        if model_name in (keep, settings.RECOGNIZER_MODEL_NAME):
+            continue
+        del _recognizers[model_name]
+        logger.info("Evicted recognizer %s (%.0f MB) to stay within the memory budget",
+                    model_name, _sizes.pop(model_name) / 1024 / 1024)
+        metrics.increment('recognizer_evictions')
+
+
+# Return a model's processor (feature extractor + tokenizer) without loading the model itself
+# Used to decode logits in processes that leave inference to the worker pool
+def get_processor(model_name=None):
+    model_name = model_name or settings.RECOGNIZER_MODEL_NAME
+    recognizer = _recognizers.get(model_name)
+    if recognizer is not None and not recognizer.transcribes_words:
+        return recognizer.processor
+    processor = _processors.get(model_name)
+    if processor is None:
+        with _load_lock(model_name):
+            processor = _processors.get(model_name)
+            if processor is None:
+                from transformers import Wav2Vec2Processor
+                processor = _processors[model_name] = Wav2Vec2Processor.from_pretrained(model_name)
+    return processor
+
+
+# Return a model's config (e.g. the conv strides that set its frame rate) without loading the model itself
+def get_config(model_name=None):
+    model_name = model_name or settings.RECOGNIZER_MODEL_NAME
+    recognizer = _recognizers.get(model_name)
+    if recognizer is not None and not recognizer.transcribes_words:
+        return recognizer.config
+    config = _configs.get(model_name)
+    if config is None:
+        with _load_lock(model_name):
+            config = _configs.get(model_name)
+            if config is None:
+                from transformers import AutoConfig
+                config = _configs[model_name] = AutoConfig.from_pretrained(model_name)
+    return config
+
+
+# Whether the configured backend transcribes words (whisper) rather than emitting CTC phoneme logits
+def transcribes_words():
+    return BACKENDS[settings.RECOGNIZER_BACKEND].transcribes_words
+
+
+# Whether the recognizer has already been loaded in this process
+def is_loaded():
+    return settings.RECOGNIZER_MODEL_NAME in _recognizers
+
+
+# Whether the recognizer has been loaded and has run its warm-up forward pass (used by the readiness endpoint)
+def is_ready():
+    return _warm.is_set()
+
+
+# Load the recognizer (and the fast cascade tier, if enabled) and run their warm-up passes
+# Called in the gunicorn master (preload mode) so forked workers share the weights copy-on-write
+def warm_up():
+    recognizers = [get_recognizer()]
+    if settings.RECOGNIZER_CASCADE:
+        recognizers.append(get_recognizer(settings.RECOGNIZER_FAST_MODEL_NAME))
+    if _warm.is_set():
+        return
+
+    start = time.perf_counter()
+    for recognizer in recognizers:
+        recognizer.warm_up()
+    _warm.set()
+    logger.info("Recognizer warm-up finished in %.2fs", time.perf_counter() - start)
+
+
+# Start warm-up in a background thread (once) - lets lazily-loading workers warm themselves from readiness probes
+def start_warm_up():
+    global _warm_up_thread
+
+    with _lock:
+        if _warm.is_set() or _warm_up_thread is not None:
+            return
+        _warm_up_thread = threading.Thread(target=warm_up, name='recognizer-warm-up', daemon=True)
+    _warm_up_thread.start()
@@ -0,0 +1,49 @@
+'''Match result cache - a retried upload of the same clip gets the original verdict instead of being re-scored
+
+Keyed by the session, an xxhash of the audio bytes and the normalized matching_text. Backed by the 'match_results'
+cache (see CACHES in settings), which sets the TTL and size cap. A clip is claimed with a PENDING marker before it
+is scored, so a concurrent retry waits for the first verdict instead of running the model again.
+'''
+
+import xxhash
+from django.conf import settings
+from django.core.cache import caches
+
+CACHE_ALIAS = 'match_results'
+PENDING = 'pending'  # Marker of a clip that is being scored
+
+
+# Function to build the cache key of a reading attempt; leaves audio_file rewound for scoring
+def cache_key(session_id, matching_text, audio_file) -> str:
+    hasher = xxhash.xxh3_128()
+    if hasattr(audio_file, 'chunks'):
+        for chunk in audio_file.chunks():
+            hasher.update(chunk)
+    else:
+        hasher.update(audio_file.read())
+    audio_file.seek(0)
+
+    normalized_text = ' '.join(matching_text.split())
+    text_hash = xxhash.xxh3_64_hexdigest(normalized_text.encode('utf-8'))
+    return f'match:{session_id}:{hasher.hexdigest()}:{text_hash}'
+
+
+# Function to return the cached entry for a key: a verdict, PENDING while it is being scored, or None
+def get(key):
+    return caches[CACHE_ALIAS].get(key)
+
+
+# Function to claim a clip for scoring - returns True if this caller should score it and apply the verdict
+# (cache.add is atomic, so concurrent retries can't both win; the claim expires if its holder never finishes)
+def claim(key) -> bool:
+    return caches[CACHE_ALIAS].add(key, PENDING, timeout=settings.MATCH_CACHE_CLAIM_TIMEOUT)
+
+
+# Function to replace a claim with its verdict, for the cache's usual TTL
+def store(key, result):
+    caches[CACHE_ALIAS].set(key, result)
+
+
+# Function to drop a claim whose scoring failed, so a retry of the clip can score it again
+def release(key):
+    caches[CACHE_ALIAS].delete(key)
@@ -0,0 +1,223 @@
+'''Reading rollups - running sums and counts behind the reading analytics endpoints, so they read one row rather than
+aggregating every session or reader on each call
+
+There is one rollup over all readers (no class) and one per class, over the class's current students, and each story
+carries counters over its own sessions (for the popularity rankings). Each change is applied as a single UPDATE of the
+global row and the rows of the reader's classes, plus one of the story, inside the transaction that makes the change.
+Writes that go around these functions (the admin site, bulk inserts, generic model edits) leave the rollups drifting
+until they're rebuilt (rebuild_rollups / the rebuild_rollups command). Migrations 0017 and 0018 build them over the
+data that existed before them.
+'''
+
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, DurationField, F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Class, ReadingRollup, ReadingSession, Story, Student, User
+
+COMPLETE = 100  # story_progress of a finished story
+
+
+# Function to snapshot what the rollups sum of a session - taken before and after a change for record_session_change
+def session_totals(session):
+    return session.story_id, session.story_progress, session.total_reading_time
+
+
+# Function to apply a change to one reader's session: before / after are session_totals, None for a new / deleted one
+def record_session_change(user_id, before, after):
+    _, progress_before, time_before = before or (None, 0.0, timedelta(0))
+    _, progress_after, time_after = after or (None, 0.0, timedelta(0))
+    completed_before = before is not None and progress_before >= COMPLETE
+    completed_after = after is not None and progress_after >= COMPLETE
+    _update(
+        _rollups_of(user_id),
+        session_count=(after is not None) - (before is not None),
+        reading_time=time_after - time_before,
+        progress_sum=progress_after - progress_before,
+        completed_count=completed_after - completed_before,
+        completed_reading_time=(time_after if completed_after else timedelta(0))
+        - (time_before if completed_before else timedelta(0)),
+    )
+
+    # The story's counters - one UPDATE, or one per story if the session moved to another story
+    stories = {}
+    for totals, sign in ((before, -1), (after, 1)):
+        if totals is not None:
+            story_id, progress, reading_time = totals
+            deltas = stories.setdefault(story_id, {'session_count': 0, 'total_reading_time': timedelta(0),
+                                                   'completed_count': 0})
+            deltas['session_count'] += sign
+            deltas['total_reading_time'] += sign * reading_time
+            deltas['completed_count'] += sign * (progress >= COMPLETE)
+    for story_id, deltas in stories.items():
+        _update(Story.objects.filter(id=story_id), **deltas)
+
+
+# Function to apply a change of a user's reading level, and of their role when previous_role is given
+def record_reading_level_change(user, previous_level, previous_role=None):
+    was_reader = (previous_role or user.role) == 'reader'
+    is_reader = user.role == 'reader'
+    if was_reader or is_reader:
+        # Class rollups count every student; the global rollup only counts users with the reader role
+        _update(_rollups_of(user.id).filter(class_code__isnull=False),
+                reading_level_sum=user.reading_level - previous_level)
+        _update(ReadingRollup.objects.filter(class_code__isnull=True), reader_count=is_reader - was_reader,
+                reading_level_sum=user.reading_level * is_reader - previous_level * was_reader)
+
+
+# Function to count a newly created reader (who isn't in any class yet)
+def record_reader_added(user):
+    if user.role == 'reader':
+        _update(ReadingRollup.objects.filter(class_code__isnull=True), reader_count=1,
+                reading_level_sum=user.reading_level)
+
+
+# Function to take a deleted user, their sessions and their class places out of the rollups - before the delete
+def record_user_removed(user):
+    for student in Student.objects.filter(reader_id=user.id):
+        record_enrolment(student, sign=-1)
+    sessions = ReadingSession.objects.filter(user_id=user.id).aggregate(**_session_sums())
+    is_reader = user.role == 'reader'
+    _update(
+        ReadingRollup.objects.filter(class_code__isnull=True),
+        reader_count=-is_reader, reading_level_sum=-user.reading_level * is_reader,
+        **{field: -value for field, value in _clean(sessions).items()},
+    )
+    # Every story they read loses their sessions
+    sessions = ReadingSession.objects.filter(user_id=user.id)
+    Story.objects.filter(id__in=sessions.values('story_id')).update(**{
+        field: F(field) - total for field, total in _subtotals(sessions, 'story_id', 'pk', _story_sums()).items()
+    })
+
+
+# Function to take a deleted story's sessions out of the rollups - before the delete
+def record_story_removed(story):
+    sessions = ReadingSession.objects.filter(story_id=story.id)
+    _update(ReadingRollup.objects.filter(class_code__isnull=True),
+            **{field: -value for field, value in _clean(sessions.aggregate(**_session_sums())).items()})
+    # Each class loses the sessions of its students
+    ReadingRollup.objects.filter(class_code__student__reader__readingsession__story_id=story.id).update(**{
+        field: F(field) - total
+        for field, total in _subtotals(sessions, 'user__student__class_code', 'class_code', _session_sums()).items()
+    })
+
+
+# Function to add (sign=1) or remove (sign=-1) a reader and their sessions to / from a class's rollup
+def record_enrolment(student, sign=1):
+    sessions = ReadingSession.objects.filter(user_id=student.reader_id).aggregate(**_session_sums())
+    # Read from the database - student.reader may be a stale copy, like the request's user
+    reading_level = User.objects.values_list('reading_level', flat=True).get(id=student.reader_id)
+    _update(
+        ReadingRollup.objects.filter(class_code_id=student.class_code_id),
+        reader_count=sign, reading_level_sum=sign * reading_level,
+        **{field: sign * value for field, value in _clean(sessions).items()},
+    )
+
+
+# Function to start the (empty) rollup of a new class
+def create_class_rollup(studentclass):
+    ReadingRollup.objects.create(class_code=studentclass)
+
+
+# Function to return the rollup of a class (by class code), or over all readers - None if there isn't one
+def get_rollup(class_code=None):
+    if class_code:
+        return ReadingRollup.objects.filter(class_code__class_code=class_code).first()
+    return ReadingRollup.objects.filter(class_code__isnull=True).first()
+
+
+# Function to recompute every rollup from the sessions and readers - fixes any drift
+def rebuild_rollups():
+    with transaction.atomic():
+        ReadingRollup.objects.all().delete()
+
+        sessions = _clean(ReadingSession.objects.aggregate(**_session_sums()))
+        readers = _clean(User.objects.filter(role='reader').aggregate(
+            reader_count=Count('id'), reading_level_sum=Sum('reading_level'),
+        ))
+        rollups = [ReadingRollup(class_code=None, **sessions, **readers)]
+
+        # Sessions and readers are grouped in separate queries - joining both would count each session per student row
+        class_sessions = {
+            row.pop('class_code'): _clean(row)
+            for row in Student.objects.values('class_code').annotate(**_session_sums('reader__readingsession__'))
+        }
+        class_readers = {
+            row.pop('class_code'): _clean(row)
+            for row in Student.objects.values('class_code').annotate(
+                reader_count=Count('id'), reading_level_sum=Sum('reader__reading_level'),
+            )
+        }
+        for class_id in Class.objects.values_list('id', flat=True):
+            rollups.append(ReadingRollup(
+                class_code_id=class_id, **class_sessions.get(class_id, {}), **class_readers.get(class_id, {}),
+            ))
+        ReadingRollup.objects.bulk_create(rollups, batch_size=1000)
+
+        Story.objects.update(**_subtotals(ReadingSession.objects.all(), 'story_id', 'pk', _story_sums()))
+    return len(rollups)
+
+
+# Aggregates matching the rollup's session fields, over sessions reached through `path`
+def _session_sums(path=''):
+    completed = Q(**{f'{path}story_progress__gte': COMPLETE})
+    return {
+        'session_count': Count(f'{path}id'),
+        'reading_time': Sum(f'{path}total_reading_time'),
+        'progress_sum': Sum(f'{path}story_progress'),
+        'completed_count': Count(f'{path}id', filter=completed),
+        'completed_reading_time': Sum(f'{path}total_reading_time', filter=completed),
+    }
+
+
+# Aggregates matching the story counters
+def _story_sums():
+    return {
+        'session_count': Count('id'),
+        'total_reading_time': Sum('total_reading_time'),
+        'completed_count': Count('id', filter=Q(story_progress__gte=COMPLETE)),
+    }
+
+
+# Aggregates over the `sessions` whose `lookup` matches the `outer` field of each row updated, as subqueries for a
+# single UPDATE (rather than one per row)
+def _subtotals(sessions, lookup, outer, aggregates):
+    grouped = sessions.filter(**{lookup: OuterRef(outer)}).order_by().values(lookup)
+    return {
+        field: Coalesce(
+            Subquery(grouped.annotate(value=aggregate).values('value')),
+            _zero(field),
+            output_field=DurationField() if field.endswith('time') else None,
+        )
+        for field, aggregate in aggregates.items()
+    }
+
+
+# The value of a field with nothing summed
+def _zero(field):
+    if field.endswith('time'):
+        return timedelta(0)
+    return 0.0 if field.endswith('sum') else 0
+
+
+# Sums over no rows are None - the rollup stores zeros
+def _clean(values):
+    return {
+        field: value if value is not None else _zero(field)
+        for field, value in values.items()
+    }
+
+
+# The global rollup and the rollups of every class the reader is in
+def _rollups_of(user_id):
+    return ReadingRollup.objects.filter(
+        Q(class_code__isnull=True) | Q(class_code__in=Student.objects.filter(reader_id=user_id).values('class_code'))
+    )
+
+
+def _update(rollups, **deltas):
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if changes:
+        rollups.update(**changes)
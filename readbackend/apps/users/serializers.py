@@ -1,5 +1,6 @@
 '''Serializers for each model - used in creation and parsing of models'''
 
+from django.conf import settings
 from rest_framework import serializers
 from .models import User, Story, ReadingSession, Class, Student
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
@@ -36,7 +37,22 @@ class UserSerializer(serializers.ModelSerializer):
 class StorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Story
-        fields = ['id', 'title', 'description', 'fulltext', 'difficulty_level', 'image']
+        fields = ['id', 'title', 'description', 'fulltext', 'difficulty_level', 'image', 'language', 'bundle_version']
+        read_only_fields = ['bundle_version']
+
+    # Only configured languages - espeak phonemizes an unknown voice to nothing
+    def validate_language(self, value):
+        if value not in settings.READING_LANGUAGES:
+            raise serializers.ValidationError(f"Unsupported language - one of {', '.join(settings.READING_LANGUAGES)}.")
+        return value
+
+# A story's entry in the popularity rankings - its listing fields and engagement counters, without the full text
+class StoryRankingSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Story
+        fields = ['id', 'title', 'description', 'difficulty_level', 'image', 'language', 'session_count',
+                  'total_reading_time', 'completed_count']
+        read_only_fields = fields
 
 class ReadingSessionSerializer(serializers.ModelSerializer):
     class Meta:
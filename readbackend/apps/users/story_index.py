@@ -0,0 +1,87 @@
+'''Story phoneme index - each story's sentences are phonemized once (on create / update) rather than on every reading attempt
+
+The index doubles as the story's sentence bundle: each sentence's offset, expected phonemes and lytspel respellings,
+versioned by Story.bundle_version so clients can prefetch upcoming sentences and know when their copy is stale.
+'''
+
+import re
+
+from django.conf import settings
+
+from .audio_processing import text_to_phonemes
+from .pronounce import get_phonetic_spellings, sentence_words
+
+# A sentence runs up to and including its terminal punctuation (and any closing quotes / brackets)
+SENTENCE_PATTERN = re.compile(r'[^.!?]+(?:[.!?]+["\'”’)\]]*|$)')
+
+
+# Function to split a story's fulltext into (character offset, sentence) pairs
+def split_sentences(fulltext: str):
+    sentences = []
+    for match in SENTENCE_PATTERN.finditer(fulltext):
+        sentence = match.group()
+        stripped = sentence.lstrip()
+        offset = match.start() + (len(sentence) - len(stripped))
+        stripped = stripped.rstrip()
+        if stripped:
+            sentences.append((offset, stripped))
+    return sentences
+
+
+# Function to build a story's phoneme index: {"<offset>": {"text": sentence, "phonemes": ipa, "respellings": {word: respelling}}}
+def build_phoneme_index(fulltext: str, language: str = None) -> dict:
+    return {
+        str(offset): {
+            'text': sentence,
+            'phonemes': text_to_phonemes(sentence, language),
+            'respellings': sentence_respellings(sentence, language),
+        }
+        for offset, sentence in split_sentences(fulltext)
+    }
+
+
+# Function to respell a sentence's words with lytspel, which only knows English (other languages get none)
+def sentence_respellings(sentence: str, language: str = None) -> dict:
+    if (language or settings.READING_DEFAULT_LANGUAGE).split('-')[0] != 'en':
+        return {}
+    return get_phonetic_spellings(sentence_words(sentence))
+
+
+# Function to (re)index a story - call whenever its fulltext or language is created or changed
+def index_story(story, save=True):
+    story.phoneme_index = build_phoneme_index(story.fulltext, story.language)
+    story.bundle_version += 1
+    if save:
+        story.save(update_fields=['phoneme_index', 'bundle_version'])
+
+
+# Function to look up the expected phonemes of the sentence being read at a session's current position
+# Returns None when the text doesn't match the indexed sentence (e.g. the client split the text differently)
+def lookup_phonemes(story, position: int, matching_text: str):
+    index = story.phoneme_index or {}
+    fulltext = story.fulltext
+
+    # Skip any whitespace between the end of the previous sentence and the start of this one
+    while position < len(fulltext) and fulltext[position].isspace():
+        position += 1
+
+    entry = index.get(str(position))
+    if entry and entry['text'] == matching_text.strip():
+        return entry['phonemes']
+    return None
+
+
+# Function to return the bundle of (at most) `count` sentences starting at `position`, in reading order
+# [{"offset", "text", "phonemes", "respellings"}] - sentences indexed before respellings were added are respelled here
+def story_bundle(story, position: int, count: int):
+    index = story.phoneme_index or {}
+    offsets = sorted(offset for offset in map(int, index) if offset >= position)[:count]
+
+    sentences = []
+    for offset in offsets:
+        entry = index[str(offset)]
+        respellings = entry.get('respellings')
+        if respellings is None:
+            respellings = sentence_respellings(entry['text'], story.language)
+        sentences.append({'offset': offset, 'text': entry['text'], 'phonemes': entry['phonemes'], 'respellings': respellings})
+    return sentences
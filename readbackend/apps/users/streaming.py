@@ -0,0 +1,249 @@
+'''Streaming recognition - a WebSocket endpoint that scores a sentence while the reader is still reading it
+
+Protocol (ws://<host>/ws/match-audio/):
+  1. Client sends a JSON text message: {"session_id": ..., "matching_text": ...,
+                                        "format": "s16le" | "f32le" (default s16le), "sample_rate": 48000 (default 16000)}
+  2. Client sends raw mono PCM audio as binary messages while the child reads
+  3. Server pushes {"type": "partial", "phonemes": ..., "similarity": ...} as the transcription grows
+  4. Client sends {"type": "end"} when the sentence is finished
+  5. Server replies {"type": "final", "match": true/false, "failed_words": [...], "words": [...], "phonemes": ...},
+     scored with READING_SCORER and applied to the ReadingSession exactly as /match-audio/ does, and closes the socket
+
+With INFERENCE_POOL_ADDRESS set, each decoding step is sent to the inference pool like any other batch, so the
+web process only loads the model's processor and config.
+'''
+
+import json
+import logging
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .audio_processing import SAMPLE_RATE, run_batch, text_to_phonemes, normalize_phonemes, levenshtein_similarity
+from .models import ReadingSession
+from .phoneme_vocab import get_vocab
+from .reading import reading_result_data, record_match_result, score_log_probs
+from .recognizer import get_config, get_processor, model_for_language, transcribes_words
+from .story_index import lookup_phonemes
+
+logger = logging.getLogger(__name__)
+
+PATH = '/ws/match-audio/'
+SAMPLE_FORMATS = {'s16le': np.int16, 'f32le': np.float32}
+
+
+class IncrementalDecoder:
+    """
+    Incremental greedy CTC decoding over a sliding window.
+
+    Each step only re-runs the recognizer over the audio that hasn't been committed yet, plus `context_ms` of
+    already-committed audio on the left. Frames more than `lookahead_ms` from the end of the audio are committed
+    (their argmax won't change with more right context); the rest are tentative and recomputed next step.
+    Audio that can no longer be part of a window is discarded, so per-step cost and memory stay bounded.
+    """
+
+    def __init__(self, model_name, vocab, step_ms, context_ms, lookahead_ms):
+        self.model_name = model_name
+        self.processor = get_processor(model_name)
+        self.vocab = vocab
+        self.hop = int(np.prod(get_config(model_name).conv_stride))  # Samples per logit frame
+        self.step = SAMPLE_RATE * step_ms // 1000
+        self.context = self._to_hops(SAMPLE_RATE * context_ms // 1000)
+        self.lookahead = SAMPLE_RATE * lookahead_ms // 1000
+
+        self.buffer = np.zeros(0, dtype=np.float32)  # Audio from buffer_start onwards
+        self.buffer_start = 0  # Absolute sample index of buffer[0]
+        self.total = 0  # Samples received so far
+        self.committed = 0  # Absolute sample index up to which frames are committed (a multiple of hop)
+        self.committed_ids = []
+        self.tentative_ids = []
+        self.committed_log_probs = []  # CTC log-probabilities of the committed frames, kept for the final verdict
+        self.tentative_log_probs = np.zeros((0, len(vocab.phoneme_ids)), dtype=np.float32)
+        self.last_step = 0
+
+    # Add 16 kHz float32 samples; returns True when a new partial transcription was computed
+    def feed(self, samples):
+        self.buffer = np.concatenate([self.buffer, samples])
+        self.total += len(samples)
+        if self.total - self.last_step < self.step:
+            return False
+        self._decode(final=False)
+        return True
+
+    # Decode whatever is left, committing every remaining frame
+    def finish(self):
+        self._decode(final=True)
+
+    def transcription(self):
+        return self.processor.decode(self.committed_ids + self.tentative_ids)
+
+    # The transcription so far as phoneme ids (see phoneme_vocab)
+    def phoneme_ids(self):
+        return self.vocab.collapse(self.committed_ids + self.tentative_ids)
+
+    # CTC log-probabilities (frames, vocab) of all the audio decoded so far
+    def log_probs(self):
+        return np.concatenate(self.committed_log_probs + [self.tentative_log_probs])
+
+    def _decode(self, final):
+        self.last_step = self.total
+        window_start = max(0, self.committed - self.context)
+        window = self.buffer[window_start - self.buffer_start:]
+        if len(window) < self.hop * 2:
+            return
+
+        log_probs = run_batch([window], self.model_name)[0]
+        ids = log_probs.argmax(axis=-1).tolist()
+        first = (self.committed - window_start) // self.hop  # First frame not yet committed
+
+        if final:
+            stable = len(ids) - first
+        else:
+            stable = min(self._to_hops(self.total - self.lookahead - self.committed) // self.hop, len(ids) - first)
+        self.committed_ids += ids[first:first + stable]
+        self.tentative_ids = ids[first + stable:]
+        self.committed_log_probs.append(log_probs[first:first + stable])
+        self.tentative_log_probs = log_probs[first + stable:]
+        self.committed += stable * self.hop
+
+        # Drop audio that will never be inside a window again
+        keep_from = max(0, self.committed - self.context)
+        if keep_from > self.buffer_start:
+            self.buffer = self.buffer[keep_from - self.buffer_start:]
+            self.buffer_start = keep_from
+
+    def _to_hops(self, samples):
+        return max(0, samples) // self.hop * self.hop
+
+
+# ASGI application for PATH
+async def match_audio_stream(scope, receive, send):
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    try:
+        await _serve(receive, send)
+    except _Disconnected:
+        pass
+    except Exception:
+        logger.exception("Streaming recognition failed")
+        await _send_json(send, {'type': 'error', 'error': 'Recognition failed'})
+        await send({'type': 'websocket.close', 'code': 1011})
+
+
+async def _serve(receive, send):
+    try:
+        start = json.loads(await _receive_text(receive))
+        session_id = start.get('session_id')
+        matching_text = start.get('matching_text')
+        sample_format = SAMPLE_FORMATS.get(start.get('format', 's16le'))
+        sample_rate = int(start.get('sample_rate', SAMPLE_RATE))
+    except (ValueError, AttributeError):
+        session_id = matching_text = sample_format = None
+
+    if not session_id or not matching_text or sample_format is None:
+        await _close_with_error(send, 'Invalid input')
+        return
+
+    text_phonemes, language = await sync_to_async(_expected_phonemes)(session_id, matching_text)
+    if text_phonemes is None:
+        await _close_with_error(send, 'Session not found')
+        return
+
+    if transcribes_words():
+        await _close_with_error(send, 'Streaming is not available with this recognizer backend')
+        return
+
+    model_name = model_for_language(language)
+    vocab = await sync_to_async(get_vocab, thread_sensitive=False)(model_name)
+    decoder = await sync_to_async(IncrementalDecoder, thread_sensitive=False)(
+        model_name, vocab, settings.STREAMING_STEP_MS, settings.STREAMING_CONTEXT_MS, settings.STREAMING_LOOKAHEAD_MS,
+    )
+    resampler = None
+    if sample_rate != SAMPLE_RATE:
+        import soxr
+        resampler = soxr.ResampleStream(sample_rate, SAMPLE_RATE, 1, dtype='float32')
+
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            raise _Disconnected()
+
+        if message.get('bytes') is not None:
+            if decoder.total > settings.AUDIO_MAX_SECONDS * SAMPLE_RATE:
+                await _close_with_error(send, 'Recording too long')
+                return
+            samples = _to_float32(message['bytes'], sample_format)
+            if resampler is not None:
+                samples = resampler.resample_chunk(samples)
+            if await sync_to_async(decoder.feed, thread_sensitive=False)(samples):
+                await _send_partial(send, decoder, text_phonemes)
+
+        elif message.get('text') is not None and json.loads(message['text']).get('type') == 'end':
+            if resampler is not None:
+                samples = resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True)
+                await sync_to_async(decoder.feed, thread_sensitive=False)(samples)
+            break
+
+    await sync_to_async(decoder.finish, thread_sensitive=False)()
+    # The whole reading is scored like an uploaded clip, so both endpoints give the same verdict for the same audio
+    result = await sync_to_async(score_log_probs, thread_sensitive=False)(
+        decoder.log_probs(), model_name, matching_text, text_phonemes, language,
+    )
+    await sync_to_async(record_match_result)(session_id, matching_text, result['match'])
+
+    await _send_json(send, {
+        'type': 'final', **reading_result_data(result), 'phonemes': normalize_phonemes(decoder.transcription()),
+    })
+    await send({'type': 'websocket.close', 'code': 1000})
+
+
+# Expected phonemes for the sentence being read and the story's language ((None, None) if the session doesn't exist)
+def _expected_phonemes(session_id, matching_text):
+    try:
+        session = ReadingSession.objects.select_related('story').get(id=session_id)
+    except (ReadingSession.DoesNotExist, ValueError):
+        return None, None
+    language = session.story.language
+    text_phonemes = lookup_phonemes(session.story, session.current_position, matching_text)
+    return text_phonemes or text_to_phonemes(matching_text, language), language
+
+
+# Partial result: the transcription so far, scored against the same-length prefix of the expected phonemes
+async def _send_partial(send, decoder, text_phonemes):
+    partial_ids = decoder.phoneme_ids()
+    expected_ids = decoder.vocab.encode(text_phonemes)[:len(partial_ids)]
+    similarity = levenshtein_similarity(partial_ids, expected_ids) if len(partial_ids) else 0.0
+    await _send_json(send, {
+        'type': 'partial', 'phonemes': normalize_phonemes(decoder.transcription()), 'similarity': similarity,
+    })
+
+
+def _to_float32(data, sample_format):
+    samples = np.frombuffer(data, dtype=sample_format)
+    if sample_format is np.int16:
+        return samples.astype(np.float32) / 32768.0
+    return samples.astype(np.float32, copy=False)
+
+
+class _Disconnected(Exception):
+    pass
+
+
+async def _receive_text(receive):
+    message = await receive()
+    if message['type'] == 'websocket.disconnect':
+        raise _Disconnected()
+    return message.get('text') or '{}'
+
+
+async def _send_json(send, data):
+    await send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+
+async def _close_with_error(send, error):
+    await _send_json(send, {'type': 'error', 'error': error})
+    await send({'type': 'websocket.close', 'code': 1008})
@@ -0,0 +1,1578 @@
+'''Tests of the users app
+
+Query budgets: each endpoint in urls.py is called against seeded data at two sizes (SIZES). At both sizes it has to
+stay within its query budget, and it has to run the same number of queries at each size - a count that grows with the
+number of classes, students, stories or sessions is an N+1. Set QUERY_BUDGET_REPORT to a file path to get the
+per-endpoint counts as JSON, e.g.
+
+    QUERY_BUDGET_REPORT=query_budgets.json python manage.py test apps.users.tests
+'''
+
+import asyncio
+import io
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from types import SimpleNamespace
+from importlib import import_module
+from datetime import timedelta
+from unittest import mock
+
+import av
+import numpy as np
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import audio_processing, metrics, phoneme_vocab, recognizer, result_cache
+from .alignment import forced_align, score_words
+from .audio_processing import (
+    SAMPLE_RATE, AudioTooLong, PhonemizerUnavailable, batch_logits, cascade, chunked_logits, ctc_confidence,
+    decode_audio, phoneme_similarity, text_to_phonemes, waveform_logits,
+)
+from .inference import BatchingScheduler
+from .inference_pool import PoolClient, PoolUnavailable
+from .jobs import LOST_JOB_ERROR, _complete_job, _run_job, fail_stale_jobs
+from .models import Class, MatchJob, ReadingRollup, ReadingSession, Story, Student, User
+from .phoneme_vocab import PhonemeVocab
+from .pronounce import get_phonetic_spelling, get_phonetic_spellings, sentence_words
+from .reading import reading_result_data, reading_verdict, score_log_probs, score_reading_once
+from .rollups import rebuild_rollups
+from .story_index import build_phoneme_index, lookup_phonemes, split_sentences, story_bundle
+from .streaming import IncrementalDecoder, match_audio_stream
+from .transcript_scoring import score_transcript
+from .views import StoryViewSet
+from .vad import NoSpeechDetected, trim_silence
+
+PASSWORD = 'query-budget-password'
+# 1x1 transparent GIF - the smallest upload an ImageField accepts
+GIF = (b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00'
+       b',\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;')
+COVER = 'resources/story_images/cover.gif'
+
+# Seeded data sizes: classes per teacher, students per class, stories and sessions per reader
+SIZES = {
+    'small': {'classes': 1, 'students': 3, 'stories': 3, 'sessions': 2},
+    'large': {'classes': 4, 'students': 20, 'stories': 12, 'sessions': 5},
+}
+
+# An endpoint call: URL name, HTTP method, the role of the calling user (None = anonymous), URL kwargs, request data
+# (query parameters for GET) and expected status - kwargs and data are functions of the seeded Fixtures - the most
+# queries the call may run, and the request body format (multipart for uploads and views that read request.POST)
+Endpoint = namedtuple('Endpoint', 'name method role kwargs data status budget format')
+
+
+def endpoint(name, method='get', role='reader', kwargs=None, data=None, status=200, budget=1, format='json'):
+    return Endpoint(name, method, role, kwargs or (lambda f: {}), data or (lambda f: {}), status, budget, format)
+
+
+ENDPOINTS = [
+    endpoint('match-audio-job', role=None, kwargs=lambda f: {'job_id': f.job.id}),
+    endpoint('health-metrics', role=None, budget=0),
+    endpoint('token_obtain_pair', 'post', None, data=lambda f: {'username': f.reader.username, 'password': PASSWORD}),
+    endpoint('token_refresh', 'post', None, data=lambda f: {'refresh': str(RefreshToken.for_user(f.reader))}, budget=0),
+    endpoint('api-root', budget=0),
+
+    endpoint('user-list', role='admin'),
+    endpoint('user-list', 'post', None, data=lambda f: {'username': 'new-reader', 'password': PASSWORD,
+                                                        'role': 'reader'}, status=201, budget=6),
+    endpoint('user-admins', role='admin'),
+    endpoint('user-teachers', role='admin'),
+    endpoint('user-readers', role='admin'),
+    endpoint('user-average-progress'),
+    endpoint('user-average-reading-duration'),
+    endpoint('user-average-reading-level'),
+    endpoint('user-average-time-to-complete'),
+    endpoint('user-change-password', 'post', data=lambda f: {'old_password': PASSWORD, 'new_password': 'new-password'}),
+    endpoint('user-check-username-exists', role=None, kwargs=lambda f: {'username': f.reader.username}),
+    endpoint('user-get-user-details', budget=0),
+    endpoint('user-readinglevel', budget=0),
+    endpoint('user-role', budget=0),
+    endpoint('user-username', budget=0),
+    endpoint('user-detail', role='admin', kwargs=lambda f: {'pk': f.reader.id}),
+    endpoint('user-detail', 'patch', 'admin', kwargs=lambda f: {'pk': f.reader.id}, data=lambda f: {'email': 'reader@example.com'},
+             budget=4),
+    endpoint('user-detail', 'delete', 'admin', kwargs=lambda f: {'pk': f.reader.id}, status=204, budget=19),
+    endpoint('user-get-by-username', role='admin', kwargs=lambda f: {'pk': f.reader.id, 'username': f.reader.username}),
+
+    endpoint('story-list'),
+    endpoint('story-list', 'post', 'admin', data=lambda f: {
+        'title': 'New', 'description': 'd', 'fulltext': 'A new story.', 'difficulty_level': 'easy',
+        'image': SimpleUploadedFile('new.gif', GIF, content_type='image/gif'),
+    }, status=201, budget=3, format='multipart'),
+    endpoint('story-get-current-story-listings'),
+    endpoint('story-get-easy-stories'),
+    endpoint('story-get-medium-stories'),
+    endpoint('story-get-hard-stories'),
+    endpoint('story-get-stories'),
+    endpoint('story-get-story-listings'),
+    endpoint('story-most-popular'),
+    endpoint('story-least-popular'),
+    endpoint('story-most-engaged'),
+    endpoint('story-most-popular', data=lambda f: {'top': 10}),
+    endpoint('story-ranking', data=lambda f: {'by': 'engagement', 'page': 2, 'page_size': 2}, budget=2),
+    endpoint('story-detail', kwargs=lambda f: {'pk': f.story.id}),
+    endpoint('story-detail', 'patch', 'admin', kwargs=lambda f: {'pk': f.story.id}, data=lambda f: {'title': 'Renamed'},
+             budget=4),
+    endpoint('story-detail', 'delete', 'admin', kwargs=lambda f: {'pk': f.story.id}, status=204, budget=10),
+    endpoint('story-bundle', kwargs=lambda f: {'pk': f.story.id}, budget=2),
+    endpoint('story-get-story-cover', kwargs=lambda f: {'pk': f.story.id}),
+    endpoint('story-update-story', 'put', 'admin', kwargs=lambda f: {'pk': f.story.id}, data=lambda f: {
+        'title': 'Renamed', 'description': 'd', 'fulltext': 'Changed text.', 'difficulty_level': 'hard',
+    }, budget=4, format='multipart'),
+
+    endpoint('readingsession-list', role='admin'),
+    endpoint('readingsession-list', 'post', 'admin', data=lambda f: {
+        'user': f.reader.id, 'story': f.story.id, 'story_progress': 0,
+    }, status=201, budget=7),
+    endpoint('readingsession-current-position', data=lambda f: {'session_id': f.session.id}),
+    endpoint('readingsession-end-session', 'post', data=lambda f: {'session_id': f.session.id, 'time_reading': 30},
+             budget=9),
+    endpoint('readingsession-most-recent-story', budget=3),
+    endpoint('readingsession-pause-session', 'post', data=lambda f: {'session_id': f.session.id, 'time_reading': 30},
+             budget=7),
+    endpoint('readingsession-previous-sentence', 'post', data=lambda f: {'session_id': f.session.id,
+                                                                         'sentence': 'Once upon a time.'},
+             budget=7, format='multipart'),
+    endpoint('readingsession-progress', data=lambda f: {'session_id': f.session.id}),
+    endpoint('readingsession-progress-by-story', data=lambda f: {'story_id': f.story.id}, budget=2),
+    endpoint('readingsession-session-stats', data=lambda f: {'session_id': f.session.id}, budget=2),
+    endpoint('readingsession-start-session', 'post', data=lambda f: {'story_id': f.story.id}, status=201, budget=7),
+    endpoint('readingsession-total-stories-read', budget=2),
+    endpoint('readingsession-detail', role='admin', kwargs=lambda f: {'pk': f.session.id}),
+    endpoint('readingsession-detail', 'patch', 'admin', kwargs=lambda f: {'pk': f.session.id},
+             data=lambda f: {'story_progress': 50}, budget=6),
+    endpoint('readingsession-detail', 'delete', 'admin', kwargs=lambda f: {'pk': f.session.id}, status=204, budget=7),
+
+    endpoint('class-list', role='teacher'),
+    endpoint('class-list', 'post', 'teacher', data=lambda f: {'teacher': f.teacher.id, 'class_code': 'NEWCLASS'},
+             status=201, budget=6),
+    endpoint('class-create-class', 'post', 'teacher', status=201, budget=6),
+    endpoint('class-dashboard', role='teacher', budget=2),
+    endpoint('class-get-classes', role='teacher'),
+    endpoint('class-get-students', role='teacher'),
+    endpoint('class-detail', role='teacher', kwargs=lambda f: {'pk': f.klass.id}),
+    endpoint('class-detail', 'patch', 'teacher', kwargs=lambda f: {'pk': f.klass.id},
+             data=lambda f: {'class_code': 'RENAMED'}, budget=3),
+    endpoint('class-detail', 'delete', 'teacher', kwargs=lambda f: {'pk': f.klass.id}, status=204, budget=4),
+
+    endpoint('student-list', role='teacher'),
+    endpoint('student-list', 'post', 'teacher', data=lambda f: {'reader': f.reader.id, 'class_code': f.other_class.id},
+             status=201, budget=8),
+    endpoint('student-join-class', 'post', data=lambda f: {'class_code': f.other_class.class_code}, status=201,
+             budget=8),
+    endpoint('student-detail', role='teacher', kwargs=lambda f: {'pk': f.student.id}),
+    endpoint('student-detail', 'patch', 'teacher', kwargs=lambda f: {'pk': f.student.id},
+             data=lambda f: {'class_code': f.other_class.id}, budget=11),
+    endpoint('student-detail', 'delete', 'teacher', kwargs=lambda f: {'pk': f.student.id}, status=204, budget=7),
+]
+
+# Endpoints that aren't budgeted, and why
+EXCLUDED = {
+    'match-audio': 'runs the speech recognizer',
+    'get-pronunciation': 'no database access (lytspel only)',
+    'get-pronunciations': 'no database access (lytspel only) - see BulkPronunciationTests',
+    'health-ready': 'no database access, and starts loading the speech recognizer',
+}
+
+
+# Seeded data for one size - the objects endpoints are called with, plus the rest of the teacher's roster
+class Fixtures:
+    def __init__(self, size):
+        password = make_password(PASSWORD)  # Hashed once - hashing per user would dominate the test run
+        now = timezone.now()
+
+        def user(username, role, reading_level=0):
+            return User(username=username, password=password, role=role, reading_level=reading_level,
+                        previous_reading_level=0)
+
+        self.admin, self.teacher, self.reader = User.objects.bulk_create([
+            user('admin', 'admin'), user('teacher', 'teacher'), user('reader', 'reader', 10),
+        ])
+        stories = Story.objects.bulk_create([
+            Story(
+                title=f'Story {i}', description='d', fulltext='Once upon a time. The end.',
+                difficulty_level=('easy', 'medium', 'hard')[i % 3], image=COVER,
+                phoneme_index={
+                    '0': {'text': 'Once upon a time.', 'phonemes': 'wʌns əpɑːn ə taɪm', 'respellings': {}},
+                    '18': {'text': 'The end.', 'phonemes': 'ðɪ ɛnd', 'respellings': {}},
+                },
+            )
+            for i in range(size['stories'])
+        ])
+        self.story = stories[0]
+
+        classes = Class.objects.bulk_create([
+            Class(teacher=self.teacher, class_code=f'CLASS{i}') for i in range(size['classes'] + 1)
+        ])
+        self.klass, self.other_class = classes[0], classes[-1]  # The reader hasn't joined other_class
+        readers = User.objects.bulk_create([
+            user(f'reader-{i}-{j}', 'reader', j) for i in range(size['classes']) for j in range(size['students'])
+        ])
+        students = Student.objects.bulk_create(
+            [Student(reader=self.reader, class_code=self.klass)]
+            + [Student(reader=reader, class_code=classes[i // size['students']]) for i, reader in enumerate(readers)]
+        )
+        self.student = students[0]
+
+        # Every reader has sessions on the first few stories - finished ones first, the last still in progress
+        sessions = []
+        for reader in [self.reader] + readers:
+            for k in range(size['sessions']):
+                finished = k < size['sessions'] - 1
+                sessions.append(ReadingSession(
+                    user=reader, story=stories[k], start_datetime=now - timedelta(days=size['sessions'] - k),
+                    end_datetime=now if finished else None, story_progress=100 if finished else 25,
+                    current_position=26 if finished else 18, total_reading_time=timedelta(minutes=5),
+                ))
+        sessions = ReadingSession.objects.bulk_create(sessions)
+        self.session = sessions[size['sessions'] - 1]  # The reader's session in progress (on the last story read)
+        self.job = MatchJob.objects.create(session=self.session, matching_text='The end.', status=MatchJob.DONE,
+                                           match=True, completed_at=now)
+        rebuild_rollups()
+
+
+class QueryBudgetTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.media_root = tempfile.mkdtemp()
+        cls.media = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media.enable()
+        os.makedirs(os.path.join(cls.media_root, os.path.dirname(COVER)))
+        with open(os.path.join(cls.media_root, COVER), 'wb') as cover:
+            cover.write(GIF)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.media.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_every_endpoint_is_budgeted(self):
+        budgeted = {spec.name for spec in ENDPOINTS} | set(EXCLUDED)
+        missing = sorted(set(url_names(get_resolver().url_patterns)) - budgeted)
+        self.assertEqual(missing, [], 'Endpoints without a query budget - add them to ENDPOINTS (or EXCLUDED)')
+
+    def test_query_budgets(self):
+        counts = {size: self.count_queries(SIZES[size]) for size in SIZES}
+
+        report = []
+        for index, spec in enumerate(ENDPOINTS):
+            by_size = {size: counts[size][index] for size in SIZES}
+            report.append({'endpoint': spec.name, 'method': spec.method.upper(), 'budget': spec.budget, **by_size})
+            with self.subTest(endpoint=spec.name, method=spec.method):
+                for size, queries in by_size.items():
+                    self.assertLessEqual(queries, spec.budget, f'Over budget with the {size} fixtures')
+                self.assertEqual(len(set(by_size.values())), 1, f'Query count grows with the data: {by_size}')
+
+        if os.environ.get('QUERY_BUDGET_REPORT'):
+            with open(os.environ['QUERY_BUDGET_REPORT'], 'w') as report_file:
+                json.dump({'sizes': SIZES, 'endpoints': report}, report_file, indent=2)
+
+    # Queries run by each endpoint call (in ENDPOINTS order) against a fresh copy of the fixtures at one size
+    # Each call runs in its own rolled-back transaction, so calls that write don't affect the ones after them
+    def count_queries(self, size):
+        counts = []
+        with rolled_back():
+            fixtures = Fixtures(size)
+            users = {'admin': fixtures.admin, 'teacher': fixtures.teacher, 'reader': fixtures.reader}
+            for spec in ENDPOINTS:
+                client = APIClient()
+                if spec.role:
+                    client.force_authenticate(users[spec.role])
+                url = reverse(spec.name, kwargs=spec.kwargs(fixtures))
+                data = spec.data(fixtures)
+
+                with rolled_back(), mock.patch('apps.users.views.index_story'):  # Phonemizing needs espeak-ng
+                    with CaptureQueriesContext(connection) as queries:
+                        if spec.method == 'get':
+                            response = client.get(url, data)
+                        else:
+                            response = getattr(client, spec.method)(url, data, format=spec.format)
+                self.assertEqual(response.status_code, spec.status, f'{spec.method.upper()} {url}: {response.content!r}')
+                counts.append(len(queries))
+        return counts
+
+
+# The reading rollups and story counters kept up to date by the endpoints have to match ones rebuilt from scratch
+class RollupTests(TestCase):
+    FIELDS = ['session_count', 'reading_time', 'progress_sum', 'completed_count', 'completed_reading_time',
+              'reader_count', 'reading_level_sum']
+
+    def test_incremental_rollups_match_a_rebuild(self):
+        fixtures = Fixtures(SIZES['small'])
+        reader, teacher, admin = APIClient(), APIClient(), APIClient()
+        reader.force_authenticate(fixtures.reader)
+        teacher.force_authenticate(fixtures.teacher)
+        admin.force_authenticate(fixtures.admin)
+
+        initial = self.rollups()
+        session = {'session_id': fixtures.session.id}
+        self.assertStatus(reader.post(reverse('readingsession-pause-session'), {**session, 'time_reading': 30}), 200)
+        self.assertStatus(reader.post(reverse('readingsession-end-session'), {**session, 'time_reading': 45}), 200)
+        started = reader.post(reverse('readingsession-start-session'), {'story_id': fixtures.story.id})
+        self.assertStatus(started, 201)
+        self.assertStatus(reader.post(reverse('readingsession-previous-sentence'),
+                                      {'session_id': started.data['session_id'], 'sentence': 'Once.'},
+                                      format='multipart'), 200)
+        self.assertStatus(reader.post(reverse('student-join-class'), {'class_code': fixtures.other_class.class_code}),
+                          201)
+        self.assertStatus(teacher.post(reverse('class-create-class')), 201)
+        self.assertStatus(teacher.delete(reverse('student-detail', kwargs={'pk': fixtures.student.id})), 204)
+        self.assertStatus(admin.patch(reverse('readingsession-detail', kwargs={'pk': fixtures.session.id}),
+                                      {'story_progress': 50}), 200)
+        self.assertStatus(APIClient().post(reverse('user-list'), {'username': 'new-reader', 'password': PASSWORD,
+                                                                  'role': 'reader'}, format='json'), 201)
+        self.assertStatus(admin.delete(reverse('user-detail', kwargs={'pk': fixtures.reader.id})), 204)
+        self.assertStatus(admin.delete(reverse('story-detail', kwargs={'pk': fixtures.story.id})), 204)
+
+        incremental = self.rollups()
+        self.assertNotEqual(incremental, initial)
+        rebuild_rollups()
+        rebuilt = self.rollups()
+        self.assertEqual(incremental.keys(), rebuilt.keys())
+        for key, values in rebuilt.items():
+            for field, value in values.items():
+                with self.subTest(rollup=key, field=field):
+                    if isinstance(value, float):
+                        self.assertAlmostEqual(incremental[key][field], value, places=6)
+                    else:
+                        self.assertEqual(incremental[key][field], value)
+
+    # Deploying builds the rollups over the existing data, as rebuild_rollups does
+    def test_migration_builds_the_rollups(self):
+        fixtures = Fixtures(SIZES['large'])
+        rebuilt = self.rollups()
+        ReadingRollup.objects.all().delete()
+        Class.objects.create(teacher=fixtures.teacher, class_code='EMPTY')
+
+        import_module('apps.users.migrations.0017_build_reading_rollups').build_rollups(django_apps, None)
+        built = self.rollups()
+        self.assertEqual(len(built), len(rebuilt) + 1)
+        self.assertEqual(built.pop(Class.objects.get(class_code='EMPTY').id)['session_count'], 0)
+        self.assertEqual(built, rebuilt)
+
+    def test_migration_backfills_the_story_counters(self):
+        Fixtures(SIZES['large'])
+        counters = self.rollups()
+        Story.objects.update(session_count=0, total_reading_time=timedelta(0), completed_count=0)
+
+        import_module('apps.users.migrations.0018_backfill_story_counters').backfill_story_counters(django_apps, None)
+        self.assertEqual(self.rollups(), counters)
+
+    def assertStatus(self, response, status):
+        self.assertEqual(response.status_code, status, f'{response.request["REQUEST_METHOD"]} '
+                                                       f'{response.request["PATH_INFO"]}: {response.content!r}')
+
+    def rollups(self):
+        rollups = {rollup['class_code']: rollup for rollup in ReadingRollup.objects.values('class_code', *self.FIELDS)}
+        stories = Story.objects.values('id', 'session_count', 'total_reading_time', 'completed_count')
+        return {**rollups, **{f'story {story.pop("id")}': story for story in stories}}
+
+
+class SessionTimeTests(TestCase):
+
+    def setUp(self):
+        self.fixtures = Fixtures(SIZES['small'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.fixtures.reader)
+
+    def test_missing_or_invalid_time_reading_is_rejected(self):
+        for name in ('readingsession-end-session', 'readingsession-pause-session'):
+            for data in ({}, {'time_reading': 'soon'}):
+                with self.subTest(endpoint=name, data=data):
+                    response = self.client.post(reverse(name), {'session_id': self.fixtures.session.id, **data})
+                    self.assertEqual(response.status_code, 400)
+        self.fixtures.session.refresh_from_db()
+        self.assertIsNone(self.fixtures.session.end_datetime)
+
+    # Sessions are re-read under a row lock and only the fields the endpoints change are written, so progress made
+    # meanwhile (e.g. by a match job) isn't overwritten with a stale position
+    def test_session_time_updates_leave_the_position_alone(self):
+        for name in ('readingsession-end-session', 'readingsession-pause-session'):
+            with self.subTest(endpoint=name), CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse(name), {'session_id': self.fixtures.session.id, 'time_reading': 30})
+                self.assertEqual(response.status_code, 200)
+            updates = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "users_readingsession"')]
+            self.assertEqual(len(updates), 1)
+            self.assertNotIn('"current_position"', updates[0])
+        self.fixtures.session.refresh_from_db()
+        self.assertEqual(self.fixtures.session.total_reading_time, timedelta(minutes=5, seconds=60))
+
+
+class MatchJobTests(TestCase):
+
+    def setUp(self):
+        self.fixtures = Fixtures(SIZES['small'])
+        self.job = MatchJob.objects.create(session=self.fixtures.session, matching_text='The end.')
+
+    def poll(self, **params):
+        return APIClient().get(reverse('match-audio-job', kwargs={'job_id': self.job.id}), params)
+
+    def test_poll_rejects_a_wait_that_never_ends(self):
+        for wait in ('nan', 'inf', '-inf', 'soon'):
+            with self.subTest(wait=wait):
+                self.assertEqual(self.poll(wait=wait).status_code, 400)
+
+    def test_poll_clamps_a_negative_wait(self):
+        response = self.poll(wait=-5)
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['status'], MatchJob.PENDING)
+
+    # A job whose worker process died stays pending in the database - polling it fails it once it's overdue
+    def test_poll_fails_a_lost_job(self):
+        MatchJob.objects.filter(id=self.job.id).update(status=MatchJob.RUNNING,
+                                                       created_at=timezone.now() - timedelta(hours=1))
+        response = self.poll()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], MatchJob.FAILED)
+        self.assertEqual(response.json()['error'], LOST_JOB_ERROR)
+
+    def test_poll_leaves_a_recent_job_pending(self):
+        self.assertEqual(fail_stale_jobs(MatchJob.objects.all()), 0)
+        self.assertEqual(self.poll().status_code, 202)
+
+    # A lost job's result can still arrive - it completes the job and is applied to the session
+    def test_late_result_completes_a_failed_job(self):
+        MatchJob.objects.filter(id=self.job.id).update(status=MatchJob.FAILED, error=LOST_JOB_ERROR)
+        position = self.fixtures.session.current_position
+        _complete_job(self.job.id, {'match': True, 'words': []})
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, MatchJob.DONE)
+        self.fixtures.session.refresh_from_db()
+        self.assertEqual(self.fixtures.session.current_position, position + len('The end.'))
+
+
+    # A job runs on a worker thread with its own connection - run it inline, keeping the test's
+    @mock.patch('apps.users.jobs.close_old_connections')
+    def test_job_lifecycle(self, close_old_connections):
+        position = self.fixtures.session.current_position
+        verdict = {'match': True, 'words': [{'word': 'end', 'correct': True}]}
+
+        def score_reading_once(session, matching_text, audio_file, apply):
+            apply(verdict)
+            return verdict, True
+
+        with mock.patch('apps.users.jobs.score_reading_once', side_effect=score_reading_once):
+            _run_job(self.job.id, b'RIFF')
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.match, self.job.words), (MatchJob.DONE, True, verdict['words']))
+        self.assertIsNotNone(self.job.completed_at)
+        self.fixtures.session.refresh_from_db()
+        self.assertEqual(self.fixtures.session.current_position, position + len('The end.'))
+
+    # A cached verdict (a retried clip) completes the job without counting the reading twice
+    @mock.patch('apps.users.jobs.close_old_connections')
+    def test_job_with_a_cached_verdict_leaves_the_session(self, close_old_connections):
+        position = self.fixtures.session.current_position
+        with mock.patch('apps.users.jobs.score_reading_once', return_value=({'match': True, 'words': []}, False)):
+            _run_job(self.job.id, b'RIFF')
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, MatchJob.DONE)
+        self.fixtures.session.refresh_from_db()
+        self.assertEqual(self.fixtures.session.current_position, position)
+
+    @mock.patch('apps.users.jobs.close_old_connections')
+    def test_failed_job_records_the_error(self, close_old_connections):
+        with mock.patch('apps.users.jobs.score_reading_once', side_effect=NoSpeechDetected('No speech detected')), \
+                self.assertLogs('apps.users.jobs', 'ERROR'):
+            _run_job(self.job.id, b'RIFF')
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.error), (MatchJob.FAILED, 'No speech detected'))
+
+
+# With INFERENCE_POOL_ADDRESS set, scoring fails when the pool is down or doesn't answer in time
+class InferencePoolTests(TestCase):
+
+    def test_timed_out_requests_are_dropped(self):
+        client = PoolClient('unused', b'', timeout=0.01)
+        with mock.patch.object(client, '_connection', return_value=mock.Mock()):
+            with self.assertRaises(TimeoutError):
+                client.infer([np.zeros(16000, dtype=np.float32)])
+        self.assertEqual(client._pending, {})
+
+    def test_match_audio_is_unavailable_without_the_pool(self):
+        fixtures = Fixtures(SIZES['small'])
+        data = {
+            'session_id': fixtures.session.id, 'matching_text': 'The end.',
+            'audio_file': SimpleUploadedFile('clip.wav', b'RIFF', content_type='audio/wav'),
+        }
+        for error in (PoolUnavailable('Inference pool connection lost'), TimeoutError()):
+            with self.subTest(error=type(error).__name__):
+                data['audio_file'].seek(0)
+                with mock.patch('apps.users.views.score_reading_once', side_effect=error):
+                    response = APIClient().post(reverse('match-audio'), data, format='multipart')
+                self.assertEqual(response.status_code, 503)
+
+
+# In pool mode the web process never loads the model - readiness and streaming both go to the pool
+@override_settings(INFERENCE_POOL_ADDRESS='/tmp/inference-pool-test.sock')
+@mock.patch('apps.users.recognizer.start_warm_up')
+class PoolModeTests(SimpleTestCase):
+
+    def stats(self, *ready):
+        return {'workers': [{'alive': True, 'ready': worker_ready} for worker_ready in ready]}
+
+    def test_readiness_is_the_pools(self, start_warm_up):
+        client = mock.Mock()
+        for stats, status in ((self.stats(False, True), 200), (self.stats(False, False), 503)):
+            client.stats.return_value = stats
+            with mock.patch('apps.users.views.get_pool_client', return_value=client):
+                self.assertEqual(self.client.get(reverse('health-ready')).status_code, status)
+        client.stats.side_effect = PoolUnavailable('Inference pool not reachable')
+        with mock.patch('apps.users.views.get_pool_client', return_value=client):
+            self.assertEqual(self.client.get(reverse('health-ready')).status_code, 503)
+        start_warm_up.assert_not_called()
+
+    def test_streaming_runs_in_the_pool(self, start_warm_up):
+        vocab = PhonemeVocab(ToyTokenizer())
+        client = mock.Mock()
+        client.infer.side_effect = lambda waveforms, model_name: [peaked_log_probs([2] * (len(waveforms[0]) // 320))]
+        with mock.patch('apps.users.streaming.get_processor'), \
+                mock.patch('apps.users.streaming.get_config', return_value=mock.Mock(conv_stride=[320])), \
+                mock.patch('apps.users.audio_processing.get_pool_client', return_value=client), \
+                mock.patch('apps.users.audio_processing.get_recognizer') as get_recognizer:
+            decoder = IncrementalDecoder('model', vocab, step_ms=250, context_ms=250, lookahead_ms=100)
+            decoder.feed(np.zeros(8000, dtype=np.float32))
+            decoder.finish()
+        self.assertTrue(client.infer.called)
+        get_recognizer.assert_not_called()
+        self.assertEqual(decoder.phoneme_ids().tolist(), [2])
+
+
+# A "model" that reads the token of each frame off the frame's first sample, so any window gives the same frames
+def sample_token_batch(waveforms, model_name=None):
+    return [peaked_log_probs([int(waveform[i * TOY_HOP]) for i in range(len(waveform) // TOY_HOP)])
+            for waveform in waveforms]
+
+
+# The streaming endpoint's final verdict comes from the same scorer as /match-audio/, over the whole reading
+@override_settings(STREAMING_STEP_MS=100, STREAMING_CONTEXT_MS=100, STREAMING_LOOKAHEAD_MS=60)
+@mock.patch('apps.users.reading.logits_to_phonemes')
+class StreamingVerdictTests(SimpleTestCase):
+    matching_text = 'ab see ab'
+    text_phonemes = 'ab c ab'
+    # "a b", then "see" misread as "a", then "a b"
+    frames = [2, 0, 3, 0, 2, 0, 2, 0, 3, 0] * 3
+
+    def stream(self):
+        audio = np.repeat(np.array(self.frames, dtype=np.float32), TOY_HOP)
+        messages = [
+            {'type': 'websocket.connect'},
+            {'type': 'websocket.receive', 'text': json.dumps({
+                'session_id': 1, 'matching_text': self.matching_text, 'format': 'f32le',
+            })},
+            *({'type': 'websocket.receive', 'bytes': audio[start:start + 5 * TOY_HOP].tobytes()}
+              for start in range(0, len(audio), 5 * TOY_HOP)),
+            {'type': 'websocket.receive', 'text': json.dumps({'type': 'end'})},
+        ]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        with mock.patch('apps.users.streaming._expected_phonemes', return_value=(self.text_phonemes, 'en-us')), \
+                mock.patch('apps.users.streaming.transcribes_words', return_value=False), \
+                mock.patch('apps.users.streaming.model_for_language', return_value='toy'), \
+                mock.patch('apps.users.streaming.get_processor', return_value=mock.Mock(decode=lambda ids: '')), \
+                mock.patch('apps.users.streaming.get_config', return_value=SimpleNamespace(conv_stride=[TOY_HOP])), \
+                mock.patch('apps.users.streaming.run_batch', side_effect=sample_token_batch), \
+                mock.patch('apps.users.streaming.record_match_result') as record_match_result:
+            asyncio.run(match_audio_stream({'type': 'websocket'}, receive, send))
+        final = json.loads(sent[-2]['text'])
+        return final, record_match_result
+
+    def test_final_verdict_matches_a_single_pass(self, logits_to_phonemes):
+        log_probs = peaked_log_probs(self.frames)
+        with mock.patch.dict(phoneme_vocab._vocabs, {'toy': PhonemeVocab(ToyTokenizer())}):
+            for scorer in ('alignment', 'levenshtein'):
+                with self.subTest(scorer=scorer), override_settings(READING_SCORER=scorer):
+                    expected = reading_result_data(
+                        score_log_probs(log_probs, 'toy', self.matching_text, self.text_phonemes, 'en-us'))
+                    final, record_match_result = self.stream()
+                    self.assertEqual({key: final[key] for key in expected}, json.loads(json.dumps(expected)))
+                    record_match_result.assert_called_once_with(1, self.matching_text, expected['match'])
+
+    def test_alignment_fails_the_misread_words(self, logits_to_phonemes):
+        with mock.patch.dict(phoneme_vocab._vocabs, {'toy': PhonemeVocab(ToyTokenizer())}), \
+                override_settings(READING_SCORER='alignment'):
+            final, _ = self.stream()
+        self.assertEqual(final['failed_words'], ['see'])
+        self.assertEqual([word['word'] for word in final['words']], ['ab', 'see', 'ab'])
+
+
+class GenerateDatasetTests(TestCase):
+
+    def generate(self, *args):
+        call_command('generate_dataset', '--readers', '5', '--stories', '2', '--sessions', '10', *args,
+                     stdout=io.StringIO())
+
+    def test_generates_a_dataset(self):
+        self.generate('--prefix', 'gen')
+        self.assertEqual(User.objects.filter(username__startswith='gen-reader-').count(), 5)
+        self.assertEqual(Class.objects.filter(class_code__startswith='GEN').count(), 5)
+        self.assertEqual(ReadingSession.objects.count(), 10)
+
+    def test_rejects_no_classes(self):
+        for args in (('--classes-per-teacher', '0'), ('--teachers', '-1')):
+            with self.subTest(args=args), self.assertRaises(CommandError):
+                self.generate(*args)
+
+    # Usernames keep the whole prefix but class codes only its first 8 characters
+    def test_rejects_a_prefix_whose_class_codes_exist(self):
+        self.generate('--prefix', 'synthetic-a')
+        with self.assertRaises(CommandError):
+            self.generate('--prefix', 'synthetic-b')
+
+
+# The teacher dashboard: every class with its students, each with their reading level and latest session
+class DashboardTests(TestCase):
+
+    def setUp(self):
+        self.fixtures = Fixtures(SIZES['small'])
+        now = timezone.now()
+        # An older session created last: the latest session is picked by start time, not id
+        ReadingSession.objects.create(user=self.fixtures.reader, story=self.fixtures.story, story_progress=0,
+                                      start_datetime=now - timedelta(days=30))
+        # Two sessions started at the same moment: the later one (higher id) is the latest
+        tied = User.objects.create(username='tied', role='reader', reading_level=3, previous_reading_level=0)
+        Student.objects.create(reader=tied, class_code=self.fixtures.other_class)
+        ReadingSession.objects.bulk_create([
+            ReadingSession(user=tied, story=story, start_datetime=now, story_progress=0)
+            for story in Story.objects.order_by('id')[:2]
+        ])
+        # A reader who hasn't read anything yet
+        new = User.objects.create(username='new', role='reader', reading_level=1, previous_reading_level=0)
+        Student.objects.create(reader=new, class_code=self.fixtures.other_class)
+
+    def dashboard(self):
+        client = APIClient()
+        client.force_authenticate(self.fixtures.teacher)
+        response = client.get(reverse('class-dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['classes']
+
+    # What the dashboard should show, worked out one student at a time
+    def expected(self):
+        classes = []
+        for klass in Class.objects.filter(teacher=self.fixtures.teacher).order_by('class_code'):
+            students = []
+            for student in Student.objects.filter(class_code=klass).order_by('reader__username'):
+                latest = ReadingSession.objects.filter(user=student.reader).order_by('start_datetime', 'id').last()
+                students.append({
+                    'id': student.reader_id, 'username': student.reader.username,
+                    'reading_level': student.reader.reading_level,
+                    'last_session': latest and {
+                        'id': latest.id, 'story_id': latest.story_id, 'story_title': latest.story.title,
+                        'story_progress': latest.story_progress, 'ended': latest.end_datetime is not None,
+                    },
+                })
+            classes.append({'class_code': klass.class_code, 'num_students': len(students), 'students': students})
+        return classes
+
+    def test_shows_each_students_latest_session(self):
+        classes = self.dashboard()
+        for klass in classes:
+            for student in klass['students']:
+                session = student['last_session']
+                if session:
+                    session['ended'] = session.pop('end_datetime') is not None
+                    del session['start_datetime']
+        self.assertEqual(classes, self.expected())
+
+    def test_latest_session_details(self):
+        students = {student['username']: student for klass in self.dashboard() for student in klass['students']}
+        self.assertEqual(students['tied']['last_session']['id'],
+                         ReadingSession.objects.filter(user__username='tied').latest('id').id)
+        self.assertEqual(students['reader']['last_session']['id'], self.fixtures.session.id)
+        self.assertIsNone(students['new']['last_session'])
+
+
+# Story rankings: ordered by an engagement counter with ties broken by id, paged, and the ?top= shortcuts
+class StoryRankingTests(TestCase):
+    # (session_count, reading minutes, completed_count) per story - with ties on every counter
+    COUNTERS = [(5, 10, 1), (3, 30, 2), (5, 20, 0), (0, 30, 2), (1, 0, 0)]
+
+    def setUp(self):
+        self.stories = Story.objects.bulk_create([
+            Story(title=f'Story {i}', description='d', fulltext='The end.', difficulty_level='easy', image=COVER,
+                  session_count=sessions, total_reading_time=timedelta(minutes=minutes), completed_count=completed)
+            for i, (sessions, minutes, completed) in enumerate(self.COUNTERS)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='reader', role='reader', reading_level=0,
+                                                           previous_reading_level=0))
+
+    def get(self, name, **params):
+        return self.client.get(reverse(name), params)
+
+    # Story ids in ranking order - the counter, then id, both in the same direction
+    def ranked(self, counter, descending=True):
+        stories = sorted(self.stories, key=lambda story: (getattr(story, counter), story.id), reverse=descending)
+        return [story.id for story in stories]
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [story['id'] for story in (data['results'] if isinstance(data, dict) else data)]
+
+    def test_rankings_are_ordered_by_their_counter_then_id(self):
+        for by, counter in StoryViewSet.RANKINGS.items():
+            for order in ('desc', 'asc'):
+                with self.subTest(by=by, order=order):
+                    response = self.get('story-ranking', by=by, order=order, page_size=100)
+                    self.assertEqual(self.ids(response), self.ranked(counter, descending=order == 'desc'))
+
+    def test_ties_are_broken_by_id_in_the_rankings_direction(self):
+        first, third = self.stories[0].id, self.stories[2].id  # Both read 5 times
+        self.assertEqual(self.ids(self.get('story-ranking', by='popularity'))[:2], [third, first])
+        self.assertEqual(self.ids(self.get('story-ranking', by='popularity', order='asc'))[-2:], [first, third])
+
+    def test_pages_cover_the_ranking_once(self):
+        pages = []
+        for page in (1, 2, 3):
+            response = self.get('story-ranking', by='engagement', page=page, page_size=2)
+            self.assertEqual(response.json()['count'], len(self.stories))
+            pages.append(self.ids(response))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(sum(pages, []), self.ranked('total_reading_time'))
+        self.assertIsNone(response.json()['next'])
+        self.assertEqual(self.get('story-ranking', by='engagement', page=4, page_size=2).status_code, 404)
+
+    def test_ranking_rejects_unknown_counters_and_orders(self):
+        for params in ({'by': 'title'}, {'order': 'up'}, {'by': 'popularity', 'order': ''}):
+            with self.subTest(params=params):
+                self.assertEqual(self.get('story-ranking', **params).status_code, 400)
+
+    def test_top_stories(self):
+        self.assertEqual(self.ids(self.get('story-most-popular', top=3)), self.ranked('session_count')[:3])
+        self.assertEqual(self.ids(self.get('story-least-popular', top=3)), self.ranked('session_count', False)[:3])
+        self.assertEqual(self.ids(self.get('story-most-engaged', top=2)), self.ranked('total_reading_time')[:2])
+
+    def test_top_is_clamped(self):
+        self.assertEqual(self.ids(self.get('story-most-popular', top=0)), self.ranked('session_count')[:1])
+        self.assertEqual(self.ids(self.get('story-most-popular', top=-3)), self.ranked('session_count')[:1])
+        with override_settings(STORY_RANKING_MAX_PAGE_SIZE=2):
+            self.assertEqual(self.ids(self.get('story-most-popular', top=50)), self.ranked('session_count')[:2])
+
+    def test_top_must_be_an_integer(self):
+        for top in ('three', '2.5', ''):
+            with self.subTest(top=top):
+                response = self.get('story-most-popular', top=top)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'top must be an integer.'})
+
+
+class StoryBundleTests(TestCase):
+
+    def setUp(self):
+        self.fixtures = Fixtures(SIZES['small'])
+        self.story = self.fixtures.session.story
+        self.story.phoneme_index = {
+            str(offset): {'text': 'Sentence.', 'phonemes': 'a', 'respellings': []} for offset in (0, 10, 18, 30)
+        }
+        self.story.save(update_fields=['phoneme_index'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.fixtures.reader)
+
+    def offsets(self, **params):
+        response = self.client.get(reverse('story-bundle', kwargs={'pk': self.story.id}), params)
+        self.assertEqual(response.status_code, 200)
+        return [sentence['offset'] for sentence in response.json()['sentences']]
+
+    def test_bundle_starts_at_the_readers_position(self):
+        self.assertEqual(self.offsets(), [18, 30])
+        self.assertEqual(self.offsets(position=0), [0, 10, 18, 30])
+
+    def test_bundle_starts_at_the_beginning_without_an_open_session(self):
+        ReadingSession.objects.filter(id=self.fixtures.session.id).update(end_datetime=timezone.now())
+        self.assertEqual(self.offsets(), [0, 10, 18, 30])
+
+
+# A story's language picks its espeak voice - an unknown one would phonemize every sentence to nothing
+@mock.patch('apps.users.views.index_story')
+class StoryLanguageTests(TestCase):
+
+    def setUp(self):
+        self.fixtures = Fixtures(SIZES['small'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.fixtures.admin)
+
+    def test_standard_update_rejects_an_unknown_language(self, index_story):
+        url = reverse('story-detail', kwargs={'pk': self.fixtures.story.id})
+        self.assertEqual(self.client.patch(url, {'language': 'xx'}, format='json').status_code, 400)
+        self.assertEqual(self.client.patch(url, {'language': 'en'}, format='json').status_code, 200)
+
+    def test_update_story_rejects_an_unknown_language(self, index_story):
+        url = reverse('story-update-story', kwargs={'pk': self.fixtures.story.id})
+        data = {'title': 'Renamed', 'description': 'd', 'fulltext': 'Changed text.', 'difficulty_level': 'hard'}
+        self.assertEqual(self.client.put(url, {**data, 'language': 'klingon'}).status_code, 400)
+        self.assertEqual(self.client.put(url, data).status_code, 200)
+        index_story.assert_called_once()
+
+
+# Loading the app (urls, views, the ASGI streaming endpoint) mustn't import the model or spaCy stacks
+class StartupImportTests(SimpleTestCase):
+
+    def test_loading_the_app_skips_heavy_libraries(self):
+        code = ('import sys, django; django.setup(); import readbackend.urls, apps.users.streaming; '
+                'print(sorted(name for name in ("torch", "transformers", "spacy", "lytspel") if name in sys.modules))')
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), '[]')
+
+
+class FakeRecognizer:
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def memory_bytes(self):
+        return 0
+
+
+# Loading a model mustn't hold up requests for models that are already loaded
+@mock.patch.dict(recognizer._load_locks)
+@mock.patch.dict(recognizer._sizes)
+@mock.patch.dict(recognizer._recognizers)
+class RecognizerRegistryTests(SimpleTestCase):
+
+    def test_loaded_models_are_served_while_another_loads(self):
+        recognizer._recognizers['main'] = FakeRecognizer('main')
+        loading, release = threading.Event(), threading.Event()
+
+        def slow_load(backend, model_name):
+            loading.set()
+            release.wait(5)
+            return FakeRecognizer(model_name)
+
+        with mock.patch.object(recognizer, 'create_recognizer', side_effect=slow_load):
+            loader = threading.Thread(target=recognizer.get_recognizer, args=('second',))
+            loader.start()
+            self.assertTrue(loading.wait(5))
+            start = time.monotonic()
+            self.assertEqual(recognizer.get_recognizer('main').model_name, 'main')
+            self.assertLess(time.monotonic() - start, 1)
+            release.set()
+            loader.join()
+        self.assertIn('second', recognizer._recognizers)
+
+    def test_concurrent_first_requests_load_once(self):
+        def load(backend, model_name):
+            time.sleep(0.1)
+            return FakeRecognizer(model_name)
+
+        with mock.patch.object(recognizer, 'create_recognizer', side_effect=load) as create:
+            threads = [threading.Thread(target=recognizer.get_recognizer, args=('second',)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        create.assert_called_once()
+
+
+# A tokenizer with a toy phoneme vocabulary: blank (pad) 0, word delimiter 1, phonemes a, b, c, tʃ
+class ToyTokenizer:
+    all_special_tokens = ['<pad>']
+    word_delimiter_token = '|'
+    pad_token_id = 0
+
+    def get_vocab(self):
+        return {'<pad>': 0, '|': 1, 'a': 2, 'b': 3, 'c': 4, 'tʃ': 5}
+
+
+# Frame log-probabilities that put almost all the mass on one token per frame
+def peaked_log_probs(frame_ids, vocab_size=6):
+    probs = np.full((len(frame_ids), vocab_size), 0.01)
+    probs[np.arange(len(frame_ids)), frame_ids] = 1.0
+    return np.log(probs / probs.sum(axis=-1, keepdims=True))
+
+
+TOY_HOP = 320  # Samples per logit frame of ToyCTCRecognizer
+
+
+class ToyInputs(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+# Pads a batch the way Wav2Vec2Processor does, with an attention mask if the model uses one
+class ToyProcessor:
+    def __init__(self, uses_attention_mask):
+        self.feature_extractor = SimpleNamespace(return_attention_mask=uses_attention_mask)
+
+    def __call__(self, waveforms, return_tensors, sampling_rate, padding=False, return_attention_mask=False):
+        waveforms = [waveforms] if np.ndim(waveforms[0]) == 0 else waveforms
+        longest = max(len(waveform) for waveform in waveforms)
+        inputs = ToyInputs(input_values=np.zeros((len(waveforms), longest), dtype=np.float32))
+        mask = np.zeros((len(waveforms), longest), dtype=np.int64)
+        for row, waveform in enumerate(waveforms):
+            inputs.input_values[row, :len(waveform)] = waveform
+            mask[row, :len(waveform)] = 1
+        if return_attention_mask:
+            inputs['attention_mask'] = mask
+        return inputs
+
+
+# A CTC "model" with one frame per TOY_HOP samples: frame energy against the clip's mean energy (a stand-in for
+# group norm), so frames depend on the whole input - padding changes them unless the attention mask excludes it
+class ToyCTCRecognizer(recognizer.Recognizer):
+    name = 'toy'
+
+    def __init__(self, uses_attention_mask=True):
+        self.model_name = 'toy'
+        self.processor = ToyProcessor(uses_attention_mask)
+        self.config = SimpleNamespace(conv_kernel=[TOY_HOP], conv_stride=[TOY_HOP])
+        self.batch_shapes = []
+
+    def forward(self, input_values, attention_mask=None):
+        self.batch_shapes.append(input_values.shape)
+        mask = attention_mask if attention_mask is not None else np.ones(input_values.shape)
+        energy = input_values ** 2
+        mean = (energy * mask).sum(axis=1, keepdims=True) / mask.sum(axis=1, keepdims=True)
+        frames = input_values.shape[1] // TOY_HOP
+        frame_energy = energy[:, :frames * TOY_HOP].reshape(len(energy), frames, TOY_HOP).mean(axis=-1)
+        return np.stack([frame_energy - mean, np.zeros_like(frame_energy), mean - frame_energy], axis=-1)
+
+
+# Clips of random noise, each length a whole number of frames
+def noise_clips(*frame_counts):
+    rng = np.random.default_rng(0)
+    return [rng.standard_normal(frames * TOY_HOP).astype(np.float32) for frames in frame_counts]
+
+
+class BatchLogitsTests(SimpleTestCase):
+
+    def test_padded_frames_are_dropped(self):
+        for uses_attention_mask in (True, False):
+            with self.subTest(uses_attention_mask=uses_attention_mask):
+                toy = ToyCTCRecognizer(uses_attention_mask)
+                clips = noise_clips(5, 12, 8)
+                results = batch_logits(clips, toy)
+                self.assertEqual([len(result) for result in results], [5, 12, 8])
+                for clip, result in zip(clips, results):
+                    np.testing.assert_allclose(result, batch_logits([clip], ToyCTCRecognizer(uses_attention_mask))[0],
+                                               rtol=1e-5, atol=1e-6)
+
+    def test_clips_share_a_pass_when_the_mask_hides_the_padding(self):
+        toy = ToyCTCRecognizer(uses_attention_mask=True)
+        batch_logits(noise_clips(5, 12, 8), toy)
+        self.assertEqual(toy.batch_shapes, [(3, 12 * TOY_HOP)])
+
+    def test_maskless_models_only_batch_clips_of_one_length(self):
+        toy = ToyCTCRecognizer(uses_attention_mask=False)
+        batch_logits(noise_clips(5, 12, 5, 8), toy)
+        self.assertEqual(sorted(toy.batch_shapes), [(1, 8 * TOY_HOP), (1, 12 * TOY_HOP), (2, 5 * TOY_HOP)])
+
+
+# A CTC "model" whose frames only see their own samples and one frame either side (a short receptive field, like
+# a conv/attention stack's), so chunks with at least a frame of overlap reproduce a single pass exactly
+class LocalCTCRecognizer(ToyCTCRecognizer):
+
+    def forward(self, input_values, attention_mask=None):
+        self.batch_shapes.append(input_values.shape)
+        frames = input_values.shape[1] // TOY_HOP
+        energy = (input_values[:, :frames * TOY_HOP] ** 2).reshape(len(input_values), frames, TOY_HOP).mean(axis=-1)
+        padded = np.pad(energy, ((0, 0), (1, 1)))
+        context = padded[:, :-2] - padded[:, 2:]
+        return np.stack([energy, context, energy * context], axis=-1)
+
+
+class ChunkedLogitsTests(SimpleTestCase):
+
+    def clip(self, samples):
+        return np.random.default_rng(1).standard_normal(samples).astype(np.float32)
+
+    # Chunk sizes and overlaps (seconds) that split the clips below at different frames
+    SPLITS = [(0.2, 0.04), (0.3, 0.02), (0.16, 0.06), (0.5, 0.1)]
+
+    def test_chunks_match_a_single_pass(self):
+        # Whole frames, a partial last frame, and a tail short enough to be folded into the last window
+        for samples in (37 * TOY_HOP, 41 * TOY_HOP + 100, 50 * TOY_HOP + TOY_HOP // 2):
+            clip = self.clip(samples)
+            single = waveform_logits(clip, LocalCTCRecognizer())
+            for chunk_seconds, overlap_seconds in self.SPLITS:
+                with self.subTest(samples=samples, chunk=chunk_seconds, overlap=overlap_seconds), \
+                        override_settings(RECOGNIZER_CHUNK_SECONDS=chunk_seconds,
+                                          RECOGNIZER_CHUNK_OVERLAP_SECONDS=overlap_seconds):
+                    toy = LocalCTCRecognizer()
+                    chunked = chunked_logits(clip, toy)
+                    self.assertGreater(len(toy.batch_shapes), 1)
+                    self.assertEqual(chunked.shape, single.shape)
+                    np.testing.assert_allclose(chunked, single, rtol=1e-6)
+
+    # Every frame comes from exactly one window, and the frames either side of each split line up with the clip
+    def test_frames_stay_aligned_across_chunk_boundaries(self):
+        clip = np.zeros(40 * TOY_HOP, dtype=np.float32)
+        clip[::TOY_HOP] = np.arange(40)  # Frame i's energy is i**2 / TOY_HOP
+        with override_settings(RECOGNIZER_CHUNK_SECONDS=0.2, RECOGNIZER_CHUNK_OVERLAP_SECONDS=0.04):
+            energy = chunked_logits(clip, LocalCTCRecognizer())[:, 0]
+        np.testing.assert_allclose(energy * TOY_HOP, np.arange(40) ** 2, rtol=1e-5)
+
+    def test_rejects_an_overlap_that_leaves_no_step(self):
+        with override_settings(RECOGNIZER_CHUNK_SECONDS=0.2, RECOGNIZER_CHUNK_OVERLAP_SECONDS=0.1):
+            with self.assertRaises(ValueError):
+                chunked_logits(self.clip(40 * TOY_HOP), LocalCTCRecognizer())
+
+
+class BatchingSchedulerTests(SimpleTestCase):
+
+    def test_requests_are_bucketed_by_length(self):
+        scheduler = BatchingScheduler(lambda waveforms: waveforms, max_batch_size=3, bucket_ratio=1.5)
+        pending = [(np.zeros(length), None) for length in (1000, 100, 140, 1400, 130, 1200, 1100)]
+        buckets = [[len(waveform) for waveform, _ in bucket] for bucket in scheduler._buckets(pending)]
+        # Never more than max_batch_size, nor clips over 1.5x the bucket's shortest
+        self.assertEqual(buckets, [[100, 130, 140], [1000, 1100, 1200], [1400]])
+
+    def test_each_caller_gets_its_own_result(self):
+        batches = []
+
+        def run_batch(waveforms):
+            batches.append(len(waveforms))
+            return [len(waveform) for waveform in waveforms]
+
+        scheduler = BatchingScheduler(run_batch, max_batch_size=8, max_wait_ms=200)
+        futures = [scheduler.submit(np.zeros(length)) for length in (300, 100, 200, 250)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [300, 100, 200, 250])
+        self.assertLess(len(batches), 4)  # Requests within the window shared a batch
+
+    def test_errors_reach_every_caller_in_the_batch(self):
+        scheduler = BatchingScheduler(mock.Mock(side_effect=RuntimeError('model crashed')), max_wait_ms=200)
+        futures = [scheduler.submit(np.zeros(100)) for _ in range(3)]
+        with self.assertLogs('apps.users.inference', 'ERROR'):
+            for future in futures:
+                with self.assertRaisesRegex(RuntimeError, 'model crashed'):
+                    future.result(timeout=5)
+
+
+class ScoringTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vocab = PhonemeVocab(ToyTokenizer())
+
+    def test_words_without_phonemes_fail_unless_they_are_punctuation(self):
+        words = score_words(peaked_log_probs([2, 0, 3]), [('ab', 'a b'), ('Hello', ''), ('...', '')], self.vocab, 0.02)
+        self.assertEqual([word['correct'] for word in words], [True, False, True])
+        self.assertIsNone(words[1]['score'])
+
+    # espeak missing or an unknown voice gives no phonemes for the whole sentence - that can't pass
+    def test_a_sentence_with_no_readable_words_fails(self):
+        self.assertFalse(reading_verdict([])['match'])
+        words = score_words(peaked_log_probs([2, 3]), [('Once', ''), ('upon', '')], self.vocab, 0.02)
+        self.assertFalse(reading_verdict(words)['match'])
+
+    def test_punctuation_is_left_out_of_the_verdict(self):
+        words = score_words(peaked_log_probs([2, 0, 3]), [('ab', 'a b'), ('-', '')], self.vocab, 0.02)
+        self.assertTrue(reading_verdict(words)['match'])
+
+
+# Toy phonemizer for ToyTokenizer's vocabulary: each word's phonemes are its letters a, b and c
+def toy_phonemes(text, language=None):
+    return ' '.join(re.sub('[^abc]', '', word) for word in text.split())
+
+
+@mock.patch('apps.users.transcript_scoring.text_to_phonemes', side_effect=toy_phonemes)
+class TranscriptScoringTests(SimpleTestCase):
+    expected = [('ab', 'ab'), ('cab', 'cab'), ('ba', 'ba')]
+
+    # A transcription with one word per second
+    def transcript(self, *words):
+        return [(word, float(second), second + 1.0, 0.9) for second, word in enumerate(words)]
+
+    def score(self, recognized, expected=None, threshold=0.5):
+        return score_transcript(recognized, expected or self.expected, PhonemeVocab(ToyTokenizer()), threshold)
+
+    def verdicts(self, words):
+        return [(word['word'], word['score'], word['correct']) for word in words]
+
+    def test_a_correct_reading(self, text_to_phonemes):
+        words = self.score(self.transcript('ab', 'cab', 'ba'))
+        self.assertEqual(self.verdicts(words), [('ab', 1.0, True), ('cab', 1.0, True), ('ba', 1.0, True)])
+        self.assertEqual([(word['start'], word['end']) for word in words], [(0.0, 1.0), (1.0, 2.0), (2.0, 3.0)])
+
+    def test_a_substituted_word_is_scored_by_phoneme_similarity(self, text_to_phonemes):
+        words = self.score(self.transcript('ab', 'cb', 'ba'))
+        self.assertEqual(self.verdicts(words)[1], ('cab', 0.667, True))
+        words = self.score(self.transcript('ab', 'cc', 'ba'))
+        self.assertEqual(self.verdicts(words)[1], ('cab', 0.333, False))
+        self.assertTrue(words[2]['correct'])
+
+    def test_a_skipped_word_fails_without_shifting_the_rest(self, text_to_phonemes):
+        words = self.score(self.transcript('ab', 'ba'))
+        self.assertEqual(self.verdicts(words), [('ab', 1.0, True), ('cab', 0.0, False), ('ba', 1.0, True)])
+        self.assertEqual((words[1]['start'], words[2]['start']), (None, 1.0))
+
+    def test_an_inserted_word_is_ignored(self, text_to_phonemes):
+        words = self.score(self.transcript('ab', 'bb', 'cab', 'ba'))
+        self.assertEqual(self.verdicts(words), [('ab', 1.0, True), ('cab', 1.0, True), ('ba', 1.0, True)])
+        self.assertEqual(words[1]['start'], 2.0)
+
+    def test_nothing_recognized_fails_every_word(self, text_to_phonemes):
+        self.assertEqual([word['correct'] for word in self.score([])], [False, False, False])
+
+    # Punctuation can't be misread; a real word that phonemized to nothing can't pass
+    def test_words_without_phonemes(self, text_to_phonemes):
+        words = self.score(self.transcript('ab', 'ba'), expected=[('ab', 'ab'), ('-', ''), ('Hello', ''), ('ba', 'ba')])
+        self.assertEqual(self.verdicts(words), [('ab', 1.0, True), ('-', None, True), ('Hello', None, False),
+                                                ('ba', 1.0, True)])
+
+    # A segment transcribed as several words is split, each piece keeping the segment's timing
+    def test_multi_word_segments_are_split(self, text_to_phonemes):
+        words = self.score([('ab cab', 0.0, 2.0, 0.9), ('ba', 2.0, 3.0, 0.9)])
+        self.assertEqual([word['correct'] for word in words], [True, True, True])
+        self.assertEqual((words[1]['start'], words[1]['end']), (0.0, 2.0))
+
+    def test_the_pass_mark_is_the_threshold(self, text_to_phonemes):
+        recognized = self.transcript('ab', 'cb', 'ba')  # "cab" read with a similarity of 0.667
+        self.assertTrue(self.score(recognized, threshold=0.6)[1]['correct'])
+        self.assertFalse(self.score(recognized, threshold=0.7)[1]['correct'])
+
+
+# Frame log-probabilities that give one token per frame the probability `peak` and share the rest evenly
+def unsure_log_probs(frame_ids, peak, vocab_size=6):
+    probs = np.full((len(frame_ids), vocab_size), (1 - peak) / (vocab_size - 1))
+    probs[np.arange(len(frame_ids)), frame_ids] = peak
+    return np.log(probs)
+
+
+@override_settings(RECOGNIZER_CASCADE=True, RECOGNIZER_FAST_MODEL_NAME='fast', RECOGNIZER_MODEL_NAME='full',
+                   RECOGNIZER_LANGUAGE_MODELS={}, READING_DEFAULT_LANGUAGE='en',
+                   RECOGNIZER_CASCADE_MIN_CONFIDENCE=0.8, RECOGNIZER_CASCADE_MARGIN=0.1)
+class CascadeTests(SimpleTestCase):
+    text_phonemes = 'a b c a b'
+    read = [2, 0, 3, 0, 4, 0, 2, 0, 3]  # All five phonemes
+    misread = [3, 0, 2, 0, 3, 0, 4, 0, 4]  # Only the b in place
+    nearly_read = [2, 0, 3, 0, 2, 0, 2, 0, 3]  # One substitution: similarity 0.8, within the margin of 0.75
+
+    def setUp(self):
+        vocab = PhonemeVocab(ToyTokenizer())
+        patcher = mock.patch.dict(phoneme_vocab._vocabs, {'fast': vocab, 'full': vocab})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Run the cascade with the Levenshtein scorer; returns (similarity, models run, change in the tier counters)
+    def run_cascade(self, fast, full, language='en'):
+        logits = {'fast': fast, 'full': full}
+        models = []
+
+        def waveform_to_logits(waveform, model_name):
+            models.append(model_name)
+            return logits[model_name]
+
+        def score(log_probs, model_name):
+            return phoneme_similarity(log_probs, self.text_phonemes, model_name)
+
+        before = metrics.snapshot()
+        with mock.patch('apps.users.audio_processing.waveform_to_logits', side_effect=waveform_to_logits):
+            similarity = cascade(np.zeros(SAMPLE_RATE), score, lambda similarity: abs(similarity - 0.75) < 0.1,
+                                 language)
+        after = metrics.snapshot()
+        counters = {
+            tier: after.get(name, 0) - before.get(name, 0)
+            for tier, name in (('fast', 'cascade_fast_decisions'), ('full', 'cascade_full_decisions'))
+        }
+        return similarity, models, counters
+
+    def test_a_confident_pass_is_decided_by_the_fast_model(self):
+        similarity, models, counters = self.run_cascade(peaked_log_probs(self.read), peaked_log_probs(self.misread))
+        self.assertEqual((similarity, models, counters), (1.0, ['fast'], {'fast': 1, 'full': 0}))
+
+    def test_a_confident_fail_is_decided_by_the_fast_model(self):
+        similarity, models, counters = self.run_cascade(peaked_log_probs(self.misread), peaked_log_probs(self.read))
+        self.assertLess(similarity, 0.5)
+        self.assertEqual((models, counters), (['fast'], {'fast': 1, 'full': 0}))
+
+    def test_an_unsure_fast_model_escalates(self):
+        similarity, models, counters = self.run_cascade(unsure_log_probs(self.read, peak=0.5),
+                                                        peaked_log_probs(self.misread))
+        self.assertLess(similarity, 0.5)  # The full model's verdict
+        self.assertEqual((models, counters), (['fast', 'full'], {'fast': 0, 'full': 1}))
+
+    def test_a_score_near_the_pass_mark_escalates(self):
+        similarity, models, counters = self.run_cascade(peaked_log_probs(self.nearly_read), peaked_log_probs(self.read))
+        self.assertEqual((similarity, models, counters), (1.0, ['fast', 'full'], {'fast': 0, 'full': 1}))
+
+    def test_only_the_full_model_runs_without_the_cascade(self):
+        with override_settings(RECOGNIZER_CASCADE=False):
+            result = self.run_cascade(peaked_log_probs(self.misread), peaked_log_probs(self.read))
+        self.assertEqual(result, (1.0, ['full'], {'fast': 0, 'full': 0}))
+
+    # The fast model is English-only - other languages go straight to their own model
+    def test_other_languages_skip_the_fast_model(self):
+        result = self.run_cascade(peaked_log_probs(self.misread), peaked_log_probs(self.read), language='fr')
+        self.assertEqual(result, (1.0, ['full'], {'fast': 0, 'full': 0}))
+
+    def test_confidence_is_the_mean_peak_over_emitted_frames(self):
+        # Blank frames don't count, however sure the model is of them
+        self.assertAlmostEqual(ctc_confidence(unsure_log_probs([2, 0, 3, 0], peak=0.6), blank_id=0), 0.6)
+        self.assertAlmostEqual(ctc_confidence(unsure_log_probs([2, 3], peak=0.9), blank_id=0), 0.9)
+        self.assertEqual(ctc_confidence(peaked_log_probs([0, 0, 0]), blank_id=0), 0.0)
+
+
+class AlignmentTests(SimpleTestCase):
+
+    def test_known_alignment(self):
+        # a a _ b: both a frames belong to the first token, the blank to neither
+        self.assertEqual(forced_align(peaked_log_probs([2, 2, 0, 3]), [2, 3], 0).tolist(), [0, 0, -1, 1])
+
+    def test_repeated_tokens_need_a_blank_between(self):
+        self.assertEqual(forced_align(peaked_log_probs([2, 0, 2]), [2, 2], 0).tolist(), [0, -1, 1])
+        self.assertIsNone(forced_align(peaked_log_probs([2, 2]), [2, 2], 0))
+
+    def test_clip_too_short_for_the_tokens(self):
+        self.assertIsNone(forced_align(peaked_log_probs([2]), [2, 3], 0))
+        self.assertIsNone(forced_align(peaked_log_probs([2, 3]), [], 0))
+
+    def test_words_are_timed_and_scored(self):
+        vocab = PhonemeVocab(ToyTokenizer())
+        words = score_words(peaked_log_probs([2, 0, 3, 0, 2, 2]), [('ab', 'a b'), ('see', 'c')], vocab, 0.02)
+        self.assertEqual((words[0]['start'], words[0]['end'], words[0]['correct']), (0.0, 0.06, True))
+        # The alignment forces "c" onto frames where the model heard "a" - the word scores low and fails
+        self.assertFalse(words[1]['correct'])
+        self.assertLess(words[1]['score'], settings.WORD_SCORE_THRESHOLD)
+
+
+class PhonemeVocabTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vocab = PhonemeVocab(ToyTokenizer())
+
+    def test_encode_takes_the_longest_phoneme(self):
+        self.assertEqual(self.vocab.encode('tʃa b').tolist(), [5, 2, 3])
+
+    def test_encode_skips_what_the_model_cant_emit(self):
+        self.assertEqual(self.vocab.encode('ˈa|b').tolist(), [2, 3])
+
+    def test_collapse_drops_repeats_blanks_and_delimiters(self):
+        self.assertEqual(self.vocab.collapse([2, 2, 0, 2, 1, 3, 3]).tolist(), [2, 2, 3])
+        self.assertEqual(self.vocab.recognized(peaked_log_probs([0, 5, 5, 0])).tolist(), [5])
+
+
+class VadTests(SimpleTestCase):
+
+    def tone(self, seconds, amplitude=0.5):
+        return (amplitude * np.sin(2 * np.pi * 220 * np.arange(int(seconds * 16000)) / 16000)).astype(np.float32)
+
+    def test_silence_is_rejected(self):
+        for clip in (np.zeros(16000, dtype=np.float32), np.zeros(100, dtype=np.float32), self.tone(0.1)):
+            with self.assertRaises(NoSpeechDetected):
+                trim_silence(clip)
+
+    def test_silence_around_speech_is_trimmed(self):
+        silence = np.zeros(16000, dtype=np.float32)
+        trimmed = trim_silence(np.concatenate([silence, self.tone(0.5), silence]))
+        # The speech plus VAD_PADDING_MS on each side
+        self.assertEqual(len(trimmed), int((0.5 + 2 * settings.VAD_PADDING_MS / 1000) * 16000))
+
+    def test_long_pauses_are_shortened(self):
+        pause = np.zeros(3 * 16000, dtype=np.float32)
+        trimmed = trim_silence(np.concatenate([self.tone(0.5), pause, self.tone(0.5)]))
+        # The pause keeps the padding after and before speech, plus VAD_MAX_PAUSE_MS of the gap between
+        pause_ms = 2 * settings.VAD_PADDING_MS + settings.VAD_MAX_PAUSE_MS
+        self.assertEqual(len(trimmed), 16000 + 16 * pause_ms)
+
+
+class StoryIndexTests(SimpleTestCase):
+
+    fulltext = 'Once upon a time.  "Run!" The end'
+
+    def test_split_sentences(self):
+        self.assertEqual(split_sentences(self.fulltext), [(0, 'Once upon a time.'), (19, '"Run!"'), (26, 'The end')])
+
+    @mock.patch('apps.users.story_index.get_phonetic_spellings', return_value={})
+    @mock.patch('apps.users.story_index.text_to_phonemes', side_effect=lambda text, language: text.lower())
+    def test_lookup_phonemes_at_a_position(self, text_to_phonemes, get_phonetic_spellings):
+        story = Story(fulltext=self.fulltext, phoneme_index=build_phoneme_index(self.fulltext))
+        self.assertEqual(lookup_phonemes(story, 17, ' "Run!" '), '"run!"')  # Whitespace before the sentence is skipped
+        self.assertIsNone(lookup_phonemes(story, 19, 'Run!'))  # Split differently from the index
+        self.assertIsNone(lookup_phonemes(story, 5, 'upon a time.'))
+
+    def test_bundle_from_a_position(self):
+        index = {
+            str(offset): {'text': text, 'phonemes': text.lower()} for offset, text in split_sentences(self.fulltext)
+        }
+        story = Story(fulltext=self.fulltext, phoneme_index=index, language='fr')
+        bundle = story_bundle(story, 1, 5)
+        self.assertEqual([sentence['offset'] for sentence in bundle], [19, 26])
+        self.assertEqual(bundle[0]['respellings'], {})  # Only English is respelled
+        self.assertEqual(len(story_bundle(story, 0, 1)), 1)
+
+
+# A clip encoded in memory: a 220 Hz tone, as browsers upload it (webm / opus, 48 kHz stereo) by default
+def encode_clip(seconds, rate=48000, layout='stereo', container='webm', codec='libopus'):
+    samples = (0.3 * np.sin(2 * np.pi * 220 * np.arange(int(seconds * rate)) / rate)).astype(np.float32)
+    channels = 2 if layout == 'stereo' else 1
+    buffer = io.BytesIO()
+    with av.open(buffer, 'w', format=container) as output:
+        stream = output.add_stream(codec, rate=rate, layout=layout)
+        for start in range(0, len(samples), 960):
+            frame = av.AudioFrame.from_ndarray(np.tile(samples[start:start + 960], (channels, 1)), format='fltp',
+                                               layout=layout)
+            frame.sample_rate = rate
+            frame.pts = start
+            output.mux(stream.encode(frame))
+        output.mux(stream.encode(None))
+    return buffer.getvalue()
+
+
+class AudioDecodingTests(TestCase):
+
+    def test_uploads_are_decoded_to_16k_mono_float32(self):
+        for clip in (encode_clip(1.0), encode_clip(1.0, 44100, 'mono', 'wav', 'pcm_s16le')):
+            waveform = decode_audio(io.BytesIO(clip))
+            self.assertEqual((waveform.shape, waveform.dtype), ((SAMPLE_RATE,), np.float32))
+            self.assertGreater(np.abs(waveform).max(), 0.1)
+
+    @override_settings(AUDIO_MAX_SECONDS=0.5)
+    def test_long_recordings_are_rejected(self):
+        with mock.patch('apps.users.audio_processing._decode_with_ffmpeg') as ffmpeg, self.assertRaises(AudioTooLong):
+            decode_audio(io.BytesIO(encode_clip(1.0)))
+        ffmpeg.assert_not_called()
+
+        fixtures = Fixtures(SIZES['small'])
+        data = {'session_id': fixtures.session.id, 'matching_text': 'The end.',
+                'audio_file': SimpleUploadedFile('clip.webm', encode_clip(1.0), content_type='audio/webm')}
+        with mock.patch('apps.users.reading.text_to_phonemes', return_value='ðə ɛnd'):
+            response = APIClient().post(reverse('match-audio'), data, format='multipart')
+        self.assertEqual(response.status_code, 413)
+
+    # Clips PyAV can't open are handed to ffmpeg, asked for raw 16 kHz mono float32
+    @mock.patch('subprocess.Popen')
+    def test_undecodable_clips_fall_back_to_ffmpeg(self, popen):
+        popen.return_value.communicate.return_value = (np.zeros(1600, dtype=np.float32).tobytes(), b'')
+        popen.return_value.returncode = 0
+        waveform = decode_audio(io.BytesIO(b'not a container PyAV knows'))
+        self.assertEqual((waveform.shape, waveform.dtype), ((1600,), np.float32))
+        command = popen.call_args.args[0]
+        self.assertEqual(command[0], 'ffmpeg')
+        self.assertIn('-ac 1 -ar 16000', ' '.join(command))
+        self.assertEqual(popen.return_value.communicate.call_args.kwargs['input'], b'not a container PyAV knows')
+
+        popen.return_value.communicate.return_value = (np.zeros(SAMPLE_RATE * 200, dtype=np.float32).tobytes(), b'')
+        with self.assertRaises(AudioTooLong):
+            decode_audio(io.BytesIO(b'not a container PyAV knows'))
+
+
+# espeak-ng failing (or missing) mustn't be cached, nor leave a story saved without its phoneme index
+@mock.patch.dict(audio_processing._phoneme_caches, clear=True)
+class PhonemizerFailureTests(TestCase):
+
+    def setUp(self):
+        # Uploads are written to MEDIA_ROOT before the save is rolled back
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.fixtures = Fixtures(SIZES['small'])
+        self.client = APIClient()
+        self.client.force_authenticate(self.fixtures.admin)
+
+    def test_empty_results_are_not_cached(self):
+        with mock.patch('apps.users.audio_processing._espeak_phonemes', side_effect=['', 'ðə', 'ɛnd']) as espeak:
+            self.assertEqual(text_to_phonemes('The'), '')
+            self.assertEqual(text_to_phonemes('The'), 'ðə')
+            self.assertEqual(text_to_phonemes('The'), 'ðə')
+        self.assertEqual(espeak.call_count, 2)
+
+    @mock.patch('subprocess.Popen', side_effect=FileNotFoundError('espeak-ng'))
+    def test_missing_espeak_is_unavailable(self, popen):
+        for _ in range(2):
+            with self.assertRaises(PhonemizerUnavailable):
+                text_to_phonemes('The end.')
+        self.assertEqual(popen.call_count, 2)
+
+    @mock.patch('subprocess.Popen', side_effect=FileNotFoundError('espeak-ng'))
+    def test_story_saves_are_rolled_back(self, popen):
+        story = self.fixtures.story
+        response = self.client.post(reverse('story-list'), {
+            'title': 'New', 'description': 'd', 'fulltext': 'A new story.', 'difficulty_level': 'easy',
+            'image': SimpleUploadedFile('new.gif', GIF, content_type='image/gif'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(Story.objects.filter(title='New').exists())
+
+        url = reverse('story-detail', kwargs={'pk': story.id})
+        self.assertEqual(self.client.patch(url, {'fulltext': 'Changed.'}, format='json').status_code, 503)
+        url = reverse('story-update-story', kwargs={'pk': story.id})
+        data = {'title': 'Renamed', 'description': 'd', 'fulltext': 'Changed.', 'difficulty_level': 'hard'}
+        self.assertEqual(self.client.put(url, data).status_code, 503)
+        story.refresh_from_db()
+        self.assertEqual((story.title, story.fulltext, story.bundle_version), ('Story 0', self.fixtures.story.fulltext, 0))
+
+
+class PronounceTests(SimpleTestCase):
+
+    def setUp(self):
+        get_phonetic_spelling.cache_clear()
+        self.addCleanup(get_phonetic_spelling.cache_clear)
+
+    def test_sentence_words(self):
+        self.assertEqual(sentence_words('Hello, world! 42 times.'), ['Hello', 'world', 'times'])
+
+    def test_respellings_are_looked_up_once_per_word(self):
+        converter = mock.Mock(convert_para=mock.Mock(side_effect=str.upper))
+        with mock.patch('apps.users.pronounce._converter', converter):
+            self.assertEqual(get_phonetic_spellings(['cat', 'dog', 'cat']), {'cat': 'CAT', 'dog': 'DOG'})
+            get_phonetic_spellings(['dog'])
+        self.assertEqual(converter.convert_para.call_count, 2)
+
+
+# /get-pronunciations/ respells a sentence or a list of words; a SimpleTestCase, so any database query fails the test
+@mock.patch('apps.users.pronounce._converter', mock.Mock(convert_para=mock.Mock(side_effect=str.upper)))
+class BulkPronunciationTests(SimpleTestCase):
+
+    def setUp(self):
+        get_phonetic_spelling.cache_clear()
+        self.addCleanup(get_phonetic_spelling.cache_clear)
+
+    def post(self, data):
+        return self.client.post(reverse('get-pronunciations'), data)
+
+    def test_respells_the_words_of_a_sentence(self):
+        response = self.post({'text': 'The cat sat, the 2 cats!'})
+        self.assertEqual(response.status_code, 200)
+        pronunciations = response.json()['pronunciations']
+        self.assertEqual(list(pronunciations.items()),
+                         [('The', 'THE'), ('cat', 'CAT'), ('sat', 'SAT'), ('the', 'THE'), ('cats', 'CATS')])
+
+    def test_respells_a_list_of_words(self):
+        response = self.post({'words': [' dog ', 'cat', 'dog']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.json()['pronunciations'].items()), [('dog', 'DOG'), ('cat', 'CAT')])
+
+    def test_words_take_precedence_over_text(self):
+        response = self.post({'words': ['dog'], 'text': 'The cat'})
+        self.assertEqual(response.json()['pronunciations'], {'dog': 'DOG'})
+
+    def test_rejects_input_without_words(self):
+        for data in ({}, {'text': ''}, {'text': '... 42 !'}, {'words': ['', '  ']}):
+            with self.subTest(data=data):
+                response = self.post(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Invalid input'})
+
+    @override_settings(PRONUNCIATION_MAX_WORDS=3)
+    def test_limits_the_number_of_words(self):
+        self.assertEqual(self.post({'words': ['a', 'b', 'c']}).status_code, 200)
+        for data in ({'words': ['a', 'b', 'c', 'd']}, {'text': 'one two three four'}):
+            with self.subTest(data=data):
+                response = self.post(data)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.json(), {'error': 'Too many words (at most 3)'})
+
+
+class ResultCacheTests(TestCase):
+
+    def setUp(self):
+        caches[result_cache.CACHE_ALIAS].clear()
+        self.session = Fixtures(SIZES['small']).session
+
+    def clip(self):
+        return SimpleUploadedFile('clip.wav', b'RIFF-audio')
+
+    def test_key_rewinds_the_clip_and_ignores_whitespace(self):
+        clip = self.clip()
+        key = result_cache.cache_key(self.session.id, 'The  end.', clip)
+        self.assertEqual(clip.read(), b'RIFF-audio')
+        self.assertEqual(key, result_cache.cache_key(self.session.id, 'The end. ', self.clip()))
+        self.assertNotEqual(key, result_cache.cache_key(self.session.id + 1, 'The end.', self.clip()))
+
+    def score(self, apply=None):
+        return score_reading_once(self.session, 'The end.', self.clip(), apply or mock.Mock())
+
+    def key(self):
+        return result_cache.cache_key(self.session.id, 'The end.', self.clip())
+
+    def test_a_retried_clip_gets_the_first_verdict(self):
+        first = {'match': True, 'words': []}
+        apply = mock.Mock()
+        with mock.patch('apps.users.reading.score_reading', return_value=first) as score_reading:
+            self.assertEqual(self.score(apply), (first, True))
+            self.assertEqual(self.score(apply), (first, False))
+        score_reading.assert_called_once()
+        apply.assert_called_once_with(first)
+
+    # A retry arriving while the clip is still being scored waits for that verdict instead of running the model
+    def test_a_concurrent_retry_waits_for_the_claimed_verdict(self):
+        winner = {'match': False, 'words': []}
+        self.assertTrue(result_cache.claim(self.key()))
+        apply = mock.Mock()
+        with mock.patch('apps.users.reading.score_reading') as score_reading, \
+                mock.patch('apps.users.reading.time.sleep', side_effect=lambda _: result_cache.store(self.key(), winner)):
+            self.assertEqual(self.score(apply), (winner, False))
+        score_reading.assert_not_called()
+        apply.assert_not_called()
+
+    # The request holding the claim failed - the waiting retry claims the clip and scores it itself
+    def test_a_released_claim_is_scored_by_the_waiting_retry(self):
+        verdict = {'match': True, 'words': []}
+        self.assertTrue(result_cache.claim(self.key()))
+        apply = mock.Mock()
+        with mock.patch('apps.users.reading.score_reading', return_value=verdict), \
+                mock.patch('apps.users.reading.time.sleep', side_effect=lambda _: result_cache.release(self.key())):
+            self.assertEqual(self.score(apply), (verdict, True))
+        apply.assert_called_once_with(verdict)
+
+    # A verdict that couldn't be scored or applied isn't cached, so the client's retry is scored and applied
+    def test_a_failed_attempt_releases_its_claim(self):
+        verdict = {'match': True, 'words': []}
+        failures = {
+            'scoring': (mock.Mock(side_effect=TimeoutError()), mock.Mock()),
+            'applying': (mock.Mock(return_value=verdict), mock.Mock(side_effect=DatabaseError())),
+        }
+        for failure, (score_reading, apply) in failures.items():
+            with self.subTest(failure=failure):
+                with mock.patch('apps.users.reading.score_reading', score_reading):
+                    with self.assertRaises((TimeoutError, DatabaseError)):
+                        self.score(apply)
+                self.assertIsNone(result_cache.get(self.key()))
+
+                apply = mock.Mock()
+                with mock.patch('apps.users.reading.score_reading', return_value=verdict):
+                    self.assertEqual(self.score(apply), (verdict, True))
+                apply.assert_called_once_with(verdict)
+                caches[result_cache.CACHE_ALIAS].clear()
+
+
+# Every named URL pattern under urlpatterns (the admin site excepted)
+def url_names(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.app_name != 'admin':
+                yield from url_names(pattern.url_patterns)
+        elif pattern.name:
+            yield pattern.name
+
+
+# Context manager for a block whose database changes are always rolled back
+class rolled_back:
+    def __enter__(self):
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+
+    def __exit__(self, *exc_info):
+        transaction.set_rollback(True)
+        self.atomic.__exit__(*exc_info)
@@ -0,0 +1,52 @@
+'''Word-level scoring for recognizers that transcribe words (the faster-whisper backend)
+
+The recognized words are phonemized and aligned to the expected words with a word-level edit alignment. Each expected
+word is scored by the phoneme similarity of the recognized word it lines up with (0 if it was skipped), so the
+results have the same shape as alignment.score_words and the same pass mark applies.
+'''
+
+from rapidfuzz.distance import Levenshtein
+
+from .alignment import is_readable, word_phonemes
+from .audio_processing import text_to_phonemes
+
+
+# Function to score each expected word against a transcription [(word, start, end, probability)]
+# Returns [{"index", "word", "start", "end", "score", "correct"}] - see alignment.score_words
+def score_transcript(recognized, expected_words, vocab, threshold, language=None):
+    # One entry per whitespace-separated word, so entries line up with the phonemized words
+    recognized = [
+        (piece, start, end, probability) for word, start, end, probability in recognized for piece in word.split()
+    ]
+    transcript = ' '.join(word for word, _, _, _ in recognized)
+    recognized_words = word_phonemes(transcript, text_to_phonemes(transcript, language), language) if transcript else []
+    recognized_ids = [tuple(vocab.encode(phonemes).tolist()) for _, phonemes in recognized_words]
+    expected_ids = [tuple(vocab.encode(phonemes).tolist()) for _, phonemes in expected_words]
+
+    # Which recognized word (if any) each expected word lines up with
+    matches = [None] * len(expected_words)
+    for tag, expected_start, expected_end, recognized_start, recognized_end in Levenshtein.opcodes(
+        expected_ids, recognized_ids
+    ):
+        if tag in ('equal', 'replace'):
+            for offset in range(min(expected_end - expected_start, recognized_end - recognized_start)):
+                matches[expected_start + offset] = recognized_start + offset
+
+    results = []
+    for index, (word, _) in enumerate(expected_words):
+        result = {'index': index, 'word': word, 'start': None, 'end': None, 'score': None, 'correct': True}
+        if not expected_ids[index]:
+            if is_readable(word):
+                result.update(correct=False)  # Its phonemes are missing - it can't be scored, so it can't pass
+            results.append(result)  # Otherwise nothing to compare (e.g. punctuation only) - can't be misread
+            continue
+
+        match = matches[index]
+        if match is None:
+            result.update(score=0.0, correct=False)
+        else:
+            _, start, end, _ = recognized[match]
+            score = Levenshtein.normalized_similarity(expected_ids[index], recognized_ids[match])
+            result.update(start=round(start, 3), end=round(end, 3), score=round(score, 3), correct=score >= threshold)
+        results.append(result)
+    return results
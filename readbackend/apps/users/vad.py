@@ -0,0 +1,56 @@
+'''Voice-activity trimming - cut silence out of a clip before it reaches the recognizer (compute grows with length)'''
+
+import numpy as np
+from django.conf import settings
+
+FRAME_MS = 20  # Energy is measured over 20 ms frames (one wav2vec2 logit frame)
+
+
+class NoSpeechDetected(ValueError):
+    pass
+
+
+# Function to trim leading / trailing silence and shorten long internal pauses of a 16 kHz waveform
+# A frame counts as speech if its energy is within VAD_DYNAMIC_RANGE_DB of the loudest frame and above the noise floor
+# Raises NoSpeechDetected if the clip is (near) silent
+def trim_silence(waveform, sample_rate=16000):
+    frame = sample_rate * FRAME_MS // 1000
+    num_frames = len(waveform) // frame
+    if num_frames == 0:
+        raise NoSpeechDetected('No speech detected')
+
+    frames = waveform[:num_frames * frame].reshape(num_frames, frame)
+    energy_db = 10 * np.log10(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-12)
+    peak_db = energy_db.max()
+    noise_floor_db = np.percentile(energy_db, 10)
+    threshold_db = max(peak_db - settings.VAD_DYNAMIC_RANGE_DB, noise_floor_db + settings.VAD_NOISE_MARGIN_DB)
+    # A clip with no quiet part has its "noise floor" at the peak - the loudest frames always count as speech
+    threshold_db = min(threshold_db, peak_db - settings.VAD_NOISE_MARGIN_DB)
+
+    speech = energy_db > threshold_db
+    if peak_db < settings.VAD_MIN_PEAK_DB or speech.sum() * FRAME_MS < settings.VAD_MIN_SPEECH_MS:
+        raise NoSpeechDetected('No speech detected')
+
+    # Keep some padding around speech so soft onsets / trailing consonants aren't clipped
+    padding = settings.VAD_PADDING_MS // FRAME_MS
+    speech_idx = np.flatnonzero(speech)
+    keep = np.zeros(num_frames, dtype=bool)
+    for offset in range(-padding, padding + 1):
+        keep[np.clip(speech_idx + offset, 0, num_frames - 1)] = True
+
+    # Shorten internal pauses longer than VAD_MAX_PAUSE_MS to that length (half from each side of the gap)
+    max_pause = settings.VAD_MAX_PAUSE_MS // FRAME_MS
+    first, last = speech_idx[0], speech_idx[-1]
+    gap_start = None
+    for i in range(first, last + 1):
+        if not keep[i] and gap_start is None:
+            gap_start = i
+        elif keep[i] and gap_start is not None:
+            if i - gap_start > max_pause:
+                keep[gap_start:gap_start + max_pause // 2] = True
+                keep[i - (max_pause - max_pause // 2):i] = True
+            else:
+                keep[gap_start:i] = True
+            gap_start = None
+
+    return frames[keep].reshape(-1)
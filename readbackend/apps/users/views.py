@@ -5,14 +5,18 @@ from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from rest_framework import viewsets
-from .models import User, Story, ReadingSession, Class, Student
+from .models import User, Story, ReadingSession, Class, Student, MatchJob
 from .serializers import UserSerializer, StorySerializer, ReadingSessionSerializer, StudentSerializer, ClassSerializer
+from .serializers import StoryRankingSerializer
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from .audio_processing import compare_phonemes,  compare_phonemes_with_sequence_matcher, compare_phonemes_with_levenshtein
+from rest_framework.exceptions import APIException
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 import base64
+import logging
+import math
 import mimetypes
 from django.utils import timezone
 from datetime import timedelta
@@ -21,10 +25,29 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.contrib.auth.hashers import make_password
 from rest_framework_simplejwt.views import TokenObtainPairView
 from .serializers import CustomTokenObtainPairSerializer
-from .pronounce import get_phonetic_spelling
-from django.db.models import Count, Sum, Avg, F, Q, OuterRef, Subquery
+from .pronounce import get_phonetic_spelling, get_phonetic_spellings, sentence_words
+from django.db.models import Count, F, FilteredRelation, Q, OuterRef, Subquery
 from django.db import transaction
 from django.utils.crypto import get_random_string
+from . import recognizer, metrics
+from .audio_processing import get_scheduler, get_pool_client, AudioTooLong, PhonemizerUnavailable
+from .inference_pool import PoolUnavailable
+from django.conf import settings
+from .story_index import index_story, story_bundle
+from .reading import score_reading_once, record_match_result, reading_result_data
+from .jobs import submit_match_job, wait_for_job
+from .vad import NoSpeechDetected
+from .rollups import (
+    create_class_rollup, get_rollup, record_enrolment, record_reader_added, record_reading_level_change,
+    record_session_change, record_story_removed, record_user_removed, session_totals,
+)
+
+logger = logging.getLogger(__name__)
+
+# Story saves that can't phonemize the text are rolled back - an unindexed story would serve empty bundles
+class StoryIndexUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Phonemizer unavailable - the story was not saved. Try again later.'
 
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
@@ -47,27 +70,51 @@ class AudioMatchView(View):
         except ReadingSession.DoesNotExist:
             return JsonResponse({'error': 'Session not found'}, status=404)
 
-        # Perform the phoneme matching
-        # match_result = compare_phonemes_with_sequence_matcher(audio_file, matching_text)
-        match_result = compare_phonemes_with_levenshtein(audio_file, matching_text)
+        # Async mode: hand the clip to a background job and return its id straight away (poll MatchJobView for the verdict)
+        if request.POST.get('async') in ('1', 'true', 'True'):
+            job = submit_match_job(session, matching_text, audio_file)
+            return JsonResponse({'job_id': str(job.id), 'status': job.status}, status=202)
 
-        with transaction.atomic():
-            session = ReadingSession.objects.select_for_update().get(id=session_id)
-            
-            if not match_result:
-                session.total_errors += 1
-            else:
-                # Update the current position
-                current_position = session.current_position
-                next_position = current_position + len(matching_text)
-                
-                # Ensure we don't exceed the story length
-                session.current_position = min(next_position, len(session.story.fulltext))
+        # Retries of an already-scored clip get the cached verdict and don't update the session again
+        try:
+            result, _ = score_reading_once(
+                session, matching_text, audio_file,
+                apply=lambda result: record_match_result(session_id, matching_text, result['match']),
+            )
+        except NoSpeechDetected:
+            return JsonResponse({'error': 'No speech detected'}, status=400)
+        except AudioTooLong:
+            return JsonResponse({'error': 'Recording too long'}, status=413)
+        except (PoolUnavailable, TimeoutError, PhonemizerUnavailable):
+            # The inference pool (or espeak-ng) is down or overloaded - the client can retry the same clip later
+            return JsonResponse({'error': 'Recognizer unavailable, try again'}, status=503)
+
+        return JsonResponse(reading_result_data(result))
+    
+# View / endpoint for the result of an async /match-audio/ job - long-polls for up to ?wait= seconds
+class MatchJobView(View):
+    
+    def get(self, request, job_id):
+        try:
+            wait = float(request.GET.get('wait', 0))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid input'}, status=400)
+        # nan / inf would never reach the poll's deadline
+        if not math.isfinite(wait):
+            return JsonResponse({'error': 'Invalid input'}, status=400)
+        wait = max(0.0, min(wait, settings.MATCH_JOB_MAX_WAIT))
 
-            session.save()
+        job = wait_for_job(job_id, wait)
+        if job is None:
+            return JsonResponse({'error': 'Job not found'}, status=404)
+
+        data = {'job_id': str(job.id), 'status': job.status}
+        if job.status == MatchJob.DONE:
+            data.update(reading_result_data({'match': job.match, 'words': job.words}))
+        elif job.status == MatchJob.FAILED:
+            data['error'] = job.error
+        return JsonResponse(data, status=202 if job.status in (MatchJob.PENDING, MatchJob.RUNNING) else 200)
 
-        return JsonResponse({'match': match_result})
-    
 # View / endpoint for getting pronunciation of a specified word / sentence
 @method_decorator(csrf_exempt, name='dispatch')
 class PronunciationView(View):
@@ -82,6 +129,72 @@ class PronunciationView(View):
         
         return JsonResponse({'correct_pronunciation': correct_pronunciation})
 
+# View / endpoint for getting the pronunciations of several words at once - a list of words, or every word of a sentence
+@method_decorator(csrf_exempt, name='dispatch')
+class BulkPronunciationView(View):
+
+    def post(self, request):
+        words = request.POST.getlist('words')
+        text = request.POST.get('text')
+        if not words and text:
+            words = sentence_words(text)
+
+        words = [word.strip() for word in words if word.strip()]
+        if not words:
+            return JsonResponse({'error': 'Invalid input'}, status=400)
+        if len(words) > settings.PRONUNCIATION_MAX_WORDS:
+            return JsonResponse({'error': f'Too many words (at most {settings.PRONUNCIATION_MAX_WORDS})'}, status=400)
+
+        return JsonResponse({'pronunciations': get_phonetic_spellings(words)})
+
+# View / endpoint for load balancer readiness checks - ready once the recognizer has been loaded and warmed up
+# With INFERENCE_POOL_ADDRESS set the model only runs in the pool, so readiness is the pool's: at least one worker ready
+class ReadinessView(View):
+
+    def get(self, request):
+        if settings.INFERENCE_POOL_ADDRESS:
+            try:
+                workers = get_pool_client().stats()['workers']
+            except Exception as e:
+                return JsonResponse({'ready': False, 'error': str(e)}, status=503)
+            ready_workers = sum(1 for worker in workers if worker['alive'] and worker['ready'])
+            return JsonResponse({'ready': ready_workers > 0, 'pool_workers_ready': ready_workers},
+                                status=200 if ready_workers else 503)
+
+        if recognizer.is_ready():
+            return JsonResponse({'ready': True})
+
+        # Workers that didn't preload the model warm themselves up in the background while probes return 503
+        recognizer.start_warm_up()
+        return JsonResponse({'ready': False, 'model_loaded': recognizer.is_loaded()}, status=503)
+
+# View / endpoint for monitoring - this process's counters, micro-batching queue, recognizer cascade and inference pool health
+class MetricsView(View):
+
+    def get(self, request):
+        data = {'counters': metrics.snapshot()}
+
+        if settings.INFERENCE_BATCHING:
+            data['batching_queue_depth'] = get_scheduler().queue_depth()
+
+        # How often the fast tier of the recognizer cascade decided on its own
+        if settings.RECOGNIZER_CASCADE:
+            fast = data['counters'].get('cascade_fast_decisions', 0)
+            full = data['counters'].get('cascade_full_decisions', 0)
+            data['cascade'] = {
+                'fast_decisions': fast,
+                'full_decisions': full,
+                'fast_decision_rate': round(fast / (fast + full), 3) if fast + full else None,
+            }
+
+        if settings.INFERENCE_POOL_ADDRESS:
+            try:
+                data['inference_pool'] = get_pool_client().stats()
+            except Exception as e:
+                data['inference_pool'] = {'error': str(e)}
+
+        return JsonResponse(data)
+
 # Viewsets - views & endpoints for all models 
 
 # Viewset for Users
@@ -93,6 +206,18 @@ class UserViewSet(viewsets.ModelViewSet):
         if self.action == 'create' or self.action=='check_username_exists':
             return [AllowAny()]  # Allow user creation without authentication
         return [IsAuthenticated()]  # Require authentication for all other actions
+
+    # Keep the reading rollups in step with reading level / role edits and deleted users
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            previous_level, previous_role = serializer.instance.reading_level, serializer.instance.role
+            user = serializer.save()
+            record_reading_level_change(user, previous_level, previous_role)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_user_removed(instance)
+            instance.delete()
     
     @action(detail=False, methods=['get'])
     def role(self, request):
@@ -129,8 +254,10 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)  # Validate request data
 
-        # Call the superclass method to save the user
-        self.perform_create(serializer)
+        # Call the superclass method to save the user, counting new readers in the reading rollup
+        with transaction.atomic():
+            self.perform_create(serializer)
+            record_reader_added(serializer.instance)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -155,7 +282,7 @@ class UserViewSet(viewsets.ModelViewSet):
 
     # Get a user by username
     @action(detail=True, url_path=r'by-username/(?P<username>\w+)')
-    def get_by_username(self, request, username=None):
+    def get_by_username(self, request, pk=None, username=None):
         user = self.queryset.filter(username=username).first()
         serializer = self.get_serializer(user)
         return Response(serializer.data)
@@ -166,12 +293,12 @@ class UserViewSet(viewsets.ModelViewSet):
         user_exists = self.queryset.filter(username__iexact=username).exists()
         return Response({"exists": user_exists}, status=status.HTTP_200_OK)
 
+    '''Reading averages of all users, or of a class's students (?class_code=) - read from the reading rollups'''
     # Get the average reading duration of all users
     @action(detail=False, methods=['get'])
     def average_reading_duration(self, request):
-        avg_duration = ReadingSession.objects.aggregate(
-            avg_duration=Avg('total_reading_time')
-        )['avg_duration']
+        rollup = get_rollup(request.query_params.get('class_code'))
+        avg_duration = rollup.reading_time / rollup.session_count if rollup and rollup.session_count else None
         
         if avg_duration:
             return Response({"average_duration": str(avg_duration)})
@@ -180,9 +307,8 @@ class UserViewSet(viewsets.ModelViewSet):
     # Get the average story progress of all users
     @action(detail=False, methods=['get'])
     def average_progress(self, request):
-        avg_progress = ReadingSession.objects.aggregate(
-            avg_progress=Avg('story_progress')
-        )['avg_progress']
+        rollup = get_rollup(request.query_params.get('class_code'))
+        avg_progress = rollup.progress_sum / rollup.session_count if rollup and rollup.session_count else None
         
         if avg_progress is not None:
             return Response({"average_progress": avg_progress})
@@ -191,9 +317,8 @@ class UserViewSet(viewsets.ModelViewSet):
     # Get the average reading level of all users
     @action(detail=False, methods=['get'])
     def average_reading_level(self, request):
-        avg_level = User.objects.filter(role='reader').aggregate(
-            avg_level=Avg('reading_level')
-        )['avg_level']
+        rollup = get_rollup(request.query_params.get('class_code'))
+        avg_level = rollup.reading_level_sum / rollup.reader_count if rollup and rollup.reader_count else None
         
         if avg_level is not None:
             return Response({"average_reading_level": avg_level})
@@ -202,10 +327,10 @@ class UserViewSet(viewsets.ModelViewSet):
     # Get the average time to complete a story of all users
     @action(detail=False, methods=['get'])
     def average_time_to_complete(self, request):
-        completed_sessions = ReadingSession.objects.filter(story_progress=100)
-        avg_time = completed_sessions.aggregate(
-            avg_time=Avg('total_reading_time')
-        )['avg_time']
+        rollup = get_rollup(request.query_params.get('class_code'))
+        avg_time = (
+            rollup.completed_reading_time / rollup.completed_count if rollup and rollup.completed_count else None
+        )
         
         if avg_time:
             return Response({"average_time_to_complete": str(avg_time)})
@@ -240,10 +365,81 @@ class UserViewSet(viewsets.ModelViewSet):
         
         
     
+# Pages of a story ranking (?page=, ?page_size=)
+class StoryRankingPagination(PageNumberPagination):
+    page_size = settings.STORY_RANKING_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.STORY_RANKING_MAX_PAGE_SIZE
+
+
 # Viewset for Stories
 class StoryViewSet(viewsets.ModelViewSet):
     queryset = Story.objects.all()
     serializer_class = StorySerializer
+
+    # Story rankings - the engagement counter each one sorts by (see rollups.py; each counter is indexed with id)
+    RANKINGS = {
+        'popularity': 'session_count',
+        'engagement': 'total_reading_time',
+        'completions': 'completed_count',
+    }
+    
+    # Phonemize the new story's sentences once, up front
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic():
+                index_story(serializer.save())
+        except PhonemizerUnavailable as e:
+            logger.error("Story not created - %s", e)
+            raise StoryIndexUnavailable()
+
+    # Take the story's sessions out of the reading rollups before they're deleted with it
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_story_removed(instance)
+            instance.delete()
+    
+    # Re-phonemize on a standard update if the text or language changed
+    def perform_update(self, serializer):
+        data = serializer.validated_data
+        fulltext_changed = 'fulltext' in data and data['fulltext'] != serializer.instance.fulltext
+        language_changed = 'language' in data and data['language'] != serializer.instance.language
+        try:
+            with transaction.atomic():
+                story = serializer.save()
+                if fulltext_changed or language_changed:
+                    index_story(story)
+        except PhonemizerUnavailable as e:
+            logger.error("Story %s not updated - %s", serializer.instance.id, e)
+            raise StoryIndexUnavailable()
+
+    # Prefetch the bundle of the next sentences from ?position= - by default the current position of the requester's
+    # latest open session of the story (or the start, without one): each sentence's offset, expected phonemes and
+    # respellings, tagged with the story's bundle version
+    @action(detail=True, methods=['get'])
+    def bundle(self, request, pk=None):
+        story = self.get_object()
+        try:
+            position = request.query_params.get('position')
+            if position is not None:
+                position = int(position)
+            elif request.user.is_authenticated:
+                position = ReadingSession.objects.filter(
+                    user=request.user, story=story, end_datetime__isnull=True,
+                ).order_by('-start_datetime').values_list('current_position', flat=True).first() or 0
+            else:
+                position = 0
+            count = int(request.query_params.get('count', settings.STORY_BUNDLE_SENTENCES))
+        except ValueError:
+            return Response({'error': 'Invalid input'}, status=status.HTTP_400_BAD_REQUEST)
+        count = max(1, min(count, settings.STORY_BUNDLE_MAX_SENTENCES))
+
+        return Response({
+            'story_id': story.id,
+            'version': story.bundle_version,
+            'language': story.language,
+            'sentences': story_bundle(story, position, count),
+        })
     
     # View to return all stories (without images)
     @action(detail=False, methods=['get'] )
@@ -328,12 +524,12 @@ class StoryViewSet(viewsets.ModelViewSet):
                 return Response({'error': 'Image not found'}, status=status.HTTP_404_NOT_FOUND)
         return Response({'error': 'No image available for this story'}, status=status.HTTP_404_NOT_FOUND)
     
-    # Return the most popular story - most views
+    # Return the most popular story - most views (or the ?top= most popular, as a list)
     @action(detail=False, methods=['get'])
     def most_popular(self, request):
-        story = Story.objects.annotate(
-            session_count=Count('readingsession')
-        ).order_by('-session_count').first()
+        if 'top' in request.query_params:
+            return self._top(request, '-session_count')
+        story = Story.objects.order_by('-session_count', '-id').first()
         
         if story:
             serializer = self.get_serializer(story)
@@ -342,12 +538,12 @@ class StoryViewSet(viewsets.ModelViewSet):
             return Response(data)
         return Response({"detail": "No stories found."}, status=404)
 
-    # Return the least popular story - least views
+    # Return the least popular story - least views (or the ?top= least popular, as a list)
     @action(detail=False, methods=['get'])
     def least_popular(self, request):
-        story = Story.objects.annotate(
-            session_count=Count('readingsession')
-        ).order_by('session_count').first()
+        if 'top' in request.query_params:
+            return self._top(request, 'session_count')
+        story = Story.objects.order_by('session_count', 'id').first()
         
         if story:
             serializer = self.get_serializer(story)
@@ -356,19 +552,46 @@ class StoryViewSet(viewsets.ModelViewSet):
             return Response(data)
         return Response({"detail": "No stories found."}, status=404)
 
-    # Return the most engaged story - most total time reading
+    # Return the most engaged story - most total time reading (or the ?top= most engaged, as a list)
     @action(detail=False, methods=['get'])
     def most_engaged(self, request):
-        story = Story.objects.annotate(
-            total_engagement=Sum('readingsession__total_reading_time')
-        ).order_by('-total_engagement').first()
+        if 'top' in request.query_params:
+            return self._top(request, '-total_reading_time')
+        story = Story.objects.order_by('-total_reading_time', '-id').first()
         
         if story:
             serializer = self.get_serializer(story)
             data = serializer.data
-            data['total_engagement'] = str(story.total_engagement)  # Convert timedelta to string
+            data['total_engagement'] = str(story.total_reading_time)  # Convert timedelta to string
             return Response(data)
         return Response({"detail": "No stories found."}, status=404)
+
+    # Return a page of stories ranked by ?by= (popularity, engagement or completions), ?order= desc (default) or asc
+    @action(detail=False, methods=['get'])
+    def ranking(self, request):
+        counter = self.RANKINGS.get(request.query_params.get('by', 'popularity'))
+        order = request.query_params.get('order', 'desc')
+        if counter is None or order not in ('asc', 'desc'):
+            return Response({'error': f"by must be one of {', '.join(self.RANKINGS)} and order asc or desc."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = StoryRankingPagination()
+        page = paginator.paginate_queryset(self._ranked(counter if order == 'asc' else f'-{counter}'), request, view=self)
+        return paginator.get_paginated_response(StoryRankingSerializer(page, many=True).data)
+
+    # The first ?top= stories of a ranking
+    def _top(self, request, ordering):
+        try:
+            top = int(request.query_params['top'])
+        except ValueError:
+            return Response({'error': 'top must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+        stories = self._ranked(ordering)[:max(1, min(top, settings.STORY_RANKING_MAX_PAGE_SIZE))]
+        return Response(StoryRankingSerializer(stories, many=True).data)
+
+    # Stories ordered by an engagement counter ('-' for descending), ties broken by id in the same direction so the
+    # ordering matches the counter's (counter, id) index
+    def _ranked(self, ordering):
+        return Story.objects.order_by(ordering, '-id' if ordering.startswith('-') else 'id')
      
     # Update a story's data   
     @action(detail=True, methods=['put'])
@@ -383,23 +606,37 @@ class StoryViewSet(viewsets.ModelViewSet):
         description = request.data.get('description')
         fulltext = request.data.get('fulltext')
         difficulty_level = request.data.get('difficulty_level')
+        language = request.data.get('language', story.language)
         image = request.FILES.get('image')  # Handle image file separately
 
         # Validate required fields
         if not title or not description or not fulltext or not difficulty_level:
             return Response({'error': 'All fields are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        if language not in settings.READING_LANGUAGES:
+            return Response({'error': f"Unsupported language - one of {', '.join(settings.READING_LANGUAGES)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        # Perform the update
-        with transaction.atomic():
-            story.title = title
-            story.description = description
-            story.fulltext = fulltext
-            story.difficulty_level = difficulty_level
-
-            if image:
-                story.image = image  # Update image if provided
-
-            story.save()
+        # Perform the update - re-phonemizing runs before the save, so a story that can't be indexed is left as it was
+        try:
+            with transaction.atomic():
+                fulltext_changed = story.fulltext != fulltext or story.language != language
+                story.title = title
+                story.description = description
+                story.fulltext = fulltext
+                story.difficulty_level = difficulty_level
+                story.language = language
+
+                if image:
+                    story.image = image  # Update image if provided
+
+                # Re-phonemize the sentences if the text or language changed
+                if fulltext_changed:
+                    index_story(story, save=False)
+
+                story.save()
+        except PhonemizerUnavailable as e:
+            logger.error("Story %s not updated - %s", story.id, e)
+            return Response({'error': StoryIndexUnavailable.default_detail}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
         # Return updated story data
         serializer = self.get_serializer(story)
@@ -409,6 +646,28 @@ class StoryViewSet(viewsets.ModelViewSet):
 class ReadingSessionViewSet(viewsets.ModelViewSet):
     queryset = ReadingSession.objects.all()
     serializer_class = ReadingSessionSerializer
+
+    # Keep the reading rollups in step with standard creates, updates and deletes
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            session = serializer.save()
+            record_session_change(session.user_id, None, session_totals(session))
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            before = session_totals(serializer.instance)
+            user_id = serializer.instance.user_id
+            session = serializer.save()
+            if session.user_id == user_id:
+                record_session_change(user_id, before, session_totals(session))
+            else:
+                record_session_change(user_id, before, None)
+                record_session_change(session.user_id, None, session_totals(session))
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_session_change(instance.user_id, session_totals(instance), None)
+            instance.delete()
    
     # View to start a reading session
     @action(detail=False, methods=['post'], url_path='start-session')
@@ -431,14 +690,16 @@ class ReadingSessionViewSet(viewsets.ModelViewSet):
             return Response({'session_id': session.id}, status=status.HTTP_200_OK)
 
         # Otherwise, create a new session
-        new_session = ReadingSession.objects.create(
-            user=user,
-            story=story,
-            start_datetime=timezone.now(),
-            story_progress=0.0,  # Initialize progress
-            total_errors=0,       # Initialize errors
-            total_reading_time=timedelta(0)  # Initialize reading time
-        )
+        with transaction.atomic():
+            new_session = ReadingSession.objects.create(
+                user=user,
+                story=story,
+                start_datetime=timezone.now(),
+                story_progress=0.0,  # Initialize progress
+                total_errors=0,       # Initialize errors
+                total_reading_time=timedelta(0)  # Initialize reading time
+            )
+            record_session_change(user.id, None, session_totals(new_session))
 
         return Response({'session_id': new_session.id}, status=status.HTTP_201_CREATED)
     
@@ -448,43 +709,53 @@ class ReadingSessionViewSet(viewsets.ModelViewSet):
         session_id = request.data.get('session_id')
         time_reading = request.data.get('time_reading')
 
-        try:
-            session = ReadingSession.objects.get(id=session_id)
-        except ReadingSession.DoesNotExist:
-            return Response({'error': 'Session not found.'}, status=404)
-
-        session.end_datetime = timezone.now()
-        
-        # Update the user's reading level upon completion of a story
-        user = session.user
-        story = session.story
-        difficulty_level = story.difficulty_level
-        initial_reading_level = user.reading_level
-        story_length = len(story.fulltext)
-        
-        difficulty_multipliers = {
-            "easy": 2,
-            "medium": 4,
-            "hard": 5
-        }
-        
-        multiplier = difficulty_multipliers.get(difficulty_level, 2)  # Default to 2 if difficulty_level is not found
-
-        level_factor = 1 - (initial_reading_level / 500)  # Decreases from 1 to 0 as level approaches 500
-        word_value = (story_length / 100) * multiplier * level_factor
-        new_reading_level = min((initial_reading_level + word_value), 500)
-        user.previous_reading_level = initial_reading_level
-        user.reading_level = new_reading_level
-        user.save()
-        
-        # Add the time_reading (received from frontend) to total_reading_time
+        # Validate the time_reading (received from frontend) before anything is changed
         try:
             time_reading_seconds = int(time_reading)
-            session.total_reading_time += timedelta(seconds=time_reading_seconds)
-        except ValueError:
+        except (TypeError, ValueError):
             return Response({'error': 'Invalid time_reading value.'}, status=400)
 
-        session.save()
+        # Row-locked, so a match result applied meanwhile (e.g. by a match job) isn't overwritten and the rollups see
+        # the session as it is - save() recomputes story_progress from the current position, so it's written
+        with transaction.atomic():
+            try:
+                session = ReadingSession.objects.select_for_update(of=('self', 'user')).select_related(
+                    'user', 'story',
+                ).get(id=session_id)
+            except ReadingSession.DoesNotExist:
+                return Response({'error': 'Session not found.'}, status=404)
+            session.end_datetime = timezone.now()
+            
+            # Update the user's reading level upon completion of a story
+            user = session.user
+            story = session.story
+            difficulty_level = story.difficulty_level
+            initial_reading_level = user.reading_level
+            story_length = len(story.fulltext)
+            
+            difficulty_multipliers = {
+                "easy": 2,
+                "medium": 4,
+                "hard": 5
+            }
+            
+            multiplier = difficulty_multipliers.get(difficulty_level, 2)  # Default to 2 if difficulty_level is not found
+
+            level_factor = 1 - (initial_reading_level / 500)  # Decreases from 1 to 0 as level approaches 500
+            word_value = (story_length / 100) * multiplier * level_factor
+            new_reading_level = min((initial_reading_level + word_value), 500)
+            user.previous_reading_level = initial_reading_level
+            user.reading_level = new_reading_level
+
+            # Save both, with the reading rollups
+            user.save(update_fields=['previous_reading_level', 'reading_level'])
+            record_reading_level_change(user, initial_reading_level)
+
+            # Add the time_reading to total_reading_time
+            before = session_totals(session)
+            session.total_reading_time += timedelta(seconds=time_reading_seconds)
+            session.save(update_fields=['end_datetime', 'total_reading_time', 'story_progress'])
+            record_session_change(user.id, before, session_totals(session))
         
 
         return Response({'message': 'Session ended and time updated successfully.'}, status=200)
@@ -520,13 +791,21 @@ class ReadingSessionViewSet(viewsets.ModelViewSet):
         time_reading = request.data.get('time_reading')
 
         try:
-            session = ReadingSession.objects.get(id=session_id)
-        except ReadingSession.DoesNotExist:
-            return Response({'error': 'Session not found.'}, status=404)
+            time_reading_seconds = int(time_reading)
+        except (TypeError, ValueError):
+            return Response({'error': 'Invalid time_reading value.'}, status=400)
         
         # Add the time_reading (received from frontend) to total_reading_time
-        session.total_reading_time += timedelta(seconds=int(time_reading))
-        session.save()
+        # Row-locked, as in end_session
+        with transaction.atomic():
+            try:
+                session = ReadingSession.objects.select_for_update().get(id=session_id)
+            except ReadingSession.DoesNotExist:
+                return Response({'error': 'Session not found.'}, status=404)
+            before = session_totals(session)
+            session.total_reading_time += timedelta(seconds=time_reading_seconds)
+            session.save(update_fields=['total_reading_time', 'story_progress'])
+            record_session_change(session.user_id, before, session_totals(session))
 
         return Response({'message': 'Session paused and time updated successfully.'}, status=200)
     
@@ -618,6 +897,7 @@ class ReadingSessionViewSet(viewsets.ModelViewSet):
 
         with transaction.atomic():
             session = ReadingSession.objects.select_for_update().get(id=session_id)
+            before = session_totals(session)
             
             # Update the current position
             current_position = session.current_position
@@ -627,6 +907,7 @@ class ReadingSessionViewSet(viewsets.ModelViewSet):
             session.current_position = max(0, previous_position)
 
             session.save()
+            record_session_change(session.user_id, before, session_totals(session))
 
         return JsonResponse({'message': 'Sentence position updated successfully.'})
 
@@ -635,6 +916,11 @@ class ReadingSessionViewSet(viewsets.ModelViewSet):
 class ClassViewSet(viewsets.ModelViewSet):
     queryset = Class.objects.all()
     serializer_class = ClassSerializer
+
+    # Every class starts with an empty reading rollup
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            create_class_rollup(serializer.save())
     
     # Function to allow a teacher to create a class
     @action(detail=False, methods=["post"])
@@ -645,7 +931,7 @@ class ClassViewSet(viewsets.ModelViewSet):
         # Create and save the new class
         serializer = ClassSerializer(data={'class_code': class_code, 'teacher': request.user.id})
         if serializer.is_valid():
-            serializer.save()
+            self.perform_create(serializer)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -658,19 +944,18 @@ class ClassViewSet(viewsets.ModelViewSet):
         if (teacher.role!='teacher'): 
             return Response({'error': 'You are not authorized to view students.'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Get all classes taught by this teacher
-        classes = Class.objects.filter(teacher=teacher)
-        
-        # Get all students in these classes
-        students = Student.objects.filter(class_code__in=classes)
+        # Get all students in the classes taught by this teacher (one joined query)
+        students = Student.objects.filter(class_code__teacher=teacher).values(
+            'reader__username', 'class_code__class_code', 'reader__reading_level',
+        )
         
         # Prepare data for response
         student_data = []
         for student in students:
             student_data.append({
-                'username': student.reader.username,
-                'class_code': student.class_code.class_code,  # Change to 'class_code' if you prefer ID
-                'reading_level': student.reader.reading_level  # Adjust if the reading level is stored elsewhere
+                'username': student['reader__username'],
+                'class_code': student['class_code__class_code'],
+                'reading_level': student['reader__reading_level']
             })
         
         return Response({'students': student_data})
@@ -684,23 +969,93 @@ class ClassViewSet(viewsets.ModelViewSet):
         if teacher.role != 'teacher': 
             return Response({'error': 'You are not authorized to view classes.'}, status=status.HTTP_403_FORBIDDEN)
         
-        # Get all classes taught by this teacher
-        classes = Class.objects.filter(teacher=teacher)
+        # Get all classes taught by this teacher, with their student counts (one grouped query)
+        classes = Class.objects.filter(teacher=teacher).annotate(num_students=Count('student'))
         
         # Prepare data for response
         class_data = []
         for studentclass in classes:
-            numstudents = Student.objects.filter(class_code=studentclass).count()
             class_data.append({
-                'class_code': studentclass.class_code,  # Missing comma added here
-                'num_students': numstudents
+                'class_code': studentclass.class_code,
+                'num_students': studentclass.num_students
             })
         
         return Response({'classes': class_data})
+
+    # Return a teacher's whole dashboard - classes with their student counts, and each student's reading level,
+    # last reading session and progress - in two queries however many classes and students there are
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        teacher = request.user
+
+        # Ensure the user is a teacher
+        if teacher.role != 'teacher':
+            return Response({'error': 'You are not authorized to view classes.'}, status=status.HTTP_403_FORBIDDEN)
+
+        classes = Class.objects.filter(teacher=teacher).annotate(num_students=Count('student')).order_by('class_code')
+
+        # Each student's most recent reading session: its id is picked by one correlated subquery, and the session
+        # (and its story) joined in on that id
+        latest_sessions = ReadingSession.objects.filter(user=OuterRef('reader')).order_by('-start_datetime', '-id')
+        students = Student.objects.filter(class_code__teacher=teacher).annotate(
+            latest_session_id=Subquery(latest_sessions.values('id')[:1]),
+            last_session=FilteredRelation(
+                'reader__readingsession', condition=Q(reader__readingsession__id=F('latest_session_id')),
+            ),
+        ).values(
+            'class_code_id', 'reader_id', 'reader__username', 'reader__reading_level',
+            last_session_id=F('last_session__id'), last_story_id=F('last_session__story_id'), last_story_title=F('last_session__story__title'),
+            last_session_start=F('last_session__start_datetime'), last_session_end=F('last_session__end_datetime'),
+            last_session_progress=F('last_session__story_progress'),
+        ).order_by('reader__username')
+
+        class_students = {}
+        for student in students:
+            last_session = None
+            if student['last_session_id'] is not None:
+                last_session = {
+                    'id': student['last_session_id'],
+                    'story_id': student['last_story_id'],
+                    'story_title': student['last_story_title'],
+                    'start_datetime': student['last_session_start'],
+                    'end_datetime': student['last_session_end'],
+                    'story_progress': student['last_session_progress'],
+                }
+            class_students.setdefault(student['class_code_id'], []).append({
+                'id': student['reader_id'],
+                'username': student['reader__username'],
+                'reading_level': student['reader__reading_level'],
+                'last_session': last_session,
+            })
+
+        class_data = []
+        for studentclass in classes:
+            class_data.append({
+                'class_code': studentclass.class_code,
+                'num_students': studentclass.num_students,
+                'students': class_students.get(studentclass.id, []),
+            })
+
+        return Response({'classes': class_data})
     
 class StudentViewSet(viewsets.ModelViewSet):
     queryset = Student.objects.all()
     serializer_class = StudentSerializer
+
+    # Move a reader's sessions and reading level in and out of their classes' reading rollups
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            record_enrolment(serializer.save())
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            record_enrolment(serializer.instance, sign=-1)
+            record_enrolment(serializer.save())
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            record_enrolment(instance, sign=-1)
+            instance.delete()
     
     # Function to allow a reader to join a class   
     @action(detail=False, methods=["post"])
@@ -721,7 +1076,9 @@ class StudentViewSet(viewsets.ModelViewSet):
                 return Response({"message": "You are already enrolled in this class"}, status=status.HTTP_200_OK)
 
             # If not, create a new student entry
-            student = Student.objects.create(class_code=class_instance, reader=request.user)
+            with transaction.atomic():
+                student = Student.objects.create(class_code=class_instance, reader=request.user)
+                record_enrolment(student)
 
             # Serialize the newly created student
             serializer = self.get_serializer(student)
@@ -0,0 +1,16 @@
+'''Gunicorn config - preloads the app (and the recognizer) in the master so workers share the model weights
+
+Run with:  RECOGNIZER_PRELOAD=True gunicorn readbackend.wsgi
+'''
+
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+# Threads per worker - concurrent requests in a worker are micro-batched when INFERENCE_BATCHING is on
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# Import the WSGI app (and warm the model) once, before forking
+preload_app = True
+
@@ -2,6 +2,7 @@
 ASGI config for readbackend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django; the streaming recognition WebSocket (see apps/users/streaming.py) is served directly.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
@@ -13,4 +14,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'readbackend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, since it uses the ORM
+from apps.users import streaming  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == streaming.PATH:
+            await streaming.match_audio_stream(scope, receive, send)
+        else:
+            # Reject unknown WebSocket paths (Django itself only speaks HTTP)
+            await receive()
+            await send({'type': 'websocket.close', 'code': 1000})
+        return
+    await django_application(scope, receive, send)
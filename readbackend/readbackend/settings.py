@@ -9,7 +9,7 @@ https://docs.djangoproject.com/en/5.0/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
-from decouple import config
+from decouple import config, Csv
 from pathlib import Path
 import os
 from datetime import timedelta
@@ -161,3 +161,138 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Caches - 'match_results' remembers verdicts of recently scored clips so client retries aren't re-scored or double-counted
+# (per-process memory by default; point it at a shared cache such as Redis to dedupe across workers)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'match_results': {
+        'BACKEND': config('MATCH_CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('MATCH_CACHE_LOCATION', default='match-results'),
+        'TIMEOUT': config('MATCH_CACHE_TTL', default=600, cast=int),  # Seconds
+        'OPTIONS': {
+            'MAX_ENTRIES': config('MATCH_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        },
+    },
+}
+
+# Seconds a clip stays claimed while it is scored - concurrent retries of it wait for that verdict instead of
+# scoring it again (the claim expires if the request scoring it dies)
+MATCH_CACHE_CLAIM_TIMEOUT = config('MATCH_CACHE_CLAIM_TIMEOUT', default=120, cast=int)
+
+
+# Logging - surface the apps' own INFO messages (e.g. model load timings) on the console
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'apps': {
+            'handlers': ['console'],
+            'level': config('APPS_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
+
+
+# Speech recognition
+# The model is loaded lazily on the first /match-audio/ request (see apps/users/recognizer.py)
+# facebook/wav2vec2-lv-60-espeak-cv-ft seems to transcribe more accurately -- Still need to work on alignment either way
+RECOGNIZER_MODEL_NAME = config('RECOGNIZER_MODEL_NAME', default='facebook/wav2vec2-xlsr-53-espeak-cv-ft')
+# Reading languages: a story's language picks its espeak voice and recognizer model. Both mappings are
+# comma-separated language=value pairs (e.g. "en=en-us,af=af"); a language without a voice entry is used as the voice
+# name, and one without a model entry uses RECOGNIZER_MODEL_NAME (multilingual)
+READING_DEFAULT_LANGUAGE = config('READING_DEFAULT_LANGUAGE', default='en')
+ESPEAK_VOICES = config(
+    'ESPEAK_VOICES', default='en=en-us', cast=Csv(cast=lambda item: item.split('=', 1), post_process=dict),
+)
+RECOGNIZER_LANGUAGE_MODELS = config(
+    'RECOGNIZER_LANGUAGE_MODELS', default='', cast=Csv(cast=lambda item: item.split('=', 1), post_process=dict),
+)
+# The languages a story may be in - the default and every language given a voice or a model above
+READING_LANGUAGES = sorted({READING_DEFAULT_LANGUAGE, *ESPEAK_VOICES, *RECOGNIZER_LANGUAGE_MODELS})
+# Loaded recognizer models are evicted least recently used first once their weights exceed this budget (the main
+# model always stays loaded)
+RECOGNIZER_MEMORY_BUDGET_MB = config('RECOGNIZER_MEMORY_BUDGET_MB', default=4096, cast=int)
+# Recognizer backend: 'torch' (Wav2Vec2ForCTC), 'onnx' (ONNX Runtime, see the export_onnx command) or 'whisper'
+# (faster-whisper / CTranslate2 word transcription; RECOGNIZER_MODEL_NAME then only supplies the phoneme vocabulary,
+# and the cascade, micro-batching, inference pool and streaming endpoint - which need CTC output - are unavailable)
+# Compare backends on labelled clips with the benchmark_recognizers command
+RECOGNIZER_BACKEND = config('RECOGNIZER_BACKEND', default='torch')
+RECOGNIZER_WHISPER_MODEL = config('RECOGNIZER_WHISPER_MODEL', default='base.en')
+RECOGNIZER_WHISPER_COMPUTE_TYPE = config('RECOGNIZER_WHISPER_COMPUTE_TYPE', default='int8')
+RECOGNIZER_WHISPER_LANGUAGE = config('RECOGNIZER_WHISPER_LANGUAGE', default='en')
+# Exported ONNX model used by the 'onnx' backend
+RECOGNIZER_ONNX_PATH = config('RECOGNIZER_ONNX_PATH', default=str(BASE_DIR / 'resources' / 'models' / 'recognizer.int8.onnx'))
+# Intra-op threads per process (torch or ONNX Runtime) - keep workers x threads <= cores
+RECOGNIZER_TORCH_THREADS = config('RECOGNIZER_TORCH_THREADS', default=1, cast=int)
+# Load and warm the model in the WSGI master before gunicorn forks its workers (see gunicorn.conf.py)
+RECOGNIZER_PRELOAD = config('RECOGNIZER_PRELOAD', default=False, cast=bool)
+# Two-tier recognizer cascade: a small, fast phoneme model scores each clip first, and the full model only runs when
+# the fast model's CTC confidence is below RECOGNIZER_CASCADE_MIN_CONFIDENCE or its score is within
+# RECOGNIZER_CASCADE_MARGIN of the pass mark. /health/metrics/ counts how often each tier decided
+RECOGNIZER_CASCADE = config('RECOGNIZER_CASCADE', default=False, cast=bool)
+RECOGNIZER_FAST_MODEL_NAME = config('RECOGNIZER_FAST_MODEL_NAME', default='bookbot/wav2vec2-ljspeech-gruut')
+RECOGNIZER_CASCADE_MIN_CONFIDENCE = config('RECOGNIZER_CASCADE_MIN_CONFIDENCE', default=0.8, cast=float)
+RECOGNIZER_CASCADE_MARGIN = config('RECOGNIZER_CASCADE_MARGIN', default=0.1, cast=float)
+# How readings are scored: 'alignment' (CTC forced alignment, per-word results) or 'levenshtein' (whole sentence only)
+READING_SCORER = config('READING_SCORER', default='alignment')
+# A word passes when its goodness-of-pronunciation score is at least WORD_SCORE_THRESHOLD (0-1); a sentence counts as
+# read unless more than MATCH_WORD_TOLERANCE of its words failed
+WORD_SCORE_THRESHOLD = config('WORD_SCORE_THRESHOLD', default=0.5, cast=float)
+MATCH_WORD_TOLERANCE = config('MATCH_WORD_TOLERANCE', default=0.25, cast=float)
+# Long clips are run through the model in RECOGNIZER_CHUNK_SECONDS windows overlapping by RECOGNIZER_CHUNK_OVERLAP_SECONDS
+# on each side, so memory per request stays bounded; uploads longer than AUDIO_MAX_SECONDS are rejected
+RECOGNIZER_CHUNK_SECONDS = config('RECOGNIZER_CHUNK_SECONDS', default=20, cast=float)
+RECOGNIZER_CHUNK_OVERLAP_SECONDS = config('RECOGNIZER_CHUNK_OVERLAP_SECONDS', default=2, cast=float)
+AUDIO_MAX_SECONDS = config('AUDIO_MAX_SECONDS', default=120, cast=float)
+# Voice-activity trimming before inference: frames quieter than VAD_DYNAMIC_RANGE_DB below the loudest frame (or within
+# VAD_NOISE_MARGIN_DB of the noise floor) are silence. Leading / trailing silence is cut (keeping VAD_PADDING_MS),
+# internal pauses are shortened to VAD_MAX_PAUSE_MS, and clips with too little speech are rejected
+VAD_ENABLED = config('VAD_ENABLED', default=True, cast=bool)
+VAD_DYNAMIC_RANGE_DB = config('VAD_DYNAMIC_RANGE_DB', default=40, cast=float)
+VAD_NOISE_MARGIN_DB = config('VAD_NOISE_MARGIN_DB', default=6, cast=float)
+VAD_MIN_PEAK_DB = config('VAD_MIN_PEAK_DB', default=-50, cast=float)  # dBFS
+VAD_MIN_SPEECH_MS = config('VAD_MIN_SPEECH_MS', default=200, cast=int)
+VAD_PADDING_MS = config('VAD_PADDING_MS', default=200, cast=int)
+VAD_MAX_PAUSE_MS = config('VAD_MAX_PAUSE_MS', default=600, cast=int)
+# Micro-batch concurrent /match-audio/ requests into one forward pass (needs a threaded server, e.g. gunicorn --threads)
+INFERENCE_BATCHING = config('INFERENCE_BATCHING', default=False, cast=bool)
+INFERENCE_MAX_BATCH_SIZE = config('INFERENCE_MAX_BATCH_SIZE', default=8, cast=int)
+INFERENCE_MAX_WAIT_MS = config('INFERENCE_MAX_WAIT_MS', default=10, cast=int)
+# Dedicated inference worker pool (manage.py run_inference_pool). When INFERENCE_POOL_ADDRESS is set, web workers
+# send decoded audio to the pool over this local socket instead of running the model in request threads
+INFERENCE_POOL_ADDRESS = config('INFERENCE_POOL_ADDRESS', default='')
+INFERENCE_POOL_AUTHKEY = config('INFERENCE_POOL_AUTHKEY', default=SECRET_KEY)
+INFERENCE_POOL_WORKERS = config('INFERENCE_POOL_WORKERS', default=2, cast=int)
+# Seconds a worker may spend on one task before it's considered hung and restarted
+INFERENCE_POOL_TIMEOUT = config('INFERENCE_POOL_TIMEOUT', default=30, cast=int)
+# Async /match-audio/ jobs: background scoring threads per process, and the longest a result poll may block
+MATCH_JOB_WORKERS = config('MATCH_JOB_WORKERS', default=2, cast=int)
+MATCH_JOB_MAX_WAIT = config('MATCH_JOB_MAX_WAIT', default=25, cast=int)
+# Seconds after which a job that is still pending / running is failed - its worker process was recycled or died
+MATCH_JOB_TIMEOUT = config('MATCH_JOB_TIMEOUT', default=120, cast=int)
+# Streaming recognition over WebSocket (ASGI only): how often partial results are computed, how much
+# already-decoded audio is re-fed as left context, and how close to the live edge frames are treated as final
+STREAMING_STEP_MS = config('STREAMING_STEP_MS', default=500, cast=int)
+STREAMING_CONTEXT_MS = config('STREAMING_CONTEXT_MS', default=1000, cast=int)
+STREAMING_LOOKAHEAD_MS = config('STREAMING_LOOKAHEAD_MS', default=500, cast=int)
+# Size of the in-process LRU (per language) of espeak-ng phonemizations for text that isn't in a story's phoneme index
+PHONEME_CACHE_SIZE = config('PHONEME_CACHE_SIZE', default=4096, cast=int)
+# Size of the in-process LRU of lytspel respellings served by the pronunciation endpoints
+PRONUNCIATION_CACHE_SIZE = config('PRONUNCIATION_CACHE_SIZE', default=8192, cast=int)
+# Most words the bulk pronunciation endpoint respells in one request
+PRONUNCIATION_MAX_WORDS = config('PRONUNCIATION_MAX_WORDS', default=200, cast=int)
+# Sentences returned by the story bundle prefetch endpoint by default, and at most
+STORY_BUNDLE_SENTENCES = config('STORY_BUNDLE_SENTENCES', default=5, cast=int)
+STORY_BUNDLE_MAX_SENTENCES = config('STORY_BUNDLE_MAX_SENTENCES', default=50, cast=int)
+# Stories per page of the story rankings by default, and at most (also the most a ?top= list returns)
+STORY_RANKING_PAGE_SIZE = config('STORY_RANKING_PAGE_SIZE', default=20, cast=int)
+STORY_RANKING_MAX_PAGE_SIZE = config('STORY_RANKING_MAX_PAGE_SIZE', default=100, cast=int)
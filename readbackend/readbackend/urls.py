@@ -35,7 +35,11 @@ router.register(r'students', views.StudentViewSet)
 
 urlpatterns = [
     path('match-audio/', views.AudioMatchView.as_view(), name='match-audio'),
+    path('match-audio/jobs/<uuid:job_id>/', views.MatchJobView.as_view(), name='match-audio-job'),
     path('get-pronunciation/', views.PronunciationView.as_view(), name='get-pronunciation'),
+    path('get-pronunciations/', views.BulkPronunciationView.as_view(), name='get-pronunciations'),
+    path('health/ready/', views.ReadinessView.as_view(), name='health-ready'),
+    path('health/metrics/', views.MetricsView.as_view(), name='health-metrics'),
     path('api/token/', views.CustomTokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('', include(router.urls)),
@@ -7,10 +7,21 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/wsgi/
 """
 
+import gc
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'readbackend.settings')
 
 application = get_wsgi_application()
+
+# Preload mode (gunicorn --preload, see gunicorn.conf.py): load and warm the recognizer in the master before
+# workers fork, so every worker shares one copy of the weights copy-on-write
+if settings.RECOGNIZER_PRELOAD:
+    from apps.users.recognizer import warm_up
+
+    warm_up()
+    # Move everything allocated so far out of the GC's reach so collections in the workers don't dirty shared pages
+    gc.freeze()